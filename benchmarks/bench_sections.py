@@ -0,0 +1,87 @@
+#!/usr/bin/python
+""" Microbenchmarks for parser.split_sections() and the backend parsers built on it.
+
+Each case generates a synthetic tool output and reports the best of --repeat runs, in
+milliseconds, for the splitter alone and for the backend parser that consumes it.
+
+    PYTHONPATH=. python benchmarks/bench_sections.py [-n 1000]
+"""
+
+from cStringIO import StringIO
+from optparse import OptionParser
+import logging
+import sys
+import time
+
+from mrchecker import megaraid, zpool, threeware
+from mrchecker.parser import Section, Boundary, END, split_sections
+
+from generate import make_pdlist, make_zpool_status, make_tw_show
+
+__version__ = '1.0'
+
+
+def best(func, text, repeat):
+    times = list()
+    for run in range(repeat):
+        stdout = StringIO(text)
+        started = time.time()
+        func(stdout)
+        times.append(time.time() - started)
+    return min(times) * 1000
+
+
+def consume(records):
+    for record in records:
+        pass
+
+
+def main(argv):
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-n', '--count', type='int', default=1000,
+                      help='disks (or vdevs, or ports) in each generated output')
+    parser.add_option('-r', '--repeat', type='int', default=10,
+                      help='runs per case - the best one is reported')
+    (options, args) = parser.parse_args(argv[1:])
+
+    logging.basicConfig(level=logging.WARNING)
+    count = options.count
+
+    pdlist = make_pdlist(count)
+    status = make_zpool_status(count)
+    tw_show = make_tw_show(count)
+
+    mr = megaraid.MegaRaid('MegaCli64')
+    zp = zpool.ZPool('zpool')
+    tw = threeware.Threeware('tw_cli')
+
+    pdlist_sections = [Section('entries', megaraid.tables['disks'], blank='break')]
+    cases = [
+        ('lines only (pdlist)', pdlist, lambda stdout: consume(stdout)),
+        ('split_sections, no spec (pdlist)', pdlist,
+         lambda stdout: consume(split_sections(stdout, [Section('entries')], [megaraid.exit_code]))),
+        ('split_sections (pdlist)', pdlist,
+         lambda stdout: consume(split_sections(stdout, pdlist_sections, [megaraid.exit_code], skip=3))),
+        ('MegaRaid._parse_adapter_tables', pdlist,
+         lambda stdout: mr._parse_adapter_tables(stdout, 'disks')),
+        ('split_sections (zpool status)', status,
+         lambda stdout: consume(split_sections(stdout, zpool.status_sections, zpool.status_boundaries))),
+        ('ZPool._parse_zpool_status', status,
+         lambda stdout: zp._parse_zpool_status(stdout, 'status')),
+        ('Threeware._parse_controller_details', tw_show,
+         lambda stdout: tw._parse_controller_details(stdout, ('c0', ('units', 'ports', 'bbus')))),
+        ]
+
+    print '%-40s %10s %10s' % ('case (n=%s)' % count, 'ms', 'lines/ms')
+    for (name, text, func) in cases:
+        ms = best(func, text, options.repeat)
+        print '%-40s %10.2f %10.0f' % (name, ms, text.count('\n') / max(ms, 0.001))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+
+## END OF LINE ##
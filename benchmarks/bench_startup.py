@@ -0,0 +1,110 @@
+#!/usr/bin/python
+""" How long mrchecker takes to start - every run a fresh python, like a cron job's.
+
+    python benchmarks/bench_startup.py [-r 20] [--budget 50] [--program dist/mrchecker]
+
+Each case is run --repeat times, and the best and the median are reported, and what they
+are over a bare python -c pass - the part mrchecker can do something about:
+
+  version     mrchecker-cli --version: the imports every run has, and the option parsing
+  linuxsw     --linuxsw --sysfs --check-all against a generated /proc and /sys tree: a whole
+              check that never starts a program, so the time is all mrchecker's own
+  dump        the same with --dump-details, which imports pprint too
+
+and how many modules each run imported (from python -v). The .pyc files are as they are
+- run it twice, or build the zipapp (make zipapp) and pass it as --program, to see a start
+with no compiling in it.
+
+--budget MS (50) fails the run - exit 1 - if the best linuxsw run is more than MS over the
+bare interpreter. That is the target for a cold start: what a host running a check every
+minute pays for it, on top of python itself.
+"""
+
+from optparse import OptionParser
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+__version__ = '1.0'
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+top = os.path.dirname(here)
+
+
+def timed_runs(args, repeat, env):
+    # (best, median) seconds of repeat runs of args
+    devnull = open(os.devnull, 'w')
+    try:
+        times = list()
+        for run in range(repeat):
+            started = time.time()
+            rc = subprocess.call(args, stdout=devnull, stderr=devnull, env=env)
+            times.append(time.time() - started)
+            if rc != 0:
+                raise Exception('%s exited with %s' % (' '.join(args), rc))
+    finally:
+        devnull.close()
+    times.sort()
+    return (times[0], times[len(times) / 2])
+
+
+def count_modules(args, env):
+    # python -v says "import x # ..." for every module it imports
+    proc = subprocess.Popen([args[0], '-v'] + args[1:], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    (stdout, stderr) = proc.communicate()
+    return len([line for line in stderr.splitlines() if line.startswith('import ')])
+
+
+def main(argv):
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-r', '--repeat', type='int', default=20,
+                      help='runs of each case [default: %default]')
+    parser.add_option('--program', default=os.path.join(top, 'mrchecker-cli'),
+                      help='the mrchecker to start [default: %default]')
+    parser.add_option('--budget', type='float', default=50.0, metavar='MS',
+                      help='exit 1 if the linuxsw case is more than MS over a bare python [default: %default]')
+    (options, args) = parser.parse_args(argv[1:])
+
+    env = dict(os.environ)
+    env.pop('PYTHONPATH', None)     # the program finds its own mrchecker
+
+    directory = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        root = generate.write_sysfs(os.path.join(directory, 'sysfs'), 16)
+        program = [sys.executable, options.program]
+        linuxsw = program + ['--linuxsw', '--sysfs', '--sysfs-root', root, '--check-all']
+        cases = [('python', [sys.executable, '-c', 'pass']),
+                 ('version', program + ['--version']),
+                 ('linuxsw', linuxsw),
+                 ('dump', linuxsw + ['--dump-details'])]
+
+        print 'python %s, %s, best and median of %d runs' % (sys.version.split()[0], options.program, options.repeat)
+        print '%-10s %9s %9s %9s %8s' % ('case', 'best ms', 'median ms', 'over ms', 'modules')
+        results = dict()
+        for (name, args) in cases:
+            (best, median) = timed_runs(args, options.repeat, env)
+            results[name] = best
+            print '%-10s %9.1f %9.1f %9.1f %8d' % (name, best * 1000, median * 1000,
+                                                  (best - results['python']) * 1000, count_modules(args, env))
+    finally:
+        shutil.rmtree(directory)
+
+    over = (results['linuxsw'] - results['python']) * 1000
+    if over > options.budget:
+        print 'OVER BUDGET: linuxsw took %.1fms over python, the budget is %.1fms' % (over, options.budget)
+        return 1
+    print 'within budget: linuxsw took %.1fms over python, the budget is %.1fms' % (over, options.budget)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+
+## END OF LINE ##
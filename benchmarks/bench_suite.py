@@ -0,0 +1,457 @@
+#!/usr/bin/python
+""" The benchmark suite - parse throughput, end to end run time and peak memory.
+
+    PYTHONPATH=. python benchmarks/bench_suite.py [-n 1000] [-k REGEX]
+        [--json results.json] [--label 1.0.1] [--compare old.json] [--tolerance 0.10]
+
+There are three groups of cases:
+
+  split   every parser.row_*_split function, and TableSpec.split() on the same table, over
+          n rows of the table it was written for
+  parse   every backend _parse_* method, over the outputs in tests/corpus/ and over generated
+          outputs of n disks (or arrays, or pools - see generate.py)
+  run     setup() + check_all() + teardown() of each backend and collection mode, with
+          simulator.py standing in for its tool, on a healthy machine of n disks
+
+Every case runs in a process of its own, so the peak RSS (ru_maxrss) reported for it - and
+how much that grew while the case ran - are its own. Throughput is rows (records parsed,
+or disks checked) per second, from the best of --repeat runs.
+
+--json writes the results where a later run can --compare against them: any case more
+than --tolerance slower than it was is listed, and the exit code is 1. The JSON needs
+python 2.6 or later; the rest runs wherever mrchecker does.
+"""
+
+from optparse import OptionParser
+import cPickle
+import logging
+import os
+import platform
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from mrchecker import megaraid, threeware, areca, linuxsw, zpool
+from mrchecker import parser as parsers
+from mrchecker.parser import TableSpec
+
+import generate
+
+__version__ = '1.0'
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+# the captured outputs the behaviour checks in tests/ use too - one corpus, not two to keep in step
+corpus_directory = os.path.join(os.path.dirname(here), 'tests', 'corpus')
+tools = ['MegaCli64', 'cli64', 'tw_cli', 'mdadm', 'zpool']
+
+
+def read_corpus(name):
+    f = open(os.path.join(corpus_directory, name))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class Replayed(object):
+    # What areca's _parse_table() reads from - the lines() of a cli64 session, here over a
+    # recorded output. Each table carries on where the last one stopped, as in a session.
+    def __init__(self, lines):
+        self.iter = iter(lines)
+
+    def lines(self):
+        return self.iter
+
+
+def count_records(result, depth=1):
+    # records in a dict of records (depth 1), a dict of dicts of them (depth 2)...
+    if depth == 1:
+        return len(result)
+    return sum([count_records(value, depth - 1) for value in result.values()])
+
+
+# Cases
+
+def split_cases(count):
+    # (name, spec, function, line) - each is timed over count copies of its line
+    pdlist_line = 'Inquiry Data:      9QG000042ST3500320NS                          SN06'
+    port_line = 'p42    OK               u5     465.76 GB   976773168     9QG00042'
+    disk_line = generate.make_cli64_disk_info(48).splitlines()[-3]
+    cntrs_line = generate.make_cli64_start(1).splitlines()[5]
+    cases = list()
+    for (name, spec, line) in [('row_whitespace_split', threeware.tables['ports'], port_line),
+                               ('row_hybrid_split', areca.tables['ARC-1680']['disks'], disk_line),
+                               ('row_fixed_split', areca.tables['cntrs'], cntrs_line),
+                               ('row_delimiter_split', megaraid.tables['disks'], pdlist_line)]:
+        split = getattr(parsers, name)
+        if name == 'row_whitespace_split':
+            arg = spec['fields_list']
+        else:
+            arg = spec
+        # the same table, compiled
+        compiled = TableSpec(split, **dict([(key, value) for (key, value) in spec.spec.items()
+                                            if key not in ('row_split', 'record')]))
+        lines = [line] * count
+        cases.append(('split', name, count, make_splitter(split, arg, lines)))
+        cases.append(('split', 'TableSpec.split (%s)' % name, count, make_splitter(compiled.split, None, lines)))
+    return cases
+
+
+def make_splitter(split, arg, lines):
+    if arg is None:
+        def run():
+            for line in lines:
+                split(line)
+    else:
+        def run():
+            for line in lines:
+                split(line, arg)
+    return run
+
+
+def parse_cases(count):
+    """ (name, corpus file, generated text, parse(lines) -> result, rows(result)) for every
+    backend parser. """
+    mr = megaraid.MegaRaid('MegaCli64')
+    mr_lazy = megaraid.MegaRaid('MegaCli64')
+    mr_lazy.lazy = True
+    tw = threeware.Threeware('tw_cli')
+    ar = areca.Areca('cli64')
+    md = linuxsw.LinuxSW('mdadm')
+    md_lazy = linuxsw.LinuxSW('mdadm')
+    md_lazy.lazy = True
+    zp = zpool.ZPool('zpool')
+
+    counts = generate.controller_counts(count)
+    twctrls = ['c%d' % n for n in range(len(counts))]
+    spare = generate.disks_per_array
+
+    def areca_tables(table):
+        # one table per controller, back to back - as a session reads them
+        def parse(lines):
+            proc = Replayed(lines)
+            d = dict()
+            while True:
+                try:
+                    d[len(d)] = ar._parse_table(proc, areca.tables['ARC-1680'][table])
+                except Exception:
+                    # out of output - the last table has been read
+                    return d
+        return parse
+
+    return [
+        ('MegaRaid._parse_controller_subdetail (disks)', 'megacli-pdlist.txt', generate.make_pdlist(count),
+         lambda lines: mr._parse_controller_subdetail(lines, (0, 'disks')), count_records),
+        ('MegaRaid._parse_controller_subdetail (disks, lazy)', 'megacli-pdlist.txt', generate.make_pdlist(count),
+         lambda lines: mr_lazy._parse_controller_subdetail(lines, (0, 'disks')), count_records),
+        ('MegaRaid._parse_controller_subdetail (volumes)', 'megacli-ldinfo.txt', generate.make_ldinfo(count / spare),
+         lambda lines: mr._parse_controller_subdetail(lines, (0, 'volumes')), count_records),
+        ('MegaRaid._parse_controller_subdetail (enclosures)', 'megacli-encinfo.txt',
+         generate.make_encinfo(max(1, count / 32)),
+         lambda lines: mr._parse_controller_subdetail(lines, (0, 'enclosures')), count_records),
+        ('MegaRaid._parse_adapter_tables (disks)', None, generate.make_pdlist_all(count),
+         lambda lines: mr._parse_adapter_tables(lines, 'disks'), lambda result: count_records(result, 2)),
+        ('MegaRaid._parse_adapter_tables (volumes)', None, generate.make_ldinfo_all(count),
+         lambda lines: mr._parse_adapter_tables(lines, 'volumes'), lambda result: count_records(result, 2)),
+        ('MegaRaid._parse_adapter_tables (enclosures)', None, generate.make_encinfo_all(count),
+         lambda lines: mr._parse_adapter_tables(lines, 'enclosures'), lambda result: count_records(result, 2)),
+
+        ('Threeware._parse_table (cntrs)', 'tw_cli-show.txt', generate.make_tw_ctrl_list(count),
+         lambda lines: tw._parse_table(lines, 'cntrs'), count_records),
+        ('Threeware._parse_controller_details', 'tw_cli-c0-show.txt', generate.make_tw_show(count),
+         lambda lines: tw._parse_controller_details(lines, ('c0', ('units', 'ports', 'bbus'))),
+         lambda result: count_records(result, 2)),
+        ('Threeware._parse_session_details', None,
+         ''.join(['//localhost> %s' % generate.make_tw_show(disks) for disks in counts]),
+         lambda lines: tw._parse_session_details(lines, twctrls), lambda result: count_records(result, 3)),
+
+        ('Areca._parse_table (cntrs)', 'cli64-start.txt', generate.make_cli64_start(len(counts)) + 'CLI> ' + generate.cli64_success,
+         lambda lines: ar._parse_table(Replayed(lines), areca.tables['cntrs']), count_records),
+        ('Areca._parse_table (raids)', 'cli64-rsf-info.txt',
+         ''.join([generate.make_cli64_rsf_info(disks) for disks in counts]), areca_tables('raids'), lambda result: count_records(result, 2)),
+        ('Areca._parse_table (volumes)', 'cli64-vsf-info.txt',
+         ''.join([generate.make_cli64_vsf_info(disks) for disks in counts]), areca_tables('volumes'), lambda result: count_records(result, 2)),
+        ('Areca._parse_table (disks)', 'cli64-disk-info.txt',
+         ''.join([generate.make_cli64_disk_info(disks) for disks in counts]), areca_tables('disks'), lambda result: count_records(result, 2)),
+        ('Areca._parse_table (sys)', 'cli64-sys-info.txt', generate.make_cli64_sys_info(),
+         areca_tables('sys'), lambda result: count_records(result, 2)),
+
+        ('LinuxSW._parse_array_table', 'mdadm-examine-scan.txt', generate.make_mdadm_scan(count),
+         lambda lines: md._parse_array_table(lines, linuxsw.tables['arrays']), count_records),
+        ('LinuxSW._parse_array_details', 'mdadm-detail.txt', generate.make_mdadm_detail(count),
+         lambda lines: md._parse_array_details(lines, '/dev/md0'), lambda result: len(result.disks)),
+        ('LinuxSW._parse_array_details (lazy)', 'mdadm-detail.txt', generate.make_mdadm_detail(count),
+         lambda lines: md_lazy._parse_array_details(lines, '/dev/md0'), lambda result: len(result.disks)),
+
+        ('ZPool._parse_zpool_table', 'zpool-list.txt', generate.make_zpool_list(count),
+         lambda lines: zp._parse_zpool_table(lines, zpool.tables['zpools']), count_records),
+        ('ZPool._parse_zpool_details', None, generate.zpool_status_section(count),
+         lambda lines: zp._parse_zpool_details(lines, 'tank'), lambda result: len(result['disks'])),
+        ('ZPool._parse_zpool_status', 'zpool-status.txt',
+         generate.make_zpool_status(count, max(1, count / (generate.disks_per_array * generate.arrays_per_pool))),
+         lambda lines: zp._parse_zpool_status(lines, 'status'),
+         lambda result: sum([len(pool['disks']) for pool in result.values()])),
+        ]
+
+
+def make_parser(parse, lines):
+    def run():
+        return parse(iter(lines))
+    return run
+
+
+def mdstat_case(count, directory):
+    # LinuxSW._read_mdstat reads /proc/mdstat itself - give it one of count arrays
+    root = os.path.join(directory, 'mdstat')
+    os.makedirs(os.path.join(root, 'proc'))
+    f = open(os.path.join(root, 'proc', 'mdstat'), 'w')
+    try:
+        f.write(generate.make_mdstat(count))
+    finally:
+        f.close()
+    md = linuxsw.LinuxSW('mdadm')
+    md.sysfs_root = root
+    return ('parse', 'LinuxSW._read_mdstat', count, md._read_mdstat)
+
+
+def run_cases(count, directory):
+    # setup() + check_all() + teardown() of a backend, against the simulated tools
+    bin = os.path.join(directory, 'bin')
+    os.makedirs(bin)
+    for tool in tools:
+        path = os.path.join(bin, tool)
+        f = open(path, 'w')
+        try:
+            f.write('#!/bin/sh\nMRCHECKER_SCENARIO=healthy MRCHECKER_SIM_DISKS=%d exec "%s" "%s" %s "$@"\n'
+                    % (count, sys.executable, os.path.join(here, 'simulator.py'), tool))
+        finally:
+            f.close()
+        os.chmod(path, 0755)
+
+    sysfs = {'use_sysfs': True, 'sysfs_root': generate.write_sysfs(os.path.join(directory, 'sysfs'), count)}
+    cases = list()
+    for (backend, tool, mode, options) in [(megaraid.MegaRaid, 'MegaCli64', None, {}),
+                                           (megaraid.MegaRaid, 'MegaCli64', 'batch', {'batch': True}),
+                                           (megaraid.MegaRaid, 'MegaCli64', 'lazy', {'lazy': True}),
+                                           (threeware.Threeware, 'tw_cli', None, {}),
+                                           (threeware.Threeware, 'tw_cli', 'batch', {'batch': True}),
+                                           (areca.Areca, 'cli64', None, {}),
+                                           (areca.Areca, 'cli64', 'batch', {'batch': True}),
+                                           (linuxsw.LinuxSW, 'mdadm', None, {}),
+                                           (linuxsw.LinuxSW, 'mdadm', 'sysfs', sysfs),
+                                           (zpool.ZPool, 'zpool', None, {}),
+                                           (zpool.ZPool, 'zpool', 'batch', {'batch': True}),
+                                           ]:
+        name = backend.__name__
+        if mode:
+            name = '%s (%s)' % (name, mode)
+        cases.append(('run', name, count, make_run(backend, os.path.join(bin, tool), options)))
+    return cases
+
+
+def make_run(backend, program, options):
+    def run():
+        controller = backend(program)
+        for (option, value) in options.items():
+            setattr(controller, option, value)
+        if not controller.setup():
+            raise Exception('setup() failed')
+        try:
+            rc = controller.check_all()
+        finally:
+            controller.teardown()
+        if rc != 0:
+            raise Exception('check_all() said %s - the generated machine should be healthy' % rc)
+    return run
+
+
+def all_cases(count, directory):
+    cases = split_cases(count)
+    for (name, corpus, text, parse, rows) in parse_cases(count):
+        for (source, text) in [(corpus, corpus and read_corpus(corpus)), ('n=%d' % count, text)]:
+            if not source:
+                continue
+            lines = text.splitlines(True)
+            run = make_parser(parse, lines)
+            # the parsers have to agree with the outputs - or we'd be timing a parse of nothing
+            found = rows(run())
+            if not found:
+                raise Exception('%s found nothing in %s' % (name, source))
+            cases.append(('parse', '%s [%s]' % (name, source), found, run))
+    cases.append(mdstat_case(count, directory))
+    cases.extend(run_cases(count, directory))
+    return cases
+
+
+# Measuring
+
+def measure(func, repeat, min_time=0.05):
+    # seconds per call, best of repeat - with enough calls in each repeat to take min_time
+    loops = 1
+    while True:
+        started = time.time()
+        for loop in xrange(loops):
+            func()
+        elapsed = time.time() - started
+        if elapsed >= min_time or loops >= 100000:
+            break
+        loops *= 10
+    times = [elapsed]
+    for run in range(repeat - 1):
+        started = time.time()
+        for loop in xrange(loops):
+            func()
+        times.append(time.time() - started)
+    return min(times) / loops
+
+
+def reset_peak_rss():
+    # A child starts with its parent's peak RSS - which takes in every case's input. Linux
+    # (4.0 on) lets us start the count again from what we're using now. Returns that.
+    try:
+        f = open('/proc/self/clear_refs', 'w')
+        try:
+            f.write('5')
+        finally:
+            f.close()
+        f = open('/proc/self/statm')
+        try:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def isolated(func, repeat):
+    """ measure() func in a child process. Returns (seconds, peak rss KB, rss growth KB). """
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            try:
+                before = reset_peak_rss()
+                seconds = measure(func, repeat)
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                data = cPickle.dumps((seconds, peak, max(0, peak - before)))
+            except Exception, ex:
+                data = cPickle.dumps(ex)
+            while data:
+                data = data[os.write(write_fd, data):]
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    chunks = list()
+    while True:
+        chunk = os.read(read_fd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    result = cPickle.loads(''.join(chunks))
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def compare(results, old, tolerance):
+    # the cases that got more than tolerance slower - (name, old seconds, new seconds)
+    before = dict([(result['name'], result['seconds']) for result in old['results']])
+    slower = list()
+    for result in results:
+        if before.get(result['name']) and result['seconds'] > before[result['name']] * (1 + tolerance):
+            slower.append((result['name'], before[result['name']], result['seconds']))
+    return slower
+
+
+def main(argv):
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-n', '--count', type='int', default=1000,
+                      help='disks (or arrays, or pools) in each generated output [default: %default]')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='runs per case - the best one is reported [default: %default]')
+    parser.add_option('-k', '--filter', metavar='REGEX',
+                      help='only the cases whose group/name matches REGEX')
+    parser.add_option('--json', metavar='FILE',
+                      help='write the results to FILE as JSON (- for stdout)')
+    parser.add_option('--label', default='',
+                      help='what was benchmarked - a release or a commit - recorded in the JSON')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare with the JSON results of an earlier run')
+    parser.add_option('--tolerance', type='float', default=0.10,
+                      help='how much slower a case can get before --compare fails [default: %default]')
+    (options, args) = parser.parse_args(argv[1:])
+
+    # the parsers log at debug level - and the run cases' teardowns at info
+    logging.basicConfig(level=logging.ERROR)
+    if options.json or options.compare:
+        import json
+
+    directory = tempfile.mkdtemp(prefix='mrchecker-bench-')
+    try:
+        cases = all_cases(options.count, directory)
+        if options.filter:
+            cases = [case for case in cases if re.search(options.filter, '%s/%s' % (case[0], case[1]))]
+
+        out = sys.stdout
+        if options.json == '-':
+            out = sys.stderr
+        out.write('%-6s %-62s %7s %12s %10s %10s %9s\n'
+                  % ('group', 'case (n=%d)' % options.count, 'rows', 'rows/s', 'ms', 'peak KB', '+KB'))
+        results = list()
+        for (group, name, rows, func) in cases:
+            (seconds, peak, growth) = isolated(func, options.repeat)
+            results.append(dict(group=group, name='%s/%s' % (group, name), rows=rows, seconds=seconds,
+                                rows_per_second=rows / max(seconds, 1e-9), peak_rss_kb=peak, rss_growth_kb=growth))
+            out.write('%-6s %-62s %7d %12.0f %10.3f %10d %9d\n'
+                      % (group, name[:62], rows, rows / max(seconds, 1e-9), seconds * 1000, peak, growth))
+            out.flush()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if options.json:
+        report = dict(label=options.label, count=options.count, repeat=options.repeat,
+                      time=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                      platform=platform.platform(), results=results)
+        if options.json == '-':
+            json.dump(report, sys.stdout, indent=1, sort_keys=True)
+            sys.stdout.write('\n')
+        else:
+            f = open(options.json, 'w')
+            try:
+                json.dump(report, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+
+    if options.compare:
+        f = open(options.compare)
+        try:
+            old = json.load(f)
+        finally:
+            f.close()
+        if old.get('count') != options.count:
+            sys.stderr.write('ERROR: %s was run with -n %s - compare with the same -n\n'
+                             % (options.compare, old.get('count')))
+            return 1
+        slower = compare(results, old, options.tolerance)
+        for (name, before, after) in slower:
+            sys.stderr.write('SLOWER %-62s %10.3f ms -> %10.3f ms (%+.0f%%)\n'
+                             % (name, before * 1000, after * 1000, (after / before - 1) * 100))
+        if slower:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+
+## END OF LINE ##
@@ -0,0 +1,452 @@
+""" Synthetic backend tool outputs, at any scale.
+
+Every make_* function returns the text a tool prints for one command, in the layout of the
+captured outputs in tests/corpus/ - but with as many disks, units, arrays or pools as
+asked for. tool_outputs() has a whole system's worth of them for simulator.py, so a
+backend can be run end to end against a few thousand disks.
+
+Raid cards are filled up controller by controller, disks_per_controller at a time, the way
+a real machine would be - an areca or 3ware table can't get much bigger than that anyway.
+"""
+
+import os
+
+__version__ = '1.0'
+
+
+disks_per_controller = 128
+disks_per_array = 8         # md raid6 arrays and raidz2 vdevs
+arrays_per_pool = 8
+
+
+def controller_counts(count):
+    # [disks on controller 0, disks on controller 1, ...] for count disks in all
+    counts = [disks_per_controller] * (count / disks_per_controller)
+    if count % disks_per_controller or not counts:
+        counts.append(count % disks_per_controller or 1)
+    return counts
+
+
+# MegaCli
+
+pdlist_entry = """Enclosure Device ID: %(enclosure)d
+Slot Number: %(slot)d
+Device Id: %(n)d
+Sequence Number: 2
+Media Error Count: 0
+Other Error Count: 0
+Predictive Failure Count: 0
+Last Predictive Failure Event Seq Number: 0
+PD Type: SATA
+Raw Size: 465.761 GB [0x3a386030 Sectors]
+Non Coerced Size: 465.261 GB [0x3a286030 Sectors]
+Coerced Size: 465.25 GB [0x3a280000 Sectors]
+Firmware state: Online
+SAS Address(0): 0x1221000000000000
+Connected Port Number: 0(path0)
+Inquiry Data:      9QG0%(n)05dST3500320NS                          SN06
+Foreign State: None
+Device Speed: 3.0Gb/s
+Link Speed: 3.0Gb/s
+Media Type: Hard Disk Device
+Drive Temperature :30C (86.00 F)
+
+"""
+
+ldinfo_entry = """Virtual Drive: %(n)d (Target Id: %(n)d)
+Name                :vol%(n)d
+RAID Level          : Primary-6, Secondary-0, RAID Level Qualifier-3
+Size                : 2.724 TB
+State               : Optimal
+Stripe Size         : 64 KB
+Number Of Drives    : 8
+Span Depth          : 1
+Default Cache Policy: WriteBack, ReadAheadNone, Direct, No Write Cache if Bad BBU
+Current Cache Policy: WriteBack, ReadAheadNone, Direct, No Write Cache if Bad BBU
+Access Policy       : Read/Write
+Disk Cache Policy   : Disk's Default
+
+"""
+
+encinfo_entry = """    Enclosure %(n)d:
+    Device ID                     : %(device)d
+    Number of Slots               : 32
+    Number of Power Supplies      : 2
+    Number of Fans                : 4
+    Number of Temperature Sensors : 1
+    Number of Alarms              : 0
+    Number of SIM Modules         : 1
+    Number of Physical Drives     : 32
+    Status                        : Normal
+    Position                      : 1
+    Connector Name                : Port 0 - 3
+
+"""
+
+
+def make_adpcount(adapters):
+    return '\nController Count: %d.\n\nExit Code: 0x%02x\n' % (adapters, adapters)
+
+
+def pdlist_section(count, adapter=0):
+    # one adapter's disks - an enclosure per 32 slots
+    entries = [pdlist_entry % dict(n=adapter * disks_per_controller + n, enclosure=252 - n / 32, slot=n % 32)
+               for n in range(count)]
+    return '                                     \nAdapter #%d\n\n%s' % (adapter, ''.join(entries))
+
+
+def make_pdlist(count, adapter=0):
+    # what MegaCli -pdlist -aN prints for one adapter with count disks
+    return pdlist_section(count, adapter) + '\nExit Code: 0x00\n'
+
+
+def ldinfo_section(count, adapter=0):
+    entries = [ldinfo_entry % dict(n=n) for n in range(count)]
+    return ('                                     \nAdapter %d -- Virtual Drive Information:\n%s'
+            % (adapter, ''.join(entries)))
+
+
+def make_ldinfo(count, adapter=0):
+    # MegaCli -ldinfo -lall -aN - count virtual drives
+    return ldinfo_section(count, adapter) + 'Exit Code: 0x00\n'
+
+
+def encinfo_section(count, adapter=0):
+    entries = [encinfo_entry % dict(n=n, device=252 - n) for n in range(count)]
+    return ('                                     \n    Number of enclosures on adapter %d -- %d\n\n%s'
+            % (adapter, count, ''.join(entries)))
+
+
+def make_encinfo(count, adapter=0):
+    # MegaCli -encinfo -aN - count enclosures
+    return encinfo_section(count, adapter) + 'Exit Code: 0x00\n'
+
+
+def make_pdlist_all(count):
+    # MegaCli -PDList -aALL for count disks over as many adapters as it takes
+    return (''.join([pdlist_section(disks, adapter) for (adapter, disks) in enumerate(controller_counts(count))])
+            + '\nExit Code: 0x00\n')
+
+
+def make_ldinfo_all(count):
+    return (''.join([ldinfo_section(max(1, disks / disks_per_array), adapter)
+                     for (adapter, disks) in enumerate(controller_counts(count))])
+            + 'Exit Code: 0x00\n')
+
+
+def make_encinfo_all(count):
+    return (''.join([encinfo_section((disks + 31) / 32, adapter)
+                     for (adapter, disks) in enumerate(controller_counts(count))])
+            + 'Exit Code: 0x00\n')
+
+
+# cli64 - each command's output is what follows the command in a session: the prompt, the
+# table framed by '='s and the GuiErrMsg line.
+
+cli64_success = 'GuiErrMsg<0x00>: Success.\n'
+cli64_clear = '\x1b[2J\x1b[1;1H'
+
+
+def make_cli64_start(controllers):
+    # the banner cli64 prints when it starts, with the controller list
+    rows = ['[%s] %-3d ARC-1680   Raid Controller  PCI' % ((n == 0 and '*') or ' ', n + 1)
+            for n in range(controllers)]
+    return ('Copyright (c) 2004-2011 Areca, Inc. All Rights Reserved.\n'
+            'Areca CLI, Version: 1.86, Arclib: 310, Date: Nov  1 2011( Linux )\n\n'
+            ' S  #   Name       Type             Interface\n'
+            '==================================================\n'
+            + ''.join(['%s\n' % row for row in rows]) +
+            '==================================================\n\n'
+            'CMD     Description\n'
+            '==========================================================\n'
+            'main    Show Command Categories.\n'
+            '==========================================================\n\n')
+
+
+def cli64_table(header, rows):
+    rule = '=' * 79
+    return ('CLI> %s%s\n%s\n%s%s\n%s'
+            % (cli64_clear, header, rule, ''.join(['%s\n' % row for row in rows]), rule, cli64_success))
+
+
+def make_cli64_rsf_info(count):
+    # rsf info - a raid set per disks_per_array disks
+    rows = ['%2d  %-18s%5d %8s %8s %10s %14s' % (n + 1, 'Raid Set # %03d' % n, disks_per_array,
+                                                 '4000.0GB', '0.0GB', '500.0GB', 'Normal')
+            for n in range(max(1, count / disks_per_array))]
+    return cli64_table(' #  Name             Disks TotalCap  FreeCap MinDiskCap         State', rows)
+
+
+def make_cli64_vsf_info(count):
+    # vsf info - a volume per raid set
+    rows = ['%3d %-17s%-16s%-7s %9s %-10s %s' % (n + 1, 'ARC-1680-VOL#%03d' % n, 'Raid Set # %03d' % n,
+                                                 'Raid6', '3000.0GB', '00/00/%02d' % n, 'Normal')
+            for n in range(max(1, count / disks_per_array))]
+    return cli64_table('  # Name             Raid Name       Level   Capacity Ch/Id/Lun  State', rows)
+
+
+def make_cli64_disk_info(count):
+    rows = ['%3d  %02d  %-8s%-33s%8s  %-16s' % (n + 1, 1 + n / 32, 'Slot#%d' % (n % 32 + 1),
+                                                'WDC WD5000AAKS-00V1A0', '500.1GB',
+                                                'Raid Set # %03d' % (n / disks_per_array))
+            for n in range(count)]
+    return cli64_table('  # Enc# Slot#   ModelName                        Capacity  Usage', rows)
+
+
+def make_cli64_sys_info():
+    return ('CLI> The System Information\n'
+            '===========================================\n'
+            'Main Processor     : 1200MHz\n'
+            'CPU ICache Size    : 32KB\n'
+            'CPU DCache Size    : 32KB\n'
+            'CPU SCache Size    : 512KB\n'
+            'System Memory      : 512MB/533MHz/ECC\n'
+            'Firmware Version   : V1.48 2010-10-21\n'
+            'BOOT ROM Version   : V1.48 2010-10-21\n'
+            'Serial Number      : Y123456789\n'
+            'Controller Name    : ARC-1680\n'
+            '===========================================\n'
+            + cli64_success)
+
+
+# tw_cli
+
+def make_tw_ctrl_list(count):
+    # tw_cli show - a 9650SE for every disks_per_controller drives
+    rows = ['c%-4d 9650SE-24M8  %-9d %-8d %-7d 0       1       1      OK      ' % (n, disks, disks, max(1, disks / disks_per_array))
+            for (n, disks) in enumerate(controller_counts(count))]
+    return ('\nCtl   Model        (V)Ports  Drives   Units   NotOpt  RRate   VRate  BBU\n'
+            '------------------------------------------------------------------------\n'
+            + ''.join(['%s\n' % row for row in rows]) + '\n')
+
+
+def make_tw_version():
+    # tw_cli show ver
+    return 'CLI Version = 2.00.11.016\nAPI Version = 2.08.00.017\n'
+
+
+def make_tw_unitstatus(count):
+    # /cN show unitstatus - a unit per disks_per_array ports
+    rows = ['u%-4d RAID-6    OK             -       -       64K     2793.9    ON     ON     ' % n
+            for n in range(max(1, count / disks_per_array))]
+    return ('\nUnit  UnitType  Status         %RCmpl  %V/I/M  Stripe  Size(GB)  Cache  AVrfy\n'
+            '------------------------------------------------------------------------------\n'
+            + ''.join(['%s\n' % row for row in rows]) + '\n')
+
+
+def make_tw_ports(count):
+    rows = ['p%-5d OK               u%-5d 465.76 GB   976773168     9QG0%05d' % (n, n / disks_per_array, n)
+            for n in range(count)]
+    return ('Port   Status           Unit   Size        Blocks        Serial\n'
+            '---------------------------------------------------------------\n'
+            + ''.join(['%s\n' % row for row in rows]) + '\n')
+
+
+def make_tw_drivestatus(count):
+    # /cN show drivestatus - just the port table
+    return '\n' + make_tw_ports(count)
+
+
+def make_tw_bbu():
+    return ('\nName  OnlineState  BBUReady  Status    Volt     Temp     Hours  LastCapTest\n'
+            '---------------------------------------------------------------------------\n'
+            'bbu   On           Yes       OK        OK       OK       255    01-Jan-2010  \n\n')
+
+
+def make_tw_show(count):
+    # tw_cli /cN show with count ports
+    return make_tw_unitstatus(count) + make_tw_ports(count) + make_tw_bbu()[1:]
+
+
+# mdadm and /proc/mdstat
+
+def make_mdadm_scan(arrays):
+    return ''.join(['ARRAY /dev/md%d level=raid6 num-devices=%d UUID=3a1e2a4f:5b2c7d1e:9f0a4b3c:%08x\n'
+                    % (n, disks_per_array, n) for n in range(arrays)])
+
+
+def disk_name(n):
+    # sda .. sdz, sdaa ..
+    name = ''
+    n += 1
+    while n:
+        (n, letter) = divmod(n - 1, 26)
+        name = chr(ord('a') + letter) + name
+    return 'sd' + name
+
+
+def make_mdadm_detail(count, array=0):
+    # mdadm --detail /dev/mdN for a raid6 of count disks
+    header = """/dev/md%(array)d:
+        Version : 1.2
+  Creation Time : Thu Jan  1 00:00:00 2009
+     Raid Level : raid6
+     Array Size : %(size)d (%(gib).2f GiB)
+  Used Dev Size : 488254464 (465.64 GiB 499.97 GB)
+   Raid Devices : %(count)d
+  Total Devices : %(count)d
+    Persistence : Superblock is persistent
+
+    Update Time : Thu Jan  1 00:00:00 2010
+          State : clean
+ Active Devices : %(count)d
+Working Devices : %(count)d
+ Failed Devices : 0
+  Spare Devices : 0
+
+         Layout : left-symmetric
+     Chunk Size : 512K
+
+           Name : host:%(array)d
+           UUID : 3a1e2a4f:5b2c7d1e:9f0a4b3c:%(array)08x
+         Events : 44
+
+    Number   Major   Minor   RaidDevice State
+"""
+    rows = ['    %4d     %3d      %3d      %4d      active sync   /dev/%s\n'
+            % (n, 8 + 57 * (n / 16), (n % 16) * 16 + 1, n, disk_name(array * count + n) + '1')
+            for n in range(count)]
+    size = 488254464 * max(1, count - 2)
+    return header % dict(array=array, count=count, size=size, gib=size / 1048576.0) + ''.join(rows)
+
+
+def make_mdstat(arrays):
+    lines = ['Personalities : [raid6] [raid5] [raid4] ']
+    for n in range(arrays):
+        members = ' '.join(['%s1[%d]' % (disk_name(n * disks_per_array + m), m) for m in range(disks_per_array)])
+        lines.append('md%d : active raid6 %s' % (n, members))
+        lines.append('      2929526784 blocks super 1.2 level 6, 512k chunk, algorithm 2 [%d/%d] [%s]'
+                     % (disks_per_array, disks_per_array, 'U' * disks_per_array))
+        lines.append('')
+    lines.append('unused devices: <none>')
+    return '\n'.join(lines) + '\n'
+
+
+# zpool
+
+def make_zpool_list(pools, exact=False):
+    if exact:
+        row = '%s\t1990000000000\t1300000000000\t690000000000\t66\tONLINE\t-\n'
+    else:
+        row = '%s\t1.81T\t1.2T\t600G\t66%%\tONLINE\t-\n'
+    return ''.join([row % pool_name(n) for n in range(pools)])
+
+
+def make_zpool_health(pools):
+    return ''.join(['%s\tONLINE\n' % pool_name(n) for n in range(pools)])
+
+
+def pool_name(n):
+    if n == 0:
+        return 'tank'
+    return 'tank%d' % n
+
+
+def zpool_status_section(count, pool='tank', first=0):
+    # one pool of count/2 mirrors, of the disks from number first on
+    lines = ['  pool: %s' % pool, ' state: ONLINE', ' scrub: none requested', 'config:', '',
+             '\tNAME        STATE     READ WRITE CKSUM',
+             '\t%-11s ONLINE       0     0     0' % pool]
+    for n in range(count / 2):
+        lines.append('\t  mirror-%d  ONLINE       0     0     0' % n)
+        for disk in [first + 2 * n, first + 2 * n + 1]:
+            lines.append('\t    %-7s ONLINE       0     0     0' % disk_name(disk))
+    lines.extend(['', 'errors: No known data errors'])
+    return '\n'.join(lines) + '\n'
+
+
+def make_zpool_status(count, pools=1):
+    # zpool status for count disks spread over pools pools
+    return '\n'.join([zpool_status_section(count / pools, pool_name(n), n * (count / pools))
+                      for n in range(pools)])
+
+
+# A whole system, for simulator.py
+
+def tool_outputs(tool, count):
+    """ What tool prints for every command it would be asked on a machine with count disks.
+    Returns a dict of command (or, for cli64, (context, command)) -> (make_* function, args...)
+    - call output() on one to get its text, so only the commands asked for are generated. """
+    counts = controller_counts(count)
+    arrays = max(1, count / disks_per_array)
+    pools = max(1, count / (disks_per_array * arrays_per_pool))
+    outputs = dict()
+
+    if tool == 'MegaCli64':
+        outputs['-adpcount'] = (make_adpcount, len(counts))
+        outputs['-PDList -aALL'] = (make_pdlist_all, count)
+        outputs['-LDInfo -Lall -aALL'] = (make_ldinfo_all, count)
+        outputs['-EncInfo -aALL'] = (make_encinfo_all, count)
+        for (adapter, disks) in enumerate(counts):
+            outputs['-pdlist -a%d' % adapter] = (make_pdlist, disks, adapter)
+            outputs['-ldinfo -lall -a%d' % adapter] = (make_ldinfo, max(1, disks / disks_per_array), adapter)
+            outputs['-encinfo -a%d' % adapter] = (make_encinfo, (disks + 31) / 32, adapter)
+
+    elif tool == 'cli64':
+        outputs['start'] = (make_cli64_start, len(counts))
+        for (n, disks) in enumerate(counts):
+            context = 'curctrl=%d' % (n + 1)
+            outputs[(context, 'set curctrl=%d' % (n + 1))] = (str, 'CLI> ' + cli64_success)
+            outputs[(context, 'rsf info')] = (make_cli64_rsf_info, disks)
+            outputs[(context, 'vsf info')] = (make_cli64_vsf_info, disks)
+            outputs[(context, 'disk info')] = (make_cli64_disk_info, disks)
+            outputs[(context, 'sys info')] = (make_cli64_sys_info,)
+
+    elif tool == 'tw_cli':
+        outputs['show'] = (make_tw_ctrl_list, count)
+        outputs['show ver'] = (make_tw_version,)
+        for (n, disks) in enumerate(counts):
+            outputs['/c%d show' % n] = (make_tw_show, disks)
+            outputs['/c%d show unitstatus' % n] = (make_tw_unitstatus, disks)
+            outputs['/c%d show drivestatus' % n] = (make_tw_drivestatus, disks)
+            outputs['/c%d/bbu show' % n] = (make_tw_bbu,)
+
+    elif tool == 'mdadm':
+        outputs['--examine --brief --scan --config=partition'] = (make_mdadm_scan, arrays)
+        for n in range(arrays):
+            outputs['--detail /dev/md%d' % n] = (make_mdadm_detail, disks_per_array, n)
+
+    elif tool == 'zpool':
+        outputs['list -H'] = (make_zpool_list, pools)
+        outputs['list -Hp -o name,size,allocated,free,capacity,health,altroot'] = (make_zpool_list, pools, True)
+        outputs['list -H -o name,health'] = (make_zpool_health, pools)
+        outputs['status'] = (make_zpool_status, count, pools)
+        for n in range(pools):
+            outputs['status %s' % pool_name(n)] = (zpool_status_section, count / pools, pool_name(n),
+                                                   n * (count / pools))
+
+    return outputs
+
+
+def output(entry):
+    # the text of one of tool_outputs()' entries
+    return entry[0](*entry[1:])
+
+
+def write_sysfs(root, count):
+    """ Write a /proc/mdstat and /sys/block/mdN/md tree under root, for linuxsw --sysfs on a
+    machine with count disks. Returns root. """
+    arrays = max(1, count / disks_per_array)
+    outputs = {'proc/mdstat': make_mdstat(arrays)}
+    for n in range(arrays):
+        md = 'sys/block/md%d/md' % n
+        for (name, value) in [('level', 'raid6'), ('array_state', 'clean'), ('raid_disks', disks_per_array),
+                              ('degraded', 0), ('sync_action', 'idle'), ('sync_completed', 'none')]:
+            outputs['%s/%s' % (md, name)] = '%s\n' % value
+        for m in range(disks_per_array):
+            member = '%s/dev-%s1' % (md, disk_name(n * disks_per_array + m))
+            outputs['%s/state' % member] = 'in_sync\n'
+            outputs['%s/slot' % member] = '%d\n' % m
+    for (path, text) in outputs.items():
+        path = os.path.join(root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+    return root
+
+
+## END OF LINE ##
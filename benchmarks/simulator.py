@@ -0,0 +1,317 @@
+#!/usr/bin/python
+""" Stand in for MegaCli64, cli64, tw_cli, mdadm or zpool, playing a scenario.
+
+    simulators/TOOL [ARGS...]
+    simulator.py TOOL [ARGS...]
+
+The tool is the name it is run as (simulators/ has a link to this for each of them), or
+the first argument. Point mrchecker-cli at it with --program:
+
+    MRCHECKER_SCENARIO=degraded ./mrchecker-cli --megaraid --program benchmarks/simulators/MegaCli64
+
+What it prints is generate.py's output for a machine of 16 disks (or the scenario's disks),
+changed by the scenario. MegaCli, mdadm and zpool answer their arguments and exit, and so
+does tw_cli when it has any. cli64, and tw_cli without arguments, are sessions: commands
+are read from stdin and answered until exit or quit - cli64 with its banner first and
+everything after a CLI> prompt, a clear screen escape and a GuiErrMsg<0x..> line, tw_cli
+after its //localhost> prompt. A command it doesn't know gets the error the tool gives.
+
+The environment picks what it plays:
+
+  MRCHECKER_SCENARIO      a name from scenarios/ (without the .scenario) or a path (healthy)
+  MRCHECKER_SIM_DISKS     the number of disks, instead of the scenario's
+  MRCHECKER_SIM_LATENCY   seconds before each answer, instead of the scenario's latency
+  MRCHECKER_SIM_JITTER    up to this many random seconds more, instead of the scenario's
+  MRCHECKER_SIM_LOG       a file to append "tool pid command" to for every command
+
+A scenario is lines of fields separated by " | " (# starts a comment). Settings:
+
+  disks | 16                  how big the machine is
+  latency | 0.05              seconds before each answer (cli64 and tw_cli: each command)
+  jitter | 0.02               plus up to this many random seconds
+  start | 5                   seconds before anything at all - a slow start
+  sigterm | ignore            carry on regardless of a SIGTERM (SIGKILL still works)
+
+and rules, for the commands of TOOL (or * for any) that REGEX is found in. A command is
+its arguments joined by spaces; in a cli64 session it has the controller set on it first,
+"[curctrl=1] rsf info", and the banner is the command "start".
+
+  edit | TOOL | REGEX | OLD | NEW [| COUNT]    re.sub(OLD, NEW) in the output, on the
+                                              first COUNT (1) matches - 0 for all of them
+  hang | TOOL | REGEX [| LINES]               print the first LINES (0) lines, then hang
+  garbage | TOOL | REGEX                      print junk instead - all but the last line
+  exit | TOOL | REGEX | CODE                  exit with CODE instead of answering
+
+Every edit that matches is made, in order; of the others, the first that matches wins.
+"""
+
+import errno
+import os
+import random
+import re
+import signal
+import sys
+import time
+
+import generate
+
+__version__ = '1.0'
+
+
+# run through a link in simulators/ - scenarios/ is next to the simulator itself
+here = os.path.dirname(os.path.realpath(__file__))
+
+tools = ['MegaCli64', 'cli64', 'tw_cli', 'mdadm', 'zpool']
+aliases = {'MegaCli': 'MegaCli64', 'cli32': 'cli64'}
+
+prompts = {'cli64': 'CLI> ', 'tw_cli': '//localhost> '}
+
+# what each tool says, and exits with, when it doesn't know the command
+unknown = {'MegaCli64': ('Invalid input at or near token %(first)s\n\nExit Code: 0x01\n', 1),
+           'cli64': ('CLI> GuiErrMsg<0x01>: Failed.\n', 0),
+           'tw_cli': ('Error: (CLI:001) Invalid command: %(command)s\n', 1),
+           'mdadm': ('mdadm: cannot open %(last)s: No such file or directory\n', 1),
+           'zpool': ("cannot open '%(last)s': no such pool\n", 1)}
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class Scenario(object):
+    settings = {'disks': int, 'latency': float, 'jitter': float, 'start': float, 'sigterm': str}
+    fields = {'edit': (5, 6), 'hang': (3, 4), 'garbage': (3, 3), 'exit': (4, 4)}
+
+    def __init__(self, path=None):
+        self.disks = 16
+        self.latency = 0.0
+        self.jitter = 0.0
+        self.start = 0.0
+        self.sigterm = 'default'
+        self.rules = list()     # (action, tool, regex, args)
+        if path:
+            self.read(path)
+
+
+    def read(self, path):
+        f = open(path)
+        try:
+            lines = f.readlines()
+        finally:
+            f.close()
+
+        for (number, line) in enumerate(lines):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            words = [word.strip() for word in line.split(' | ')]
+            where = '%s line %d' % (path, number + 1)
+            if words[0] in self.settings:
+                if len(words) != 2:
+                    raise ScenarioError('%s: %s takes one value' % (where, words[0]))
+                try:
+                    setattr(self, words[0], self.settings[words[0]](words[1]))
+                except ValueError:
+                    raise ScenarioError('%s: bad %s %s' % (where, words[0], words[1]))
+            elif words[0] in self.fields:
+                (least, most) = self.fields[words[0]]
+                if not least <= len(words) <= most:
+                    raise ScenarioError('%s: %s takes %d to %d fields' % (where, words[0], least, most))
+                try:
+                    regex = re.compile(words[2])
+                    if words[0] == 'edit':
+                        re.compile(words[3])
+                except re.error, ex:
+                    raise ScenarioError('%s: %s' % (where, ex))
+                self.rules.append((words[0], words[1], regex, words[3:]))
+            else:
+                raise ScenarioError('%s: no such setting or rule %s' % (where, words[0]))
+
+        if self.sigterm not in ('default', 'ignore'):
+            raise ScenarioError('%s: sigterm is default or ignore' % path)
+
+
+    def matching(self, tool, command):
+        return [(action, args) for (action, rule_tool, regex, args) in self.rules
+                if rule_tool in ('*', tool) and regex.search(command)]
+
+
+def load_scenario(name):
+    path = name
+    if not os.path.isfile(path) and os.sep not in name:
+        path = os.path.join(here, 'scenarios', name + '.scenario')
+    scenario = Scenario(path)
+
+    for (setting, variable) in [('disks', 'MRCHECKER_SIM_DISKS'), ('latency', 'MRCHECKER_SIM_LATENCY'),
+                                ('jitter', 'MRCHECKER_SIM_JITTER')]:
+        if os.environ.get(variable):
+            try:
+                setattr(scenario, setting, scenario.settings[setting](os.environ[variable]))
+            except ValueError:
+                raise ScenarioError('bad %s %s' % (variable, os.environ[variable]))
+    return scenario
+
+
+def garbage(text, seed):
+    # about as many lines of junk - with the odd broken escape and control character - and
+    # the real last line, so a reader waiting for a sentinel isn't left waiting for ever
+    rand = random.Random(seed)
+    lines = text.splitlines(True)
+    junk = list()
+    for n in range(max(20, len(lines) - 1)):
+        line = ''.join([chr(rand.randint(32, 126)) for i in range(rand.randint(0, 79))])
+        if rand.random() < 0.1:
+            line = line[:10] + rand.choice(['\x1b[', '\x1b[2', '\x00', '\r', '\x07', '\xff\xfe']) + line[10:]
+        junk.append(line + '\n')
+    return ''.join(junk) + ''.join(lines[-1:])
+
+
+class Simulator(object):
+    def __init__(self, tool, scenario):
+        self.tool = tool
+        self.scenario = scenario
+        self.outputs = generate.tool_outputs(tool, scenario.disks)
+        self.log = os.environ.get('MRCHECKER_SIM_LOG')
+
+
+    def answer(self, command, key):
+        """ What to print for command (looked up in the outputs as key), and the exit code
+        a scenario's exit rule wants - None to carry on. Hangs, if the scenario says to. """
+        if self.log:
+            f = open(self.log, 'a')
+            try:
+                f.write('%s %d %s\n' % (self.tool, os.getpid(), command))
+            finally:
+                f.close()
+
+        if key in self.outputs:
+            text = generate.output(self.outputs[key])
+        else:
+            words = command.split() or ['']
+            text = unknown[self.tool][0] % dict(command=command, first=words[0], last=words[-1])
+
+        for (action, args) in self.scenario.matching(self.tool, command):
+            if action == 'edit':
+                count = 1
+                if len(args) > 2:
+                    count = int(args[2])
+                text = re.sub(args[0], args[1], text, count)
+                continue
+            if action == 'exit':
+                return ('', int(args[0]))
+            if action == 'hang':
+                lines = 0
+                if args:
+                    lines = int(args[0])
+                self.hang(''.join(text.splitlines(True)[:lines]))
+            if action == 'garbage':
+                text = garbage(text, command)
+            break
+
+        self.wait(self.scenario.latency)
+        return (text, None)
+
+
+    def wait(self, seconds):
+        seconds += random.uniform(0, self.scenario.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+    def hang(self, text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        while True:
+            time.sleep(3600)
+
+
+    def run(self, args):
+        if self.scenario.sigterm == 'ignore':
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if self.scenario.start:
+            time.sleep(self.scenario.start)
+
+        if self.tool == 'cli64' or (self.tool == 'tw_cli' and not args):
+            return self.session()
+
+        command = ' '.join(args)
+        (text, code) = self.answer(command, command)
+        sys.stdout.write(text)
+        if code is not None:
+            return code
+        if command not in self.outputs:
+            return unknown[self.tool][1]
+        # MegaCli exits with what its Exit Code line says - -adpcount with the count
+        match = re.search(r'Exit Code: 0x([0-9a-fA-F]+)\s*$', text)
+        if self.tool == 'MegaCli64' and match:
+            return int(match.group(1), 16)
+        return 0
+
+
+    def session(self):
+        context = ''
+        if self.tool == 'cli64':
+            context = 'curctrl=1'
+            (text, code) = self.answer('start', 'start')
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            if code is not None:
+                return code
+
+        while True:
+            line = sys.stdin.readline()
+            if not line:
+                return 0
+            command = line.strip()
+            if command in ('exit', 'quit'):
+                return 0
+
+            key = command
+            if self.tool == 'cli64':
+                match = re.match(r'^set (curctrl=\d+)$', command)
+                if match and (match.group(1), command) in self.outputs:
+                    context = match.group(1)
+                key = (context, command)
+                command = '[%s] %s' % (context, command)
+
+            (text, code) = self.answer(command, key)
+            if code is not None:
+                sys.stdout.write(text)
+                return code
+            if self.tool == 'tw_cli':
+                text = prompts['tw_cli'] + text
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+
+def main(argv):
+    tool = os.path.basename(argv[0])
+    args = argv[1:]
+    tool = aliases.get(tool, tool)
+    if tool not in tools:
+        if not args or aliases.get(args[0], args[0]) not in tools:
+            sys.stderr.write('usage: %s {%s} [ARGS...]\n' % (argv[0], ','.join(tools)))
+            return 1
+        tool = aliases.get(args[0], args[0])
+        args = args[1:]
+
+    try:
+        scenario = load_scenario(os.environ.get('MRCHECKER_SCENARIO') or 'healthy')
+    except (IOError, ScenarioError), ex:
+        sys.stderr.write('%s: %s\n' % (tool, ex))
+        return 1
+
+    try:
+        return Simulator(tool, scenario).run(args)
+    except IOError, ex:
+        # whoever ran us has stopped listening
+        if ex.errno == errno.EPIPE:
+            return 1
+        raise
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+
+## END OF LINE ##
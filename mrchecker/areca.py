@@ -1,11 +1,11 @@
 import logging
-from subprocess import Popen, PIPE
-from pprint import pprint
 import re
 
-from raid_check.controller import Controller
-from raid_check.parser import row_hybrid_split, row_delimiter_split
-from raid_check.condition import Condition
+from mrchecker.controller import Controller, CommandTimeout, CommandFailed
+from mrchecker.parser import TableSpec, row_hybrid_split, row_delimiter_split
+from mrchecker.parser import Section, Boundary, END, split_sections
+from mrchecker.records import Disk, Volume, Array, number, state, size
+from mrchecker.condition import Condition
 
 __version__ = '1.2'
 
@@ -15,86 +15,118 @@ __version__ = '1.2'
 # I changed the layout of the 'tables' dictionary so that one model of controller
 # can re-use the settings from some other controller - a few of them are the same
 
+class ArecaArray(Array):
+    __slots__ = ()
+    layout = { 'number': ('name', str),
+               'status': ('state', state),
+               'disk count': ('total_devices', number),
+               'total capacity': ('size', size),
+               }
+
+
+class ArecaVolume(Volume):
+    __slots__ = ()
+    layout = { 'number': ('name', str),
+               'status': ('state', state),
+               'raid_level': ('level', state),
+               'capacity': ('size', size),
+               }
+
+
+class ArecaDisk(Disk):
+    __slots__ = ()
+    layout = { 'number': ('name', str),
+               'enclosure': ('enclosure', number),
+               'capacity': ('size', size),
+               'raid_name': ('unit', state),
+               }
+
+
 tables = {
-    'cntrs': { 'row_split': row_hybrid_split,
-               'name_field': 'controller_num',
-               'fields_list': [('controller_num', 4, 8),
-                               ('model', 8, 19),
-                               ('type', 19, 36),
-                               ('interface', 36, 50)
-                               ]
-               },
+    'cntrs': TableSpec(row_split=row_hybrid_split,
+                       name_field='controller_num',
+                       fields_list=[('controller_num', 4, 8),
+                                    ('model', 8, 19),
+                                    ('type', 19, 36),
+                                    ('interface', 36, 50)
+                                    ]
+                       ),
     }
 
 tables['ARC-1680'] = {
-    'raids': { 'row_split': row_hybrid_split,
-               'name_field': 'number',
-               'fields_list': [('number', 0),
-                               ('name', 4, 22),
-                               ('disk count', -5),
-                               ('total capacity', -4),
-                               ('free capacity', -3),
-                               ('mindiskcap', -2),
-                               ('status', -1),
-                               ]
-               },
-    'volumes': { 'row_split': row_hybrid_split,
-                 'name_field': 'number',
-                 'fields_list': [('number', 0),
-                                 ('volume_name', 4, 21),
-                                 ('raid_name', 21, 37),
-                                 ('raid_level', -4),
-                                 ('capacity', -3),
-                                 ('ch/id/lun', -2),
-                                 ('status', -1),
-                                 ]
-                 },
-    'disks': { 'row_split': row_hybrid_split,
-               'name_field': 'number',
-               'fields_list': [('number', 0),
-                               ('enclosure', 1),
-                               ('slot', 9, 17),
-                               ('modelname', 17, 50),
-                               ('capacity', 50, 60),
-                               ('raid_name', 60, -1),
-                               ],
-               },
-    'sys': { 'row_split': row_delimiter_split,
-             'delimiter': ':',
-             'name_field': 0,
-             'value_field': 1,
-             'strip_list': [None],
-             },
-    'hw': { 'row_split': row_delimiter_split,
-            'delimiter': ':',
-            'name_field': 0,
-            'value_field': 1,
-            'strip_list': [None],
-            },
+    'raids': TableSpec(row_split=row_hybrid_split,
+                       record=ArecaArray,
+                       name_field='number',
+                       fields_list=[('number', 0),
+                                    ('name', 4, 22),
+                                    ('disk count', -5),
+                                    ('total capacity', -4),
+                                    ('free capacity', -3),
+                                    ('mindiskcap', -2),
+                                    ('status', -1),
+                                    ]
+                       ),
+    'volumes': TableSpec(row_split=row_hybrid_split,
+                         record=ArecaVolume,
+                         name_field='number',
+                         fields_list=[('number', 0),
+                                      ('volume_name', 4, 21),
+                                      ('raid_name', 21, 37),
+                                      ('raid_level', -4),
+                                      ('capacity', -3),
+                                      ('ch/id/lun', -2),
+                                      ('status', -1),
+                                      ]
+                         ),
+    'disks': TableSpec(row_split=row_hybrid_split,
+                       record=ArecaDisk,
+                       name_field='number',
+                       fields_list=[('number', 0),
+                                    ('enclosure', 1),
+                                    ('slot', 9, 17),
+                                    ('modelname', 17, 50),
+                                    ('capacity', 50, 60),
+                                    ('raid_name', 60, -1),
+                                    ],
+                       ),
+    'sys': TableSpec(row_split=row_delimiter_split,
+                     delimiter=':',
+                     name_field=0,
+                     value_field=1,
+                     strip_list=[None],
+                     ),
+    'hw': TableSpec(row_split=row_delimiter_split,
+                    delimiter=':',
+                    name_field=0,
+                    value_field=1,
+                    strip_list=[None],
+                    ),
     }
 
 tables['ARC-1231'] = {
-    'raids': { 'row_split': row_hybrid_split,
-               'name_field': 'number',
-               'fields_list': [('number', 0),
-                               ('name', 4, 22),
-                               ('disk count', -5),
-                               ('total capacity', -4),
-                               ('free capacity', -3),
-                               ('disk channels', -2),
-                               ('status', -1),
-                               ]
-               },
+    'raids': TableSpec(row_split=row_hybrid_split,
+                       record=ArecaArray,
+                       name_field='number',
+                       fields_list=[('number', 0),
+                                    ('name', 4, 22),
+                                    ('disk count', -5),
+                                    ('total capacity', -4),
+                                    ('free capacity', -3),
+                                    ('disk channels', -2),
+                                    ('status', -1),
+                                    ]
+                       ),
     'volumes': tables['ARC-1680']['volumes'],
-    'disks': { 'row_split': row_hybrid_split,
-               'name_field': 'number',
-               'fields_list': [('number', 0),
-                               ('channel', 1),
-                               ('modelname', 8, 40),
-                               ('capacity', 40, 50),
-                               ('raid_name', 50, -1),
-                               ],
-               },
+    'disks': TableSpec(row_split=row_hybrid_split,
+                       record=ArecaDisk,
+                       name_field='number',
+                       fields_list=[('number', 0),
+                                    ('channel', 1),
+                                    ('modelname', 8, 40),
+                                    ('capacity', 40, 50),
+                                    ('raid_name', 50, -1),
+                                    ],
+                       ),
     'sys': tables['ARC-1680']['sys'],
     'hw': tables['ARC-1680']['hw'],
 }
@@ -102,45 +134,142 @@ tables['ARC-1231'] = {
 tables['ARC-1220'] = tables['ARC-1231']
 
 
+# cli64 command for each of the per-controller tables, in the order we ask for them.
+commands = [('raids', 'rsf info'),
+            ('volumes', 'vsf info'),
+            ('disks', 'disk info'),
+            ('sys', 'sys info'),
+            ]
+
+# The tables that hardly ever change - the disk models and capacities, and the firmware. They
+# aren't asked for on every run if we keep an inventory.
+inventory_tables = ['disks', 'sys']
+
+success = 'GuiErrMsg<0x00>: Success.'
+
+# a table is framed by lines of '='s - and every command's output ends with a GuiErrMsg
+table_boundaries = [Boundary('GuiErrMsg<', END, mark=True),
+                    Boundary(re.compile('^=+'), 'table', within=['head']),
+                    Boundary(re.compile('^=+'), 'tail', within=['table']),
+                    ]
+
+
 program_list = ['cli64', 'cli32']
 
 class Areca(Controller):
 
+    single_flight = True
+    inventory_attrs = ['inventory']
+    selectable_tables = [table for (table, command) in commands]
+    table_aliases = { 'raids': 'arrays' }
+
     def __init__(self, program_name):
         super(Areca, self).__init__(program_name, program_list)
         log = logging.getLogger('Controller.Areca.init')
         self.details = dict()
+        self.proc = None
 
         log.debug('Controller.Areca.init ending')
         
-    def setup(self):
-        log = logging.getLogger('Controller.Areca.setup')
+    def collect(self):
+        log = logging.getLogger('Controller.Areca.collect')
+
+        # Keep using the cli64 session we already have (--daemon mode) - unless its gone away on us.
+        if self.proc and self.proc.poll() is not None:
+            log.warning('%s (pid %s) exited with %s - restarting it'
+                        % (self.program, self.proc.pid, self.proc.poll()))
+            self.proc = None
+
+        if not self.proc:
+            if not self._start():
+                return False
+            # cli64 only prints the controller list when it starts up, so hang on to it
+            self.summary = self._get_controller_list()
+
+        ctrls = [ctrl for ctrl in self.summary.keys() if self.wanted_controller(ctrl)]
+        if not ctrls:
+            log.error('none of the selected controllers were found')
+            return False
+        ctrls.sort()
+
+        inventory = self.tiered() and self.load_inventory()
+        if inventory:
+            known = self.inventory.keys()
+            known.sort()
+            if ctrls != known:
+                self.inventory_changed('the controllers are now %s' % ', '.join(ctrls))
+                inventory = False
+
+        self.details = dict()
+        for ctrl in ctrls:
+            if inventory:
+                names = [table for (table, command) in commands if table not in inventory_tables]
+            else:
+                names = None
+            self.details[ctrl] = self._get_controller_details(ctrl, self.summary[ctrl]['model'], names)
+            self.details[ctrl]['summary'] = self.summary[ctrl]
+
+        if inventory and self._in_trouble():
+            # we want to see the disks as they are now
+            self.inventory_changed('a raid set or volume is not Normal')
+            inventory = False
+            for ctrl in ctrls:
+                self.details[ctrl].update(self._get_controller_details(ctrl, self.summary[ctrl]['model'],
+                                                                       inventory_tables))
+
+        if inventory:
+            for ctrl in ctrls:
+                self.details[ctrl].update(self.inventory[ctrl])
+        elif self.tiered():
+            self.inventory = dict()
+            for ctrl in ctrls:
+                self.inventory[ctrl] = dict([(table, self.details[ctrl][table])
+                                             for table in inventory_tables if table in self.details[ctrl]])
+            self.save_inventory()
+        return True
+
+
+    def _in_trouble(self):
+        for ctrl in self.details.keys():
+            for table in ['raids', 'volumes']:
+                for detail in self.details[ctrl].get(table, {}).values():
+                    if detail.state != 'Normal':
+                        return True
+        return False
+
+
+    def _start(self):
+        log = logging.getLogger('Controller.Areca.start')
 
         # start the areca specific backend program
-        log.debug('running cmd "%s"' % self.program)
-        try:
-            self.proc = Popen(self.program, shell=False, stdin=PIPE, stdout=PIPE, bufsize=0)
-            log.debug('pid = %s' % self.proc.pid)
-        except OSError, ex:
-            log.exception('Specified backend command not found')
+        self.proc = self.start_command([self.program], stdin=True)
+        if not self.proc:
             return False
 
-        summary = self._get_controller_list()
-        for ctrl in summary.keys():
-            self.details[ctrl] = self._get_controller_details(ctrl, summary[ctrl]['model'])
-            self.details[ctrl]['summary'] = summary[ctrl]
-        return True 
+        log.debug('pid = %s' % self.proc.pid)
+        return True
 
 
     def teardown(self):
         log = logging.getLogger('Controller.Areca.teardown')
 
-        # We're done with our backend command line tool
-        # finally we get to use subprocess.communicate()
-        log.debug('shutting down backend program')
-        self.proc.communicate('exit')
+        # We're done with our backend command line tool - if we ever started it (the
+        # details may have come from the cache).
+        if not self.proc:
+            return
 
-        # Fixme: we need to record the pid, and in here kill it if its somehow still alive.
+        # Ask it nicely - stop() kills it if that doesn't work (or it had timed out already).
+        log.debug('shutting down backend program')
+        if self.proc.poll() is None:
+            self.proc.write('exit\n')
+            self.proc.close()
+            try:
+                for line in self.proc.lines():
+                    pass
+            except CommandTimeout, ex:
+                log.warning('%s did not exit: %s' % (self.program, ex))
+        self.proc.stop()
+        self.proc = None
 
         
     def check_all(self):
@@ -150,101 +279,134 @@ class Areca(Controller):
         return cond.state
 
 
+    def quick_check(self):
+        log = logging.getLogger('controller.quick_check')
+        cond = Condition()
+
+        # Just rsf info on each controller - the raid sets. A controller with a raid set in
+        # trouble is as far as we go, and then cli64 gets killed rather than asked to exit.
+        if not self._start():
+            return None
+        summary = self._get_controller_list()
+        ctrls = 0
+        for ctrl in summary.keys():
+            if not self.wanted_controller(ctrl):
+                continue
+            ctrls += 1
+            self.proc.write('set curctrl=%s\n' % ctrl)
+            self._parse_table(self.proc, None)
+            self.proc.write('rsf info\n')
+            sections = [Section('head'),
+                        Section('table', tables[summary[ctrl]['model']]['raids'], strip=False),
+                        Section('tail')]
+            status = None
+            for (section, record) in split_sections(self._read_lines(self.proc), sections,
+                                                    table_boundaries):
+                if section == END:
+                    status = record.line
+                    continue
+                (raid, detail) = record
+                if detail.state != 'Normal':
+                    cond.error()
+                    log.error('controller %s raid unit %s is not ok with status %s'
+                              % (ctrl, raid, detail.state))
+                    break
+            if cond.state == Condition.ERROR:
+                break
+            self._check_status(self.proc, status)
+
+        if cond.state == Condition.ERROR:
+            self.proc.stop(terminate=True)
+            self.proc = None
+        else:
+            self.teardown()
+
+        if not ctrls:
+            log.error('%s found no (selected) controllers' % self.program)
+            return None
+        return cond.state
+
+
     def _get_controller_list(self):
         log = logging.getLogger('controller.getlist')
         log.debug('starting getlist')
 
         # We blindly set the current controller to 1, as any system should have at least one controller -
         # this forces cli64 to print out the GuiErrMsg we can stop parsing on.
-        self.proc.stdin.write('set curctrl=1\n')
-        info = self._parse_table(self.proc.stdout, tables['cntrs'])
+        self.proc.write('set curctrl=1\n')
+        info = self._parse_table(self.proc, tables['cntrs'])
 
         log.debug('end of getlist')
         return info
 
 
-    def _parse_table(self, stdout, table_spec):
-        log = logging.getLogger('_parse_table')
-        
-        d = dict()
-        seperator = re.compile('=+')
-        
-        state = 'HEAD'        # state machine, states are "HEAD", "TABLE", "TAIL"
-                              # start at HEAD, transition each time you see a line of '='s, only one way
-        
-        log.debug('starting parse loop:')
-        while True:
-            line = stdout.readline().rstrip()
-        
+    def _read_lines(self, proc):
+        for line in proc.lines():
             # FIXME: hard coded assumption from looking at cli64 - if we contain the esc char, delete the first 10 as thats
             # the code for clearing the screen and repositioning to the origin.
             # What we should do is find esc's, and then consume the string to the first char in range 64-126.
             if line.count(chr(27)):
                 line = line[10:]
-                
-            log.debug('current line: "%s"' % line)
-                
-            # Do this before we enter the state machine proper, as we don't care about which state we're in -
-            # if we see this, we're done, regardless.
-            if line.count('GuiErrMsg<0x00>: Success.'):
-                break
+            yield line
 
-            if state == 'HEAD':
-                #log.debug('state = HEAD')
-                if seperator.match(line):
-                    log.debug('  seperator line - changing state to TABLE')
-                    state = 'TABLE'
-                    continue
-                else:
-                    # ignore this line
-                    log.debug('  trash line - ignoring it and looping')
-                    continue
-            elif state == 'TABLE':
-                log.debug('state = TABLE')
-                if seperator.match(line):
-                    log.debug('  seperator line - changing state to TAIL')
-                    state = 'TAIL'
-                    continue
-                else:
-                    log.debug('  table row - adding to dict')
-                    (name, value) = table_spec['row_split'](line, table_spec)
-                    d[name] = value
-            elif state == 'TAIL':
-                log.debug('state = TAIL')
-                log.debug('  trash line - ignoring it and looping')
+
+    def _parse_table(self, proc, table_spec):
+        log = logging.getLogger('_parse_table')
+        
+        # The table is between two lines of '='s, with trash before and after it. Whatever
+        # the command, its output ends with a GuiErrMsg line. A table_spec of None just
+        # reads the output of a command up to there.
+        sections = [Section('head'), Section('table', table_spec, strip=False), Section('tail')]
+        d = dict()
+        status = None
+
+        for (section, record) in split_sections(self._read_lines(proc), sections, table_boundaries):
+            if section == END:
+                status = record.line
             else:
-                log.debug('parse error - invalid state reached -- raising exception')
-                raise Exception('parse error - invalid state reached')
+                d[record[0]] = record[1]
 
+        self._check_status(proc, status)
         return d
 
 
-    def _get_controller_details(self, ctrl, ctrl_model):
+    def _check_status(self, proc, status):
+        # status is the GuiErrMsg line a command's output ended with - None if it didn't get that far
+        if status is not None and status.count(success):
+            return
+
+        # whatever cli64 says next won't be the answer to what we ask it - start over with
+        # a new one (collect() does, when it sees this one has gone)
+        proc.stop(terminate=True)
+        if status is None:
+            raise CommandFailed('parse error - output ended before %s' % success)
+        raise CommandFailed('%s failed: %s' % (self.program, status))
+
+
+    def _get_controller_details(self, ctrl, ctrl_model, names=None):
         log = logging.getLogger('controller.getdetails')
         log.debug('starting getdetails')
 
+        # all the tables selected - or just those of them named
         d = dict()
-
-        log.debug('attempting write set ctrl to %s' % ctrl)
-        self.proc.stdin.write('set curctrl=%s\n' % ctrl)
+        wanted = [(table, command) for (table, command) in commands
+                  if self.wanted_table(table) and (names is None or table in names)]
+
+        if self.batch:
+            # Pipeline the whole lot - one write, then read the output of each command in turn.
+            batch = ['set curctrl=%s' % ctrl] + [command for (table, command) in wanted]
+            log.debug('writing batch %s' % batch)
+            self.proc.write(''.join(['%s\n' % command for command in batch]))
+        else:
+            log.debug('attempting write set ctrl to %s' % ctrl)
+            self.proc.write('set curctrl=%s\n' % ctrl)
         # we need to consume the output up to the GuiErrMsg so that _parse_table() will work
-        while True:
-            line = self.proc.stdout.readline()
-            if line.count('GuiErrMsg<0x00>: Success.'):
-                break
-
-        # FIXME: this could be a loop based on the table - one more field to contain the command.
-        self.proc.stdin.write('rsf info\n')
-        d['raids'] = self._parse_table(self.proc.stdout, tables[ctrl_model]['raids'])
+        self._parse_table(self.proc, None)
 
-        self.proc.stdin.write('vsf info\n')
-        d['volumes'] = self._parse_table(self.proc.stdout, tables[ctrl_model]['volumes'])
-
-        self.proc.stdin.write('disk info\n')
-        d['disks'] = self._parse_table(self.proc.stdout, tables[ctrl_model]['disks'])
-
-        self.proc.stdin.write('sys info\n')
-        d['sys'] = self._parse_table(self.proc.stdout, tables[ctrl_model]['sys'])
+        for (table, command) in wanted:
+            if not self.batch:
+                self.proc.write('%s\n' % command)
+            d[table] = self._parse_table(self.proc, tables[ctrl_model][table])
 
         return d
 
@@ -255,24 +417,26 @@ class Areca(Controller):
         cond = Condition(Condition.OK)
 
 #        pprint(self.details)
+        # A table that wasn't selected (--only) wasn't collected - hence the get()s.
+
         # check the raid units themselves
-        for raid in self.details[ctrl]['raids'].keys():
+        for raid in self.details[ctrl].get('raids', {}).keys():
             detail = self.details[ctrl]['raids'][raid]
-            if detail['status'] != 'Normal':
+            if detail.state != 'Normal':
                 cond.error()
                 log.error('controller %s raid unit %s is not ok with status %s' 
-                          % (ctrl, raid, detail['status'])) 
+                          % (ctrl, raid, detail.state)) 
 
     #    for disk in details['disks'].keys():
     #        detail = details['disks'][disk]
     #        # On areca, I don't see a per-disk status yet.        
 
-        for volume in self.details[ctrl]['volumes'].keys():
+        for volume in self.details[ctrl].get('volumes', {}).keys():
             detail = self.details[ctrl]['volumes'][volume]
-            if detail['status'] != 'Normal':
+            if detail.state != 'Normal':
                 cond.error()
                 log.error('controller %s volume %s is not ok with status %s' 
-                          % (ctrl, volume, detail['status'])) 
+                          % (ctrl, volume, detail.state)) 
 
         return cond.state
 
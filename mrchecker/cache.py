@@ -0,0 +1,92 @@
+import cPickle
+import logging
+import os
+import re
+import time
+
+__version__ = '1.0'
+
+
+default_directory = '/var/cache/mrchecker'
+
+
+class ResultCache(object):
+    """ Parsed backend details kept in a local state directory, so that several consumers on
+    one host (cron, monitoring, someone running --dump-details) can share one run of a slow
+    raid tool.
+
+    Entries are written to a temporary file and renamed into place, so a reader only ever
+    sees a complete entry - the old one or the new one.
+    """
+
+    def __init__(self, directory=default_directory):
+        self.directory = directory
+
+
+    def path(self, key, suffix='.cache'):
+        # keys are things like ('MegaRaid', '/opt/MegaRAID/MegaCli/MegaCli64') - make a file name out of it
+        name = re.sub(r'[^A-Za-z0-9.-]+', '_', '-'.join([str(part) for part in key]))
+        return os.path.join(self.directory, name.strip('_') + suffix)
+
+
+    def get(self, key, max_age):
+        """ Return the entry stored under key, or None if there isn't one younger than max_age seconds
+        (of any age, for a max_age of None). """
+        log = logging.getLogger('ResultCache.get')
+
+        path = self.path(key)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except OSError:
+            log.debug('no cache entry %s' % path)
+            return None
+        if max_age is not None and age > max_age:
+            log.debug('cache entry %s is %.1fs old - too old' % (path, age))
+            return None
+
+        try:
+            f = open(path, 'rb')
+            try:
+                entry = cPickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, cPickle.UnpicklingError), ex:
+            log.warning('unreadable cache entry %s: %s' % (path, ex))
+            return None
+
+        log.debug('using cache entry %s (%.1fs old)' % (path, age))
+        return entry
+
+
+    def put(self, key, entry):
+        """ Store entry under key. Returns False (having logged why) if it couldn't be written. """
+        log = logging.getLogger('ResultCache.put')
+        import tempfile     # it pulls in random and more - only the runs that write pay for it
+
+        path = self.path(key)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0755)
+            (fd, tmppath) = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+            try:
+                f = os.fdopen(fd, 'wb')
+                try:
+                    cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    f.close()
+                os.chmod(tmppath, 0644)
+                os.rename(tmppath, path)
+            except:
+                os.unlink(tmppath)
+                raise
+        except (IOError, OSError), ex:
+            log.warning('could not write cache entry %s: %s' % (path, ex))
+            return False
+
+        log.debug('wrote cache entry %s' % path)
+        return True
+
+
+## END OF LINE ##
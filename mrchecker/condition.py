@@ -1,7 +1,7 @@
 
 
 class Condition(object):
-    (OK, WARNING, ERROR) = range(0,3)
+    (OK, WARNING, ERROR, TIMEOUT) = range(0,4)
 
     def __init__(self, initial=OK):
         self.state = initial
@@ -19,6 +19,9 @@ class Condition(object):
     def error(self, state=ERROR):
         self.set(state)
 
+    def timeout(self, state=TIMEOUT):
+        self.set(state)
+
     def __str__(self):
         if self.state == self.OK:
             return 'OK'
@@ -26,6 +29,8 @@ class Condition(object):
             return 'WARNING'
         elif self.state == self.ERROR:
             return 'ERROR'
+        elif self.state == self.TIMEOUT:
+            return 'TIMEOUT'
         else:
             raise Exception('invalid state')
 
@@ -1,15 +1,283 @@
+from collections import deque
+import errno
 import logging
+import os
 import os.path
+import select
+import signal
+import time
 
-from raid_check.condition import Condition
+from mrchecker.condition import Condition
+from mrchecker.parallel import run_parallel
+from mrchecker.records import as_dicts
+from mrchecker import histogram, timing
 
 paths = ['/usr/sbin', '/usr/bin', '/sbin', '/bin' ] 
 
+
+def find_exec(name):
+    for path in paths:
+        pathname = os.path.join(path, name)
+        if os.path.exists(pathname):
+            return pathname
+
+    return None
+
+
+class CommandTimeout(Exception):
+    """ A backend program didn't finish (or answer) in time - it has been stopped. """
+
+
+class CommandFailed(Exception):
+    """ A backend program's output ended early, or it said what it was asked to do failed. """
+
+
+# Programs that even SIGKILL didn't get rid of in time (stuck in the kernel on a controller
+# in trouble) - reaped when they finally go, the next time a Command starts.
+unreaped = list()
+
+
+class Command(object):
+    """ One run of a backend program - that can't hang us.
+
+    Its output is read with select() against a deadline: timeout seconds from the start, or
+    from the last command written to it in a session (each line written gets timeout seconds
+    to be answered). When the deadline passes the program is stopped and lines() raises
+    CommandTimeout. However it ends, stop() makes sure the program is gone - closing its
+    pipes and waiting a moment, then SIGTERM, then SIGKILL - and reaps it.
+    """
+
+    grace = 2       # seconds stop() waits after each step
+
+    def __init__(self, args, timeout, stdin=False, owner=None):
+        self.args = args
+        self.timeout = timeout      # 0 for no deadline
+        self.stdin = stdin
+        self.owner = owner          # the backend running it - for --profile
+        self.proc = None
+        self.pid = None
+        self.deadline = None
+        self.pending = deque()      # lines read, but not handed out yet
+        self.partial = ''           # the start of the next line
+        self.started = None
+        self.first_byte = None      # when the first output came
+        self.eof = None             # when the output ended
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.recorded = False        # stop() has added the run to the profile and histograms
+        self.last_data = None       # when output last came
+        self.command = None         # in a session - what was last written, and when
+        self.written = None
+
+
+    def start(self):
+        log = logging.getLogger('Command.start')
+
+        for proc in unreaped[:]:
+            if proc.poll() is not None:
+                unreaped.remove(proc)
+
+        # subprocess takes longer to import than most of mrchecker - and --linuxsw --sysfs never
+        # starts a program at all
+        from subprocess import Popen, PIPE
+
+        log.debug('attempting cmd "%s"' % ' '.join(self.args))
+        if self.stdin:
+            stdin = PIPE
+        else:
+            stdin = None
+        try:
+            # its own process group, so stop() gets anything it has started too
+            self.proc = Popen(self.args, shell=False, stdin=stdin, stdout=PIPE, preexec_fn=os.setpgrp)
+        except OSError, ex:
+            log.exception('Specified backend command not found')
+            return False
+        self.pid = self.proc.pid
+        self.started = time.time()
+        self._set_deadline(1)
+        return True
+
+
+    def _set_deadline(self, commands):
+        if self.timeout:
+            self.deadline = time.time() + self.timeout * commands
+
+
+    def write(self, text):
+        """ Write text (one or more commands, each ending in a newline) to the program. """
+        self._answered()
+        self.proc.stdin.write(text)
+        self.proc.stdin.flush()
+        self.command = '; '.join([line.strip() for line in text.splitlines() if line.strip()])
+        self.written = time.time()
+        self._set_deadline(max(1, text.count('\n')))
+
+
+    def _answered(self):
+        # a session's last command took until the last of the output that came after it - known
+        # once the next command is written (or the session ends)
+        if self.written is not None and self.last_data > self.written:
+            self._latency('%s: %s' % (self.describe(), self.command), self.last_data - self.written)
+        self.written = None
+
+
+    def _latency(self, name, seconds):
+        if histogram.monitor and self.owner:
+            histogram.monitor.record(self.owner, name, seconds)
+
+
+    def describe(self):
+        return ' '.join([os.path.basename(self.args[0])] + list(self.args[1:]))
+
+
+    def close(self):
+        """ No more commands - close the program's stdin. """
+        if self.proc.stdin and not self.proc.stdin.closed:
+            self.proc.stdin.close()
+
+
+    def poll(self):
+        return self.proc.poll()
+
+
+    def lines(self):
+        """ The lines of the program's output, as they come. A consumer that stops early
+        leaves the rest for the next call - the output of the next command in a session. """
+        while True:
+            while self.pending:
+                self.lines_read += 1
+                yield self.pending.popleft()
+            data = self._read()
+            if not data:
+                if self.partial:
+                    (line, self.partial) = (self.partial, '')
+                    self.lines_read += 1
+                    yield line
+                return
+            chunks = (self.partial + data).split('\n')
+            self.partial = chunks.pop()
+            self.pending.extend([chunk + '\n' for chunk in chunks])
+
+
+    def _read(self):
+        # whatever the program has written, once there's something - '' at the end
+        fd = self.proc.stdout.fileno()
+        while True:
+            started = time.time()
+            try:
+                remaining = None
+                if self.deadline is not None:
+                    remaining = self.deadline - started
+                    if remaining <= 0:
+                        self.stop(terminate=True)
+                        raise CommandTimeout('%s (pid %s) timed out after %ss'
+                                             % (' '.join(self.args), self.pid, self.timeout))
+                try:
+                    ready = select.select([fd], [], [], remaining)[0]
+                except select.error, ex:
+                    if ex.args[0] != errno.EINTR:
+                        raise
+                    continue
+            finally:
+                if timing.profile:
+                    timing.waited(time.time() - started)
+            if ready:
+                data = os.read(fd, 65536)
+                if data:
+                    self.last_data = time.time()
+                    if self.first_byte is None:
+                        self.first_byte = self.last_data
+                    self.bytes_read += len(data)
+                else:
+                    self.eof = time.time()
+                return data
+
+
+    def stop(self, terminate=False):
+        """ Make sure the program has exited and reap it. Returns its exit status (None if
+        it couldn't be got rid of). With terminate we don't wait for it to finish by itself. """
+        log = logging.getLogger('Command.stop')
+
+        self.close()
+        self.proc.stdout.close()
+        if terminate:
+            status = self.proc.poll()
+        else:
+            status = self._wait(self.grace)
+        if status is None:
+            log.debug('sending SIGTERM to %s (pid %s)' % (self.args[0], self.pid))
+            self._signal(signal.SIGTERM)
+            if self._wait(self.grace) is None:
+                log.warning('%s (pid %s) ignored SIGTERM - killing it' % (self.args[0], self.pid))
+                self._signal(signal.SIGKILL)
+                if self._wait(self.grace) is None:
+                    log.error('%s (pid %s) will not die - leaving it' % (self.args[0], self.pid))
+                    unreaped.append(self.proc)
+        if not self.recorded:
+            self.recorded = True
+            timing.command_done(self)
+            if self.stdin:
+                self._answered()
+            else:
+                self._latency(self.describe(), (self.eof or time.time()) - self.started)
+        return self.proc.returncode
+
+
+    def _signal(self, signum):
+        try:
+            os.killpg(self.pid, signum)
+        except OSError:
+            pass        # it has gone already
+
+
+    def _wait(self, seconds):
+        # the exit status, or None if it's still running after seconds
+        deadline = time.time() + seconds
+        delay = 0.005
+        while self.proc.poll() is None:
+            if time.time() >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        return self.proc.returncode
+
+
 class Controller(object):
 
+    # The attributes collect() fills in, and check_all() needs - what goes into the cache.
+    state_attrs = ['details']
+
+    # The attributes that make up the backend's inventory - models, serial numbers, the list
+    # of controllers - that hardly ever change. With an inventory_age they're kept (and
+    # cached) between runs, and collect() only runs the commands for the volatile state.
+    inventory_attrs = []
+
+    # Is the backend program unsafe (or too slow) to have several copies running at once?
+    single_flight = False
+
+    # The tables of each controller --only can pick from - and other names they go by, so
+    # that --only volumes means the same thing whatever the backend calls them.
+    selectable_tables = []
+    table_aliases = {}
+
     def __init__(self, program_name, program_list):
         self.logname = 'Controller'
         self.name = self.__class__.__name__
+        self.concurrency = 1     # how many sub-commands run_commands() may run at once
+        self.batch = False       # collect with as few tool runs as the backend knows how to
+        self.lazy = False        # only split out the fields the checks need (see records.lazy_record)
+        self.cache = None        # a ResultCache to share collected details through
+        self.max_age = 0         # how old (in seconds) a cache entry can be and still be used
+        self.flight = None       # a SingleFlight to share program runs with other processes
+        self.timeout = 60        # seconds a backend program run (or session command) gets - 0 for ever
+        self.timed_out = False   # did the last collect() give up on a backend program
+        self.controllers = None  # names of the controllers (arrays, pools) to look at - None for all
+        self.only = None         # names of the tables to collect - None for all
+        self.inventory_age = 0   # how old (in seconds) the inventory can get - 0 to collect it every run
+        self.inventory_cache = None  # a ResultCache to keep the inventory in between runs
+        self.inventory_time = None   # when the inventory we have was collected
+        self.inventory_stale = False # the backend saw something that says it is out of date
+        self.grouping = None     # with --parallel, the GroupingHandler holding back our thread's records
         self.set_program(program_name, program_list)
 
 
@@ -32,16 +300,213 @@ class Controller(object):
 
 
     def find_exec(self, name):
-        for path in paths:
-            pathname = os.path.join(path, name)
-            if os.path.exists(pathname):
-                return pathname
+        return find_exec(name)
+
+
+    def run_commands(self, batch):
+        """ Run a batch of backend commands, up to self.concurrency of them at once.
+
+        batch is a list of (key, cmdline, parser) tuples. Each parser is called as
+        parser(lines, key) and returns the parsed result. Returns a dict of key -> result;
+        a command that could not be started gives False, as does a parser that raised
+        while running in parallel (it has been logged). A command that timed out raises
+        CommandTimeout.
+        """
+        log = logging.getLogger('.'.join([self.logname, 'run_commands']))
+        log.debug('running %s commands, %s at a time' % (len(batch), self.concurrency))
+
+        if self.concurrency > 1 and len(batch) > 1:
+            results = list()
+            for (result, records) in run_parallel(self._run_command, batch, self.concurrency, self.grouping):
+                if result is None:
+                    result = False
+                results.append(result)
+                # back into our own group, so that they still come out with the rest of
+                # this backend's output - one sub-command after the other
+                for record in records:
+                    self.grouping.handle(record)
+        else:
+            results = [self._run_command(command) for command in batch]
+
+        d = dict()
+        for (command, result) in zip(batch, results):
+            # a timeout in a worker thread comes back as the exception - raise it here
+            if isinstance(result, CommandTimeout):
+                raise result
+            d[command[0]] = result
+        return d
+
+
+    def _run_command(self, command):
+        (key, cmdline, parser) = command
+        proc = self.start_command(cmdline)
+        if not proc:
+            return False
+
+        try:
+            try:
+                return parser(proc.lines(), key)
+            except CommandTimeout, ex:
+                if self.concurrency > 1:
+                    return ex
+                raise
+        finally:
+            proc.stop()
+
+
+    def start_command(self, cmdline, stdin=False):
+        """ Start cmdline (a string, or a list of arguments) as a Command with our timeout.
+        Returns the Command, or None if it couldn't start. """
+        if isinstance(cmdline, basestring):
+            cmdline = cmdline.split()
+        proc = Command(cmdline, self.timeout, stdin, self.name)
+        if not proc.start():
+            return None
+        return proc
+
+
+    def wanted_controller(self, name):
+        """ Is controller (array, pool) name one of the ones selected? md2 will do for /dev/md2. """
+        if self.controllers is None:
+            return True
+        name = str(name)
+        return name in self.controllers or os.path.basename(name) in self.controllers
+
+
+    def wanted_table(self, table):
+        """ Is table one of the ones selected - by its own name or its alias? """
+        if self.only is None:
+            return True
+        return table in self.only or self.table_aliases.get(table) in self.only
+
+
+    def cache_key(self):
+        # Details collected for a selection are no good to a run that wants everything, or
+        # something else - so the selection is part of the key.
+        key = (self.name, self.program)
+        if self.controllers is not None:
+            controllers = list(self.controllers)
+            controllers.sort()
+            key += tuple(['controllers'] + controllers)
+        if self.only is not None:
+            only = list(self.only)
+            only.sort()
+            key += tuple(['only'] + only)
+        return key
+
+
+    def inventory_key(self):
+        return self.cache_key() + ('inventory',)
+
+
+    # Backend API
+    def tiered(self):
+        """ Does this backend keep an inventory between runs? """
+        return self.inventory_age > 0 and len(self.inventory_attrs) > 0
 
-        return None
+
+    # Backend API
+    def load_inventory(self):
+        """ Fill in the inventory_attrs, if we - or another run, through the cache - collected
+        them less than inventory_age seconds ago. Returns False if the backend has to collect
+        them this time round (and save_inventory() them). """
+        log = logging.getLogger('.'.join([self.logname, 'load_inventory']))
+
+        if self.inventory_stale:
+            return False
+        if self.inventory_time and time.time() - self.inventory_time <= self.inventory_age:
+            return True
+        if not self.inventory_cache:
+            return False
+
+        entry = self.inventory_cache.get(self.inventory_key(), self.inventory_age)
+        if not entry:
+            return False
+        (self.inventory_time, inventory) = entry
+        for attr in self.inventory_attrs:
+            setattr(self, attr, inventory[attr])
+        log.debug('%s inventory taken from the cache' % self.name)
+        return True
+
+
+    # Backend API
+    def save_inventory(self):
+        """ The backend has collected the inventory_attrs afresh - keep them. """
+        self.inventory_time = time.time()
+        self.inventory_stale = False
+        if self.inventory_cache:
+            inventory = dict()
+            for attr in self.inventory_attrs:
+                inventory[attr] = getattr(self, attr)
+            self.inventory_cache.put(self.inventory_key(), (self.inventory_time, inventory))
+
+
+    # Backend API
+    def inventory_changed(self, reason):
+        """ The backend has seen a change the inventory doesn't know about (a new controller,
+        a failed disk) - don't use it again until it has been collected afresh. """
+        log = logging.getLogger('.'.join([self.logname, 'inventory_changed']))
+
+        log.info('%s inventory is out of date - %s' % (self.name, reason))
+        self.inventory_stale = True
+
+
+    def _collect_state(self):
+        log = logging.getLogger('.'.join([self.logname, '_collect_state']))
+
+        self.timed_out = False
+        try:
+            if not self.collect():
+                return None
+        except CommandTimeout, ex:
+            log.error('%s gave up: %s' % (self.name, ex))
+            self.timed_out = True
+            return None
+        except CommandFailed, ex:
+            log.error('%s failed: %s' % (self.name, ex))
+            return None
+        state = dict()
+        for attr in self.state_attrs:
+            state[attr] = getattr(self, attr)
+        return state
 
 
     # API
     def setup(self):
+        log = logging.getLogger('.'.join([self.logname, 'setup']))
+
+        if self.cache and self.max_age:
+            state = self.cache.get(self.cache_key(), self.max_age)
+            if state:
+                log.debug('%s details taken from the cache' % self.name)
+                for attr in self.state_attrs:
+                    setattr(self, attr, state[attr])
+                return True
+
+        return self.refresh()
+
+
+    # API
+    def refresh(self):
+        # Collect the details again - straight away on an already set up backend (--daemon mode).
+        # Backends whose program can't stand two copies running share the run with any other
+        # mrchecker doing the same thing at the same time.
+        if self.single_flight and self.flight:
+            state = self.flight.run(self.cache_key(), self._collect_state)
+        else:
+            state = self._collect_state()
+        if state is None:
+            return False
+
+        for attr in self.state_attrs:
+            setattr(self, attr, state[attr])
+        if self.cache:
+            self.cache.put(self.cache_key(), state)
+        return True
+
+
+    # Backend API - run the backend program(s) and fill in the state_attrs. Returns True if it worked.
+    def collect(self):
         pass
 
 
@@ -58,9 +523,27 @@ class Controller(object):
         pass
 
 
+    # API
+    def quick_check(self):
+        """ Run only the backend's cheapest summary command (--quick), stopping at the first
+        row that makes it an ERROR. Returns the Condition state, or None if nothing could be
+        checked at all.
+
+        Backends without a quick check of their own just do the whole setup/check_all/teardown.
+        """
+        if not self.setup():
+            if self.timed_out:
+                return Condition.TIMEOUT
+            return None
+        try:
+            return self.check_all()
+        finally:
+            self.teardown()
+
+
     # API
     def dump_details(self):
-        return self.details
+        return as_dicts(self.details)
 
 
 ## END OF LINE ##
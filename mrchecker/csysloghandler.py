@@ -1,18 +1,63 @@
+
+from collections import deque
 import logging
+import re
 import syslog
+import threading
+import time
 import types
 
 __version__ = '1.0'
 
 
+# a word with a digit in it - a controller, disk or array name, or a count - is what varies
+# between the messages coalescing merges
+varying = re.compile(r'\d')
+
+
 class CSysLogHandler(logging.Handler):
+    """ Log to syslog(3).
+
+    Every syslog() blocks until the syslog daemon takes the message - so a checker logging a
+    few hundred bad disks to a backed up syslog stalls on them. With a queue_size, emit() only
+    puts the record on a queue, and a thread writes them out. When the queue is full the
+    oldest record is thrown away, and how many were is logged once the queue is moving again.
+    flush() (logging.shutdown() calls it) waits up to flush_timeout seconds for the queue to
+    be written.
 
-    def __init__(self, facility=syslog.LOG_USER, ident='', logopts=0):
+    coalesce (which needs a queue) merges the records waiting on the queue that only differ in
+    one word with digits in it into one line - "controller 0 disk 4 is not ok with Media Error
+    Count 3", and the same for disks 7 and 9, become "3 times: controller 0 disk {4,7,9} is not
+    ok with Media Error Count 3". Every disk is listed, and the ones on controller 1 get a line
+    of their own. The thread waits up to window seconds after a record for the rest of its lot
+    to arrive.
+    """
+
+    window = 0.2
+    flush_timeout = 10
+
+    def __init__(self, facility=syslog.LOG_USER, ident='', logopts=0, queue_size=0, coalesce=False):
         logging.Handler.__init__(self)
 
         self.formatter = None
         syslog.openlog(ident, logopts, facility)
 
+        self.queue_size = queue_size
+        self.coalesce = coalesce
+        self.dropped = 0        # records thrown away, in all
+        self.unreported = 0     # ... and not logged about yet
+        self.thread = None
+        if queue_size:
+            self.queue = deque()
+            # an RLock - a signal handler (SIGUSR1 in --daemon) can log while we're in emit()
+            self.ready = threading.Condition(threading.RLock())
+            self.busy = False       # the thread has records it hasn't written yet
+            self.flushing = 0
+            self.closing = False
+            self.thread = threading.Thread(target=self._drain, name='syslog')
+            self.thread.setDaemon(True)
+            self.thread.start()
+
     def _convertPriorityName(self, priority):
         priority_names = {
             "alert":    syslog.LOG_ALERT,
@@ -34,12 +79,181 @@ class CSysLogHandler(logging.Handler):
         return priority
         
     def emit(self, record):
+        if not self.thread:
+            self._write(record)
+            return
+
+        self.ready.acquire()
+        try:
+            if len(self.queue) >= self.queue_size:
+                self.queue.popleft()
+                self.dropped += 1
+                self.unreported += 1
+            self.queue.append(record)
+            self.ready.notifyAll()
+        finally:
+            self.ready.release()
+
+    def _write(self, record):
         msg = self.format(record)
         priority = self._convertPriorityName(record.levelname.lower())
         syslog.syslog(priority, msg)
 
+    def _drain(self):
+        while True:
+            self.ready.acquire()
+            try:
+                while not self.queue and not self.closing:
+                    self.ready.wait()
+                if self.coalesce:
+                    deadline = time.time() + self.window
+                    while not self.closing and not self.flushing and time.time() < deadline:
+                        self.ready.wait(deadline - time.time())
+                records = list(self.queue)
+                self.queue.clear()
+                dropped = self.unreported
+                self.unreported = 0
+                if not records and self.closing:
+                    return
+                self.busy = True
+            finally:
+                self.ready.release()
+
+            try:
+                if dropped:
+                    records.insert(0, logging.makeLogRecord({
+                        'name': 'CSysLogHandler', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                        'msg': 'dropped %d messages - syslog was too slow for them (%d in all)'
+                               % (dropped, self.dropped)}))
+                if self.coalesce:
+                    records = coalesced(records)
+                for record in records:
+                    try:
+                        self._write(record)
+                    except Exception:
+                        self.handleError(record)
+            finally:
+                self.ready.acquire()
+                try:
+                    self.busy = False
+                    self.ready.notifyAll()
+                finally:
+                    self.ready.release()
+
+    def flush(self):
+        """ Wait (up to flush_timeout seconds) for the queued records to be written. """
+        if not self.thread:
+            return
+
+        deadline = time.time() + self.flush_timeout
+        self.ready.acquire()
+        try:
+            self.flushing += 1
+            self.ready.notifyAll()
+            try:
+                while (self.queue or self.busy) and self.thread.isAlive() and time.time() < deadline:
+                    self.ready.wait(deadline - time.time())
+            finally:
+                self.flushing -= 1
+        finally:
+            self.ready.release()
+
     def close(self):
+        if self.thread:
+            self.flush()
+            self.ready.acquire()
+            try:
+                self.closing = True
+                self.ready.notifyAll()
+            finally:
+                self.ready.release()
+            self.thread.join(self.flush_timeout)
         syslog.closelog()
 
-       
+
+def natural(word):
+    # disk 9 before disk 10
+    parts = re.split(r'(\d+)', word)
+    for index in range(1, len(parts), 2):
+        parts[index] = int(parts[index])
+    return parts
+
+
+def coalesced(records):
+    """ records, with the ones that differ in just one of the words with digits in them merged
+    into one - where the first of them was. controller 0 disk 4 and controller 1 disk 7 are
+    never merged into controller {0,1} disk {4,7}, which would lose which disk is where. A
+    record with a traceback is never merged. """
+    shapes = dict()
+    order = list()
+    for (index, record) in enumerate(records):
+        words = record.getMessage().split(' ')
+        key = (record.name, record.levelno, tuple([varying.search(word) and '#' or word for word in words]))
+        if record.exc_info:
+            key = record
+        if key not in shapes:
+            shapes[key] = list()
+            order.append(key)
+        shapes[key].append((index, record, words))
+
+    merged = list()
+    for key in order:
+        merged.extend(merge(shapes[key]))
+    merged.sort(key=lambda item: item[0])
+    return [record for (index, record) in merged]
+
+
+def merge(group):
+    # (index, record) for each lot of a group of records with the same shape - the lots being
+    # the records that only differ in the one word that splits the group into the fewest lots
+    columns = list()
+    for column in range(len(group[0][2])):
+        values = dict([(words[column], True) for (index, record, words) in group])
+        if len(values) > 1:
+            columns.append(column)
+
+    column = None
+    lots = lots_by(group, None)     # all the same - no word differs
+    for candidate in columns:
+        candidate_lots = lots_by(group, candidate)
+        if column is None or len(candidate_lots) < len(lots):
+            (column, lots) = (candidate, candidate_lots)
+
+    merged = list()
+    for lot in lots:
+        (index, record, words) = lot[0]
+        if len(lot) == 1:
+            merged.append((index, record))
+            continue
+        words = list(words)
+        if column is not None:
+            values = list()
+            for (other, other_record, other_words) in lot:
+                if other_words[column] not in values:
+                    values.append(other_words[column])
+            values.sort(key=natural)
+            words[column] = '{%s}' % ','.join(values)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = '%d times: %s' % (len(lot), ' '.join(words))
+        record.args = ()
+        merged.append((index, record))
+    return merged
+
+
+def lots_by(group, column):
+    # the records of group that are the same apart from the word at column, in order
+    lots = dict()
+    order = list()
+    for (index, record, words) in group:
+        if column is None:
+            key = None
+        else:
+            key = tuple(words[:column] + words[column + 1:])
+        if key not in lots:
+            lots[key] = list()
+            order.append(key)
+        lots[key].append((index, record, words))
+    return [lots[key] for key in order]
+
+
 ## END OF LINE ##
@@ -0,0 +1,61 @@
+import logging
+import random
+import signal
+import time
+
+__version__ = '1.0'
+
+
+class Scheduler(object):
+    """ Call a function every interval seconds until told to stop.
+
+    Each wait gets up to jitter seconds of random delay added, so a rack full of hosts
+    started at the same time doesn't run its checks (and hit syslog) in the same second.
+    SIGTERM and SIGINT stop the scheduler once the current cycle is done.
+    """
+
+    def __init__(self, interval, jitter=0):
+        self.interval = interval
+        self.jitter = jitter
+        self.running = False
+
+
+    def stop(self, signum=None, frame=None):
+        log = logging.getLogger('Scheduler.stop')
+        log.debug('stopping on signal %s' % signum)
+        self.running = False
+
+
+    def run(self, cycle):
+        log = logging.getLogger('Scheduler.run')
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.running = True
+        next_run = time.time()
+        while self.running:
+            try:
+                cycle()
+            except Exception:
+                # A bad cycle (a backend program dying mid-parse, say) must not kill the daemon.
+                log.exception('cycle failed')
+
+            # Schedule off the start times rather than the end times, so the checks don't drift
+            # later by however long they take - but never try to catch up on missed cycles.
+            now = time.time()
+            next_run = max(next_run + self.interval, now)
+            self.sleep(next_run - now + random.uniform(0, self.jitter))
+
+
+    def sleep(self, seconds):
+        # A signal cuts time.sleep() short - go back to sleep unless it was one telling us to stop.
+        deadline = time.time() + seconds
+        while self.running:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+
+## END OF LINE ##
@@ -0,0 +1,157 @@
+""" Rolling latency histograms of backend program runs, for --daemon.
+
+A MegaCli or tw_cli run that suddenly takes 20s instead of 2s is often the first sign of a
+controller in trouble - before anything it reports changes. Every command a backend runs
+has a Histogram of how long it has taken; a run slower than --slow-ratio times the
+--slow-percentile of its own history is reported (and makes the check a WARNING).
+
+The histograms are HDR style - fixed buckets, 16 to each power of two of milliseconds, so
+a value is within about 6% - and take the same memory however long the daemon runs. Once
+a histogram holds max_count runs every count is halved, so old runs fade out.
+"""
+
+import logging
+import math
+import threading
+
+__version__ = '1.0'
+
+
+monitor = None      # the LatencyMonitor, once enable() has been called
+
+sub_buckets = 16
+magnitudes = 19     # up to 2**23 ms, over two hours - anything longer goes in the last bucket
+
+
+def bucket_index(ms):
+    if ms < sub_buckets:
+        return ms
+    shift = math.frexp(ms)[1] - 5       # ms >> shift is in 16..31
+    if shift >= magnitudes:
+        return sub_buckets * (magnitudes + 1) - 1
+    return sub_buckets * (shift + 1) + (ms >> shift) - sub_buckets
+
+
+def bucket_value(index):
+    # the highest number of milliseconds that goes in bucket index
+    if index < sub_buckets:
+        return index
+    (shift, step) = divmod(index - sub_buckets, sub_buckets)
+    return ((sub_buckets + step + 1) << shift) - 1
+
+
+class Histogram(object):
+
+    max_count = 1000
+
+    def __init__(self):
+        self.counts = [0] * (sub_buckets * (magnitudes + 1))
+        self.count = 0
+        self.max = 0.0          # the slowest run - since the start
+
+
+    def record(self, seconds):
+        self.counts[bucket_index(int(seconds * 1000))] += 1
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+        if self.count >= self.max_count:
+            self.counts = [count / 2 for count in self.counts]
+            self.count = sum(self.counts)
+
+
+    def percentile(self, percent):
+        """ Seconds that percent of the runs took no longer than - None with no runs. """
+        if not self.count:
+            return None
+        wanted = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                # the top of the bucket - but no more than any run took
+                return min((bucket_value(index) + 1) / 1000.0, self.max)
+        return None
+
+
+    def buckets(self):
+        # (seconds, count) of every bucket with runs in it
+        return [((bucket_value(index) + 1) / 1000.0, count)
+                for (index, count) in enumerate(self.counts) if count]
+
+
+class LatencyMonitor(object):
+    """ A Histogram per backend and command, and the runs that were too slow for theirs. """
+
+    min_runs = 20           # a command needs this much history before it can be slow
+    min_seconds = 0.5       # and a run has to take at least this long
+
+    def __init__(self, percentile=None, ratio=None):
+        self.percentile = percentile    # None - never call a run slow
+        self.ratio = ratio
+        # an RLock - dump() is called from a signal handler, maybe in the middle of a record()
+        self.lock = threading.RLock()
+        self.histograms = dict()        # (backend, command) -> Histogram
+        self.slow = dict()              # backend -> [messages]
+
+
+    def record(self, backend, command, seconds):
+        self.lock.acquire()
+        try:
+            histogram = self.histograms.get((backend, command))
+            if histogram is None:
+                histogram = self.histograms[(backend, command)] = Histogram()
+            if self.percentile is not None and histogram.count >= self.min_runs and seconds >= self.min_seconds:
+                baseline = histogram.percentile(self.percentile)
+                if seconds > baseline * self.ratio:
+                    self.slow.setdefault(backend, list()).append(
+                        '%s took %.3fs - over %g times its p%g of %.3fs'
+                        % (command, seconds, self.ratio, self.percentile, baseline))
+            histogram.record(seconds)
+        finally:
+            self.lock.release()
+
+
+    def slow_commands(self, backend):
+        """ The messages about backend's slow runs since the last call. """
+        self.lock.acquire()
+        try:
+            return self.slow.pop(backend, list())
+        finally:
+            self.lock.release()
+
+
+    def dump(self):
+        """ A line per histogram - its percentiles and buckets. """
+        self.lock.acquire()
+        try:
+            keys = self.histograms.keys()
+            keys.sort()
+            lines = list()
+            for key in keys:
+                histogram = self.histograms[key]
+                lines.append('%s %s: %d runs p50 %.3fs p90 %.3fs p99 %.3fs max %.3fs buckets %s'
+                             % (key[0], key[1], histogram.count, histogram.percentile(50),
+                                histogram.percentile(90), histogram.percentile(99), histogram.max,
+                                ' '.join(['%g:%d' % bucket for bucket in histogram.buckets()])))
+            return lines
+        finally:
+            self.lock.release()
+
+
+def enable(percentile=None, ratio=None):
+    global monitor
+    monitor = LatencyMonitor(percentile, ratio)
+    return monitor
+
+
+def dump(signum=None, frame=None):
+    # the SIGUSR1 handler
+    log = logging.getLogger('histogram.dump')
+    if not monitor:
+        return
+    for line in monitor.dump():
+        log.info(line)
+
+
+## END OF LINE ##
@@ -1,86 +1,281 @@
 
-from subprocess import Popen, PIPE
 import logging
-from pprint import pprint
+import os
+import re
 
-from raid_check.controller import Controller
-from raid_check.condition import Condition
-from raid_check.parser import row_hybrid_split, row_delimiter_split
+from mrchecker.controller import Controller
+from mrchecker.condition import Condition
+from mrchecker.parser import TableSpec, row_hybrid_split, row_delimiter_split
+from mrchecker.parser import Section, Boundary, split_sections
+from mrchecker.records import Array, Disk, lazy_record, raw, number, state, kibibytes
 
 __version__ = '1.0'
 
 
-# FIXME: we mix the table, entry and row data in one dict here - very MESSY - seperate them
+class LinuxSWArray(Array):
+    __slots__ = ()
+    layout = { 'Raid Level': ('level', state),
+               'State': ('state', state),
+               'Array Size': ('size', kibibytes),
+               'Raid Devices': ('raid_devices', number),
+               'Total Devices': ('total_devices', number),
+               'Active Devices': ('active_devices', number),
+               'Working Devices': ('working_devices', number),
+               'Failed Devices': ('failed_devices', number),
+               'Spare Devices': ('spare_devices', number),
+               'disks': ('disks', raw),
+               }
+
+
+class LinuxSWDisk(Disk):
+    __slots__ = ()
+    layout = { 'number': ('name', str),
+               'state': ('state', state),
+               'raid_device': ('slot', number),
+               'device': ('device', str),
+               }
+
+
+# the mdadm command that prints each table
+commands = {
+    'arrays': '%(program)s --examine --brief --scan --config=partition',
+    'array_details': '%(program)s --detail %(array)s',
+    # (no disks - they are the rows at the end of the array_details output)
+    }
+
 tables = {
-    'arrays': { 'commandline': '%(program)s --examine --brief --scan --config=partition',
-                'row_split': row_hybrid_split,
-                'name_field': 'array_name',
-                'fields_list': [('array_name', 1),
-                                ('level', 2),
-                                ('device_count', 3),
-                                ('uuid', 4)],
-                # 'strip_list': [None, '.'],
-                },
+    'arrays': TableSpec(row_split=row_hybrid_split,
+                        name_field='array_name',
+                        fields_list=[('array_name', 1),
+                                     ('level', 2),
+                                     ('device_count', 3),
+                                     ('uuid', 4)],
+                        # strip_list=[None, '.'],
+                        ),
     
-    'array_details': { 'commandline': '%(program)s --detail %(array)s',
-               'row_split': row_delimiter_split,
-               'delimiter': ':',
-               'name_field': 0,
-               'value_field': 1,
-               'strip_list': [None],
-               },
+    'array_details': TableSpec(row_split=row_delimiter_split,
+                               delimiter=':',
+                               name_field=0,
+                               value_field=1,
+                               strip_list=[None],
+                               ),
     
-    'disks': { 'commandline': None,    # we got the data from the array_details command...
-               'row_split': row_hybrid_split,
-               'name_field': 'number',
-               'fields_list': [('number', 0),
-                               ('major_devid', 1),
-                               ('minor_devid', 2),
-                               ('raid_device', 3),
-                               ('state', 4),
-                               ('device', -1)],
-               'strip_list': [None],
-               },
+    'disks': TableSpec(row_split=row_hybrid_split,
+                       record=LinuxSWDisk,
+                       name_field='number',
+                       fields_list=[('number', 0),
+                                    ('major_devid', 1),
+                                    ('minor_devid', 2),
+                                    ('raid_device', 3),
+                                    ('state', 4),
+                                    ('device', -1)],
+                       strip_list=[None],
+                       ),
     }
 
 
 program_list = ['mdadm']
 
 
+# the [raid devices/working devices] of an mdstat status line
+mdstat_devices = re.compile(r'\[(\d+)/(\d+)\]')
+
+
+# sysfs member state flag -> the state mdadm --detail would show for the member
+sysfs_disk_states = { 'in_sync': 'active',
+                      'faulty': 'faulty',
+                      'spare': 'spare',
+                      }
+
+
 class LinuxSW(Controller):
+
+    # mdadm --examine --scan reads the superblock of every partition on the box to find the
+    # arrays - keep the list. (--sysfs has no need for it.)
+    inventory_attrs = ['array_list']
     
     def __init__(self, program_name):
         super(LinuxSW, self).__init__(program_name, program_list)
         self.log = logging.getLogger('Controller.LinuxSW')
         self.log.debug('__init__ starting')
+        self.use_sysfs = False     # read /proc/mdstat and sysfs instead of running mdadm
+        self.sysfs_root = '/'      # where to find proc/ and sys/ - somewhere else for testing
         self.log.debug('__init__ ending')
 
 
-    def setup(self):
+    def collect(self):
         # Usually we do this by controller - in linux software raid, the OS _IS_ the controller,
         # so there can only be one. (VM's are their own OS, so thats irrelevant here I hope).
-        self.log.debug('setup() starting')
+        self.log.debug('collect() starting')
 
-        self.details = dict()
-        array_list = self._get_array_list()
-#        pprint(array_list)
+        if self.use_sysfs:
+            return self._collect_sysfs()
 
-        if not array_list:
-            self.log.debug('setup() ending - didnt find any arrays - returning False')
-            return False
+        self.details = dict()
+        inventory = self.tiered() and self.load_inventory()
+        if inventory:
+            array_list = self.array_list
+        else:
+            array_list = self._get_array_list()
+#            pprint(array_list)
+
+            if not array_list:
+                self.log.debug('collect() ending - didnt find any arrays - returning False')
+                return False
+            for array in array_list.keys():
+                if not self.wanted_controller(array):
+                    del array_list[array]
+            if not array_list:
+                self.log.error('none of the selected arrays were found')
+                return False
+            if self.tiered():
+                self.array_list = array_list
+                self.save_inventory()
 
+        # One mdadm --detail per array - let the Controller run them as a batch.
+        batch = list()
         for array in array_list.keys():
-            self.details[array] = self._get_array_details(array)
+            args = dict(zip(['program', 'array'], [self.program, array]))
+            cmdline = commands['array_details'] % args
+            batch.append((array, cmdline, self._parse_array_details))
+
+        results = self.run_commands(batch)
+        if inventory:
+            for array in results.keys():
+                if results[array] is False or 'State' not in results[array]:
+                    # mdadm knows nothing about it any more
+                    self.inventory_changed('no details for array %s' % array)
+                    return self.collect()
+        for array in results.keys():
+            self.details[array] = results[array]
 #            self.details[array]['summary'] = array_list[array]
 #            silly for linux sw raid - repeats everything we already know.
             if not self.details[array]:
-                self.log.debug('setup() ending - didnt find any details for a controller - returning False')
+                self.log.debug('collect() ending - didnt find any details for a controller - returning False')
                 return False
 
-        self.log.debug('setup() ending - found array and details - returning True')
+        self.log.debug('collect() ending - found array and details - returning True')
+        return True
+
+
+    def _collect_sysfs(self):
+        # The kernel already knows the state of every array - no need to fork mdadm and have
+        # it read the member superblocks. We fill in the same details as the mdadm parsing does.
+        self.log.debug('_collect_sysfs() starting')
+
+        self.details = dict()
+        arrays = self._read_mdstat()
+        if not arrays:
+            self.log.debug('_collect_sysfs() ending - didnt find any arrays - returning False')
+            return False
+
+        for array in arrays.keys():
+            if self.wanted_controller(array):
+                self.details['/dev/%s' % array] = self._read_array_sysfs(array, arrays[array])
+        if not self.details:
+            self.log.error('none of the selected arrays were found')
+            return False
+
+        self.log.debug('_collect_sysfs() ending - found arrays and details - returning True')
         return True
 
 
+    def _read_sysfs(self, *path):
+        # contents of a proc/sys file, or None if the kernel doesn't provide it (raid0 has no
+        # degraded or sync_action, for one)
+        try:
+            f = open(os.path.join(self.sysfs_root, *path))
+            try:
+                return f.read().strip()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+
+    def _read_mdstat(self):
+        self.log.debug('_read_mdstat() starting')
+
+        # We only want the array lines, like
+        #   md1 : active raid5 sdc1[2] sdb1[1] sda1[0](F)
+        d = dict()
+        mdstat = self._read_sysfs('proc', 'mdstat')
+        if mdstat is None:
+            self.log.error('can not read %s' % os.path.join(self.sysfs_root, 'proc', 'mdstat'))
+            return d
+
+        for line in mdstat.splitlines():
+            info = line.split()
+            if len(info) < 3 or info[1] != ':' or not info[0].startswith('md'):
+                continue
+            d[info[0]] = { 'state': info[2] }
+            if len(info) > 3 and info[3].startswith('raid'):
+                d[info[0]]['level'] = info[3]
+
+        self.log.debug('_read_mdstat() ending')
+        return d
+
+
+    def _read_array_sysfs(self, array, mdstat):
+        self.log.debug('_read_array_sysfs(%s) starting' % array)
+
+        d = dict()
+        d['Raid Level'] = self._read_sysfs('sys', 'block', array, 'md', 'level') or mdstat.get('level')
+        d['State'] = self._read_sysfs('sys', 'block', array, 'md', 'array_state') or mdstat['state']
+        for (key, name) in [('Raid Devices', 'raid_disks'),
+                            ('Degraded', 'degraded'),
+                            ('Sync Action', 'sync_action'),
+                            ('Sync Completed', 'sync_completed')]:
+            value = self._read_sysfs('sys', 'block', array, 'md', name)
+            if value is not None:
+                d[key] = value
+
+        # The members are the dev-* directories. Number them the way mdadm does - by raid
+        # slot, with the spares and failed members (no slot) after the rest.
+        members = list()
+        try:
+            for entry in os.listdir(os.path.join(self.sysfs_root, 'sys', 'block', array, 'md')):
+                if entry.startswith('dev-'):
+                    members.append(entry)
+        except OSError, ex:
+            self.log.warning('can not list the members of %s: %s' % (array, ex))
+        members.sort()
+
+        disks = dict()
+        spare_number = int(d.get('Raid Devices') or 0)
+        for member in members:
+            flags = (self._read_sysfs('sys', 'block', array, 'md', member, 'state') or '').split(',')
+            slot = self._read_sysfs('sys', 'block', array, 'md', member, 'slot')
+            if slot and slot.isdigit():
+                number = slot
+            else:
+                number = str(spare_number)
+                spare_number += 1
+                slot = '-'
+            state = flags[0]
+            for flag in flags:
+                if flag in sysfs_disk_states:
+                    state = sysfs_disk_states[flag]
+                    break
+            disks[number] = LinuxSWDisk([('number', number),
+                                         ('raid_device', slot),
+                                         ('state', state),
+                                         ('flags', ','.join(flags)),
+                                         ('device', '/dev/%s' % member[len('dev-'):]),
+                                         ])
+        d['disks'] = disks
+
+        failed = len([disk for disk in disks.values() if disk.state == 'faulty'])
+        d['Total Devices'] = str(len(disks))
+        d['Active Devices'] = str(len([disk for disk in disks.values() if disk.state == 'active']))
+        d['Spare Devices'] = str(len([disk for disk in disks.values() if disk.state == 'spare']))
+        d['Failed Devices'] = str(failed)
+        d['Working Devices'] = str(len(disks) - failed)
+
+        self.log.debug('_read_array_sysfs(%s) ending' % array)
+        return LinuxSWArray(d.items())
+
+
     def check_all(self):
         self.log.debug('check_all() starting')
 
@@ -94,16 +289,64 @@ class LinuxSW(Controller):
         return cond.state
 
 
+    def quick_check(self):
+        log = logging.getLogger('controller.linuxsw.quick_check')
+        cond = Condition()
+
+        # Just /proc/mdstat - mdadm or not. Each array is a line like
+        #   md1 : active raid5 sdc1[2] sdb1[1] sda1[0](F)
+        # (F) being a failed member, followed by a status line ending like
+        #         1953519872 blocks level 5, 64k chunk, algorithm 2 [3/2] [_UU]
+        # where [3/2] says only 2 of its 3 devices are working.
+        path = os.path.join(self.sysfs_root, 'proc', 'mdstat')
+        try:
+            f = open(path)
+        except IOError, ex:
+            log.error('can not read %s: %s' % (path, ex))
+            return None
+
+        arrays = 0
+        array = None
+        try:
+            for line in f:
+                info = line.split()
+                if len(info) >= 3 and info[1] == ':' and info[0].startswith('md'):
+                    array = None
+                    if not self.wanted_controller(info[0]):
+                        continue
+                    arrays += 1
+                    array = '/dev/%s' % info[0]
+                    failed = [member for member in info[3:] if member.endswith('(F)')]
+                    if not info[2].startswith('active'):
+                        cond.error()
+                        log.error('array %s is not ok with state %s' % (array, info[2]))
+                    elif failed:
+                        cond.error()
+                        log.error('array %s is not ok with failed devices %s' % (array, ' '.join(failed)))
+                elif array:
+                    match = mdstat_devices.search(line)
+                    if match and int(match.group(2)) < int(match.group(1)):
+                        cond.error()
+                        log.error('array %s is not ok with only %s of %s devices working'
+                                  % (array, match.group(2), match.group(1)))
+                    array = None
+                if cond.state == Condition.ERROR:
+                    break
+        finally:
+            f.close()
+
+        if not arrays:
+            log.error('%s lists no (selected) arrays' % path)
+            return None
+        return cond.state
+
+
     def _parse_array_table(self, iter, table_spec):
         self.log.debug('parse_array_table() starting')
         
         d = dict()
 
-        for line in iter:
-            line = line.strip()
-            self.log.debug('  line is %s' % line)
-            self.log.debug('  table row - adding to dict')
-            (name, value) = table_spec['row_split'](line, table_spec)
+        for (section, (name, value)) in split_sections(iter, [Section('arrays', table_spec)]):
             for key in value.keys():
                 if value[key].count('='):
                     value[key] = value[key].split('=')[1]
@@ -116,83 +359,49 @@ class LinuxSW(Controller):
         self.log.debug('_get_array_list() starting')
 
         args = dict(zip(['program'], [self.program]))
-        cmdline = tables['arrays']['commandline'] % args
-        self.log.debug('attempting cmd "%s"' % cmdline)
+        cmdline = commands['arrays'] % args
 
         d = dict()
-        try:
-            proc = Popen(cmdline.split(), shell=False, stdout=PIPE)
-        except OSError, ex:
-            self.log.exception('Specified backend command not found')
+        proc = self.start_command(cmdline)
+        if not proc:
             return False
 
-        d = self._parse_array_table(proc.stdout, tables['arrays'])
+        try:
+            d = self._parse_array_table(proc.lines(), tables['arrays'])
+        finally:
+            proc.stop()
         self.log.debug('_get_array_list() ending')
         return d
     
 
-    def _parse_table0(self, iter, table_spec):
-        self.log.debug('parse_table0() starting')
-        
-        d = dict()
-
-        for line in iter:
-            line = line.strip()
-            self.log.debug('  line is %s' % line)
-            if line.count('Number   Major   Minor'):
-                self.log.debug('parse_table0() ending')
-                return d 
-            elif not line:
-                continue
+    def _parse_array_details(self, stdout, array):
+        self.log.debug('_parse_array_details() starting')
+
+        # After the array details, we get a list of the drives in the array - we need their
+        # state and name if nothing else.
+        if self.lazy:
+            # keep the lines, and only split out the ones the checks need
+            sections = [Section('array_details', keep=True), Section('disks', tables['disks'])]
+        else:
+            sections = [Section('array_details', tables['array_details']),
+                        Section('disks', tables['disks'])]
+        boundaries = [Boundary('Number   Major   Minor', 'disks')]
+
+        details = list()
+        disks = dict()
+        # Skip over first 1 lines, and then parse the tables.
+        for (section, record) in split_sections(stdout, sections, boundaries, skip=1):
+            if section == 'disks':
+                disks[record[0]] = record[1]
             else:
-                self.log.debug('  table row - adding to dict')
-                (name, value) = table_spec['row_split'](line, table_spec)
-                d[name] = value
-
-
-    def _parse_table1(self, iter, table_spec):
-        self.log.debug('parse_table1() starting')
-        
-        d = dict()
+                details.append(record)
 
-        for line in iter:
-            line = line.strip()
-            self.log.debug('  line is %s' % line)
-            self.log.debug('  table row - adding to dict')
-            (name, value) = table_spec['row_split'](line, table_spec)
-            d[name] = value
-
-        return d
-    
-
-    def _get_array_details(self, array):
-        self.log.debug('_get_array_details() starting')
-
-        args = dict(zip(['program', 'array'], [self.program, array]))
-        cmdline = tables['array_details']['commandline'] % args
-        self.log.debug('attempting cmd "%s"' % cmdline)
-
-        try:
-            proc = Popen(cmdline.split(), shell=False, stdout=PIPE)
-        except OSError, ex:
-            self.log.exception('Specified backend command not found')
-            return False
-
-        # Skip over first 1 lines, and then parse the table.
-        for lineno in range(1):
-            if not proc.stdout.next():   # we explicitly don't care about the content of the lines, if any
-                # FIXME - should be a more specific error
-                raise Exception('parse error')
-
-        d = self._parse_table0(proc.stdout, tables['array_details'])
-
-        # We're not done - after the array details, we get a list of the drives in the array
-        # we need their state and name if nothing else.
-        # Our previous effort stopped at the headers for this info, so we're perfectly positioned
-        
-        d['disks'] = self._parse_table1(proc.stdout, tables['disks'])
-
-        return  d
+        if self.lazy:
+            array = lazy_record(LinuxSWArray, details, tables['array_details']['delimiter'])
+        else:
+            array = LinuxSWArray(details)
+        array.disks = disks
+        return array
 
 
     # FIXME: This is very spartan because I'm developing on a machine with all healthy raids.
@@ -201,24 +410,38 @@ class LinuxSW(Controller):
         cond = Condition(Condition.OK)
 
         # check the disks (physical drives)
-        for disk in self.details[array]['disks'].keys():
-            detail = self.details[array]['disks'][disk]
-            if detail['state'] != 'active':
+        for disk in self.details[array].disks.keys():
+            detail = self.details[array].disks[disk]
+            if detail.state != 'active':
                 cond.error()
                 log.error('array %s disk %s is not ok with state %s' 
-                          % (array, disk, detail['state'])) 
+                          % (array, disk, detail.state)) 
                 
 
         detail = self.details[array]
-        if detail['Failed Devices'] != '0':
+        # the kernel's own count of missing members - only there with --sysfs, and not for raid0
+        degraded = detail.get('Degraded')
+        if degraded is not None and degraded != '0':
+            cond.error()
+            log.error('array %s is not ok with Degraded %s'
+                      % (array, degraded))
+
+        # a member that has been removed altogether isn't in Total Devices or Working Devices
+        # either - it is only missing from the slots the array has
+        if getattr(detail, 'raid_devices', None) is not None and detail.active_devices != detail.raid_devices:
+            cond.error()
+            log.error('array %s is not ok with Raid Devices %s != Active Devices %s'
+                      % (array, detail.raid_devices, detail.active_devices))
+
+        if detail.failed_devices != 0:
             cond.error()
             log.error('array %s not ok with Failed Devices %s' 
-                      % (array, detail['Failed Devices'])) 
+                      % (array, detail.failed_devices)) 
             
-        if detail['Working Devices'] != detail['Total Devices']:
+        if detail.working_devices != detail.total_devices:
             cond.warning()
             log.warning('array %s is not ok with Total Devices %s != Working Devices %s' 
-                      % (array, detail['Total Devices'], detail['Working Devices'])) 
+                      % (array, detail.total_devices, detail.working_devices)) 
             
         return cond.state
 
@@ -0,0 +1,84 @@
+import errno
+import fcntl
+import logging
+import os
+import time
+
+from mrchecker.cache import ResultCache
+
+__version__ = '1.0'
+
+
+default_directory = '/run/mrchecker'
+
+
+class SingleFlight(object):
+    """ Make concurrent mrchecker processes share one run of a backend program.
+
+    Whoever gets the flock() on the backend's lock file runs the program and publishes the
+    result next to the lock. Anybody arriving while that is going on waits for the lock (up to
+    timeout seconds) and then uses the published result instead of starting a second copy
+    of a tool that is slow and not safe to run twice at once.
+    """
+
+    def __init__(self, directory=default_directory, timeout=120):
+        self.directory = directory
+        self.timeout = timeout
+        self.results = ResultCache(directory)
+
+
+    def run(self, key, collect):
+        """ Return collect()'s result - or one published by whoever beat us to it.
+
+        collect returns None on failure, and None is also returned if we timed out.
+        """
+        log = logging.getLogger('SingleFlight.run')
+
+        path = self.results.path(key, '.lock')
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0755)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+            # not inherited by the backend program - one that won't die mustn't keep the lock
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        except OSError, ex:
+            log.debug('can not use lock %s (%s) - running without it' % (path, ex))
+            return collect()
+
+        try:
+            started = time.time()
+            waited = False
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except IOError, ex:
+                    if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                if not waited:
+                    log.debug('%s is being run by another process - waiting for it' % (key,))
+                    waited = True
+                if time.time() - started > self.timeout:
+                    log.error('gave up after waiting %ss for another mrchecker to finish with %s '
+                              '(lock file %s)' % (self.timeout, key[0], path))
+                    return None
+                time.sleep(0.1)
+
+            if waited:
+                # Anything published since we started waiting is the other run's result.
+                result = self.results.get(key, time.time() - started)
+                if result is not None:
+                    log.debug('using the result published by the other run')
+                    return result
+                log.debug('the other run published nothing - running it ourselves')
+
+            result = collect()
+            if result is not None:
+                self.results.put(key, result)
+            return result
+        finally:
+            # closing the file drops the flock
+            os.close(fd)
+
+
+## END OF LINE ##
@@ -1,58 +1,127 @@
 
-from subprocess import Popen, PIPE
 import logging
-from pprint import pprint
+import re
 
-from raid_check.controller import Controller
-from raid_check.condition import Condition
-from raid_check.parser import row_hybrid_split, row_delimiter_split
+from mrchecker.controller import Controller
+from mrchecker.condition import Condition
+from mrchecker.parser import TableSpec, row_delimiter_split
+from mrchecker.parser import Section, Boundary, Mark, BREAK, END, split_sections
+from mrchecker.records import Disk, Volume, Enclosure, lazy_record
+from mrchecker.records import number, state, size, temperature
 
 __version__ = '1.0'
 
 
-# FIXME: we mix the table, entry and row data in one dict here - very MESSY - seperate them
+class MegaRaidDisk(Disk):
+    __slots__ = ()
+    layout = { 'Device Id': ('name', str),
+               'Firmware state': ('state', state),
+               'Slot Number': ('slot', number),
+               'Enclosure Device ID': ('enclosure', number),
+               'Raw Size': ('size', size),
+               'Drive Temperature': ('temperature', temperature),
+               'Media Error Count': ('media_errors', number),
+               'Other Error Count': ('other_errors', number),
+               'Predictive Failure Count': ('predictive_failures', number),
+               'Last Predictive Failure Event Seq Number': ('predictive_event', number),
+               }
+
+
+class MegaRaidVolume(Volume):
+    __slots__ = ()
+    layout = { 'Name': ('name', str),
+               'State': ('state', state),
+               'RAID Level': ('level', state),
+               'Size': ('size', size),
+               }
+
+
+class MegaRaidEnclosure(Enclosure):
+    __slots__ = ()
+    layout = { 'Device ID': ('name', str),
+               'Status': ('state', state),
+               'Number of Alarms': ('alarms', number),
+               }
+
+
+# The MegaCli command for each table - one adapter's worth, and (batch mode) every adapter's
+# in one run.
+commands = {
+    'enclosures': '%(program)s -encinfo -a%(controller)s',
+    'disks': '%(program)s -pdlist -a%(controller)s',
+    'volumes': '%(program)s -ldinfo -lall -a%(controller)s',
+    }
+
+commands_all = {
+    'enclosures': '%(program)s -EncInfo -aALL',
+    'disks': '%(program)s -PDList -aALL',
+    'volumes': '%(program)s -LDInfo -Lall -aALL',
+    }
+
+# In the output of a commands_all run each adapter's section starts with a line matching its
+# adapter header.
+adapter_headers = {
+    'enclosures': re.compile(r'^Number of enclosures on adapter (\d+)'),
+    'disks': re.compile(r'^Adapter #(\d+)'),
+    'volumes': re.compile(r'^Adapter (\d+) -- Virtual Drive Information'),
+    }
+
+# Each entry is a block of key: value lines - named by the value of this key.
+entry_names = {
+    'enclosures': 'Device ID',
+    'disks': 'Device Id',
+    'volumes': 'Name',
+    }
+
 tables = {
-    'cntrs': { 'row_split': row_delimiter_split,
-               'delimiter': ':',
-               'name_field': 0,
-               'value_field': 1,
-               'strip_list': [None, '.'],
-               },
+    'cntrs': TableSpec(row_split=row_delimiter_split,
+                       delimiter=':',
+                       name_field=0,
+                       value_field=1,
+                       strip_list=[None, '.'],
+                       ),
     
-    'enclosures': { 'commandline': '%(program)s -encinfo -a%(controller)s',
-                    'row_split': row_delimiter_split,
-                    'delimiter': ':',
-                    'name_field': 0,
-                    'value_field': 1,
-                    'entry_name': 'Device ID',
-                    'strip_list': [None],
-                    },
+    'enclosures': TableSpec(row_split=row_delimiter_split,
+                            delimiter=':',
+                            name_field=0,
+                            value_field=1,
+                            record=MegaRaidEnclosure,
+                            strip_list=[None],
+                            ),
     
-    'disks': { 'commandline': '%(program)s -pdlist -a%(controller)s',
-               'row_split': row_delimiter_split,
-               'delimiter': ':',
-               'name_field': 0,
-               'value_field': 1,
-               'entry_name': 'Device Id',
-               'strip_list': [None],
-               },
+    'disks': TableSpec(row_split=row_delimiter_split,
+                       delimiter=':',
+                       name_field=0,
+                       value_field=1,
+                       record=MegaRaidDisk,
+                       strip_list=[None],
+                       ),
     
-    'volumes': { 'commandline': '%(program)s -ldinfo -lall -a%(controller)s',
-                 'row_split': row_delimiter_split,
-                 'delimiter': ':',
-                 'name_field': 0,
-                 'value_field': 1,
-                 'entry_name': 'Name',
-                 'strip_list': [None],
-                 },
+    'volumes': TableSpec(row_split=row_delimiter_split,
+                         delimiter=':',
+                         name_field=0,
+                         value_field=1,
+                         record=MegaRaidVolume,
+                         strip_list=[None],
+                         ),
     }
 
 
+# every MegaCli command's output ends with this
+exit_code = Boundary('Exit Code:', END)
+
+
 program_list = ['MegaCli64', 'MegaCli']
 
 
 class MegaRaid(Controller):
-    
+
+    state_attrs = ['ctrl_list', 'details']
+    # batch mode learns the adapters from the -aALL output, and has no use for an inventory
+    inventory_attrs = ['ctrl_list']
+    single_flight = True
+    selectable_tables = ['enclosures', 'disks', 'volumes']
+
     def __init__(self, program_name):
         super(MegaRaid, self).__init__(program_name, program_list)
         self.log = logging.getLogger('Controller.MegaRaid')
@@ -60,25 +129,88 @@ class MegaRaid(Controller):
         self.log.debug('__init__ ending')
 
 
-    def setup(self):
-        self.log.debug('setup() starting')
+    def collect(self):
+        self.log.debug('collect() starting')
+
+        if self.batch:
+            return self._setup_batch()
 
-        self.ctrl_list = self._get_controller_list()
-#        pprint(self.ctrl_list)
+        # The adapters are our inventory - no -adpcount if we already know them.
+        inventory = self.tiered() and self.load_inventory()
+        if not inventory:
+            self.ctrl_list = self._get_controller_list()
+#            pprint(self.ctrl_list)
         
-        if not self.ctrl_list:
-            self.log.debug('setup() ending - didnt find any controllers - returning False')
-            return False
+            if not self.ctrl_list:
+                self.log.debug('collect() ending - didnt find any controllers - returning False')
+                return False
+            for ctrl in self.ctrl_list.keys():
+                if not self.wanted_controller(ctrl):
+                    del self.ctrl_list[ctrl]
+            if not self.ctrl_list:
+                self.log.error('none of the selected controllers were found')
+                return False
+            if self.tiered():
+                self.save_inventory()
+
+        # One command per table per controller - let the Controller run them all as a batch.
         self.details = dict()
+        batch = list()
         for ctrl in self.ctrl_list.keys():
-            self.details[ctrl] = self._get_controller_details(ctrl)
-#            print 'inside setup() - printing results'
-#            pprint(self.details[ctrl])
-            if not self.details[ctrl]:
-                self.log.debug('setup() ending - didnt find any details for a controller - returning False')
+            self.details[ctrl] = dict()
+            batch.extend(self._get_controller_commands(ctrl))
+        results = self.run_commands(batch)
+        if inventory:
+            for ctrl in self.ctrl_list.keys():
+                if not [table for (key, table) in results.keys() if key == ctrl and results[(key, table)]]:
+                    # gone - or not the adapter it was
+                    self.inventory_changed('adapter %s showed nothing' % ctrl)
+                    return self.collect()
+        for (ctrl, table) in results.keys():
+            if results[(ctrl, table)] is False:
+                self.log.debug('collect() ending - didnt find any details for a controller - returning False')
                 return False
+            self.details[ctrl][table] = results[(ctrl, table)]
 
-        self.log.debug('setup() ending - found controllers and details - returning True')
+        self.log.debug('collect() ending - found controllers and details - returning True')
+        return True
+
+
+    def _setup_batch(self):
+        # Three MegaCli runs in total, whatever the number of adapters - we learn the list of
+        # controllers from the adapter sections of the output instead of running -adpcount.
+        self.log.debug('_setup_batch() starting')
+
+        batch = list()
+        for table in tables:
+            if table == 'cntrs' or not self.wanted_table(table):
+                continue
+            args = dict(zip(['program'], [self.program]))
+            batch.append((table, commands_all[table] % args, self._parse_adapter_tables))
+        results = self.run_commands(batch)
+
+        self.ctrl_list = dict()
+        self.details = dict()
+        for table in results.keys():
+            if results[table] is False:
+                self.log.debug('_setup_batch() ending - a MegaCli run failed - returning False')
+                return False
+            for ctrl in results[table].keys():
+                if not self.wanted_controller(ctrl):
+                    continue
+                self.ctrl_list[ctrl] = None
+                self.details.setdefault(ctrl, dict())[table] = results[table][ctrl]
+
+        if not self.ctrl_list:
+            self.log.debug('_setup_batch() ending - didnt find any controllers - returning False')
+            return False
+
+        # An adapter with (say) no enclosures may not show up in every output at all.
+        for ctrl in self.details.keys():
+            for table in results.keys():
+                self.details[ctrl].setdefault(table, dict())
+
+        self.log.debug('_setup_batch() ending - found controllers and details - returning True')
         return True
 
 
@@ -95,62 +227,58 @@ class MegaRaid(Controller):
         return cond.state
 
 
-    def _parse_table0(self, iter, table_spec):
-        self.log.debug('parse_table0() starting')
-        
-        d = dict()
+    def quick_check(self):
+        log = logging.getLogger('controller.quick_check')
+        cond = Condition()
 
-        for line in iter:
-            line = line.strip()
-            self.log.debug('  line is %s' % line)
-            if line.count('Exit Code:'):
-                self.log.debug('parse_table0() ending')
-                return d 
-            elif not line:
+        # Just -LDInfo -Lall -aALL - the State of every virtual drive, on every adapter.
+        args = dict(zip(['program'], [self.program]))
+        proc = self.start_command(commands_all['volumes'] % args)
+        if not proc:
+            return None
+        sections = [Section('preamble'), Section('entries', tables['volumes'])]
+        boundaries = [Boundary(adapter_headers['volumes'], 'entries', mark=True), exit_code]
+        ctrl = None
+        volume = None
+        for (section, record) in split_sections(proc.lines(), sections, boundaries):
+            if isinstance(record, Mark):
+                ctrl = int(record.match.group(1))
                 continue
-            else:
-                self.log.debug('  table row - adding to dict')
-                (name, value) = table_spec['row_split'](line, table_spec)
-                d[name] = value
-
-
-
-    def _parse_table1(self, iter, table_spec):
-        self.log.debug('parse_table1() starting')
-
-        d = dict()
+            if not self.wanted_controller(ctrl):
+                continue
+            (name, value) = record
+            if name == entry_names['volumes']:
+                volume = value
+            elif name == 'State' and value != 'Optimal':
+                cond.error()
+                log.error('controller %s volume %s is not ok with State %s' % (ctrl, volume, value))
+                break
+        proc.stop(terminate=True)
 
-        for line in iter:
-            line = line.strip()
-            if line.count('Exit Code:'):
-                self.log.debug('parse_table1() ending = NONE')
-                return None
-            elif not line:
-                self.log.debug('parse_table1() ending = DICT')
-                return d
-            else:
-                self.log.debug('  table row - adding to dict')
-                (name, value) = table_spec['row_split'](line, table_spec)
-                d[name] = value
+        if ctrl is None:
+            log.error('MegaCli found no adapters')
+            return None
+        return cond.state
 
 
-        
     def _get_controller_list(self):
         self.log.debug('_get_controller_list() starting')
 
         cmdline = '%s -adpcount' % self.program
-        self.log.debug('attempting cmd "%s"' % cmdline)
 
         d = dict()
-        try:
-            proc = Popen(cmdline.split(), shell=False, stdout=PIPE)
-        except OSError, ex:
-            self.log.exception('Specified backend command not found')
+        proc = self.start_command(cmdline)
+        if not proc:
             return False
 
         # Megacli only returns a count, which we then must convert to 0 based (subtract 1)
         # FIXME: next line does too much
-        count = int(self._parse_table0(proc.stdout, tables['cntrs'])['Controller Count'])
+        try:
+            info = dict([record for (section, record)
+                         in split_sections(proc.lines(), [Section('cntrs', tables['cntrs'])], [exit_code])])
+        finally:
+            proc.stop()
+        count = int(info['Controller Count'])
         for num in range(count):
             d[num] = None        # we have no data as yet - just the "identifier" itself
 
@@ -158,64 +286,97 @@ class MegaRaid(Controller):
         return d
     
 
-    def _get_controller_details(self, ctrl):
-        self.log.debug('_get_controller_details() starting')
+    def _get_controller_commands(self, ctrl):
+        self.log.debug('_get_controller_commands() starting')
 
-        d = dict() 
+        batch = list()
         for table in tables:
             if table == 'cntrs':
                 continue         # we already did this - we want the details of each controller now,
                                  # not the controller itself.
-            d[table] = self._get_controller_subdetail(ctrl, table)
-#            pprint(d[table])
+            if not self.wanted_table(table):
+                continue
+            args = dict(zip(['program', 'controller'], [self.program, ctrl]))
+            cmdline = commands[table] % args
+            batch.append(((ctrl, table), cmdline, self._parse_controller_subdetail))
+
+        self.log.debug('_get_controller_commands() ending')
+        return batch
 
-        self.log.debug('_get_controller_details() ending')
+    def _parse_adapter_tables(self, stdout, table):
+        self.log.debug('_parse_adapter_tables() starting')
+
+        # Output of an -aALL command - a vertical table per adapter, each one starting at an
+        # adapter header line. Returns a dict of controller -> that adapters vertical table.
+        sections = [Section('preamble'), self._entries_section(tables[table])]
+        boundaries = [Boundary(adapter_headers[table], 'entries', mark=True), exit_code]
+        d = dict()
+        entries = None      # entries of the adapter we're in the middle of
+        entry = list()      # (key, value) pairs of the entry we're in the middle of
+
+        for (section, record) in split_sections(stdout, sections, boundaries):
+            if isinstance(record, Mark):
+                # end of an entry
+                if entry:
+                    self._add_entry(entries, entry, table)
+                    entry = list()
+                if record is not BREAK:
+                    self.log.debug('  adapter header - starting controller %s' % record.match.group(1))
+                    entries = d.setdefault(int(record.match.group(1)), dict())
+            else:
+                entry.append(record)
+        if entry:
+            self._add_entry(entries, entry, table)
+
+        self.log.debug('_parse_adapter_tables() ending')
         return d
 
-    def _parse_vertical_table(self, iter, table_spec):
+
+    def _parse_vertical_table(self, stdout, table, skip=0):
         self.log.debug('_parse_vertical_table() starting')
 
+        # One block of key: value lines per entry, with blank lines in between.
+        sections = [self._entries_section(tables[table])]
         d = dict()
-        while True:
-            res = self._parse_table1(iter, table_spec)
-            if res:
-                d[res[table_spec['entry_name']]] = res
+        entry = list()
+
+        for (section, record) in split_sections(stdout, sections, [exit_code], skip=skip):
+            if record is BREAK:
+                if entry:
+                    self._add_entry(d, entry, table)
+                    entry = list()
             else:
-                return d
+                entry.append(record)
+        if entry:
+            self._add_entry(d, entry, table)
+
+        return d
+
+
+    def _entries_section(self, table_spec):
+        # In lazy mode we keep the lines as they are, and _add_entry() only splits the ones
+        # the checks need.
+        if self.lazy:
+            return Section('entries', blank='break', keep=True)
+        return Section('entries', table_spec, blank='break')
+
+
+    def _add_entry(self, entries, entry, table):
+        table_spec = tables[table]
+        if self.lazy:
+            record = lazy_record(table_spec['record'], entry, table_spec['delimiter'])
+        else:
+            record = table_spec['record'](entry)
+        entries[record[entry_names[table]]] = record
             
         
-    def _get_controller_subdetail(self, ctrl, table):
-        self.log.debug('_get_controller_subdetail() starting')
-        
+    def _parse_controller_subdetail(self, stdout, key):
+        self.log.debug('_parse_controller_subdetail() starting')
 
-        args = dict(zip(['program', 'controller'], [self.program, ctrl]))
-#        print 'args:'
-#        pprint(args)
-#        print 'table name:'
-#        pprint(table)
-#        print 'table spec:'
-#        pprint(tables[table])
-#        print 'command line string (before replacements):'
-#        pprint(tables[table]['commandline'])
-        cmdline = tables[table]['commandline'] % args
-        self.log.debug('attempting cmd "%s"' % cmdline)
-
-        d = dict()
-        try:
-            proc = Popen(cmdline.split(), shell=False, stdout=PIPE)
-        except OSError, ex:
-            self.log.exception('Specified backend command not found')
-            return False
+        (ctrl, table) = key
 
         # Skip over first 3 lines, and then parse the table.
-        for lineno in range(3):
-            if not proc.stdout.next():   # we explicitly don't care about the content of the lines, if any
-                # FIXME
-                raise Exception('parse error')
-
-#        d[table] = self._parse_vertical_table(proc.stdout, tables[table])
-#        return d
-        return self._parse_vertical_table(proc.stdout, tables[table])
+        return self._parse_vertical_table(stdout, table, skip=3)
 
 
     # FIXME: This is very spartan because I'm developing on a machine with all healthy raids.
@@ -223,44 +384,46 @@ class MegaRaid(Controller):
         log = logging.getLogger('controller.checkdetails')
         cond = Condition(Condition.OK)
 
+        # A table that wasn't selected (--only) wasn't collected - hence the get()s.
+
         # check the disks (physical drives)
-        for disk in self.details[ctrl]['disks'].keys():
+        for disk in self.details[ctrl].get('disks', {}).keys():
             detail = self.details[ctrl]['disks'][disk]
-            if detail['Firmware state'] != 'Online':
+            if detail.state != 'Online':
                 cond.warning()
                 log.warning('controller %s disk %s is not ok with Firmware State %s' 
-                          % (ctrl, disk, detail['Firmware state'])) 
-            if detail['Last Predictive Failure Event Seq Number'] != '0':
+                          % (ctrl, disk, detail.state)) 
+            if detail.predictive_event != 0:
                 cond.error()
                 log.error('controller %s disk %s is not ok with Last Predictive Event Number %s' 
-                          % (ctrl, disk, detail['Last Predictive Failure Event Seq Number'])) 
-            if detail['Media Error Count'] != '0':
+                          % (ctrl, disk, detail.predictive_event)) 
+            if detail.media_errors != 0:
                 cond.error()
                 log.error('controller %s disk %s is not ok with Media Error Count %s' 
-                          % (ctrl, disk, detail['Media Error Count'])) 
-            if detail['Predictive Failure Count'] != '0':
+                          % (ctrl, disk, detail.media_errors)) 
+            if detail.predictive_failures != 0:
                 cond.warning()
                 log.error('controller %s disk %s is not ok with Predictive Failure Count %s' 
-                          % (ctrl, disk, detail['Predictive Failure Count'])) 
+                          % (ctrl, disk, detail.predictive_failures)) 
                 
 
-        for enclosure in self.details[ctrl]['enclosures'].keys():
+        for enclosure in self.details[ctrl].get('enclosures', {}).keys():
             detail = self.details[ctrl]['enclosures'][enclosure]
-            if detail['Status'] != 'Normal':
+            if detail.state != 'Normal':
                 cond.error()
                 log.error('controller %s enclosure unit %s is not ok with status %s' 
-                          % (ctrl, raid, detail['Status'])) 
-            if detail['Number of Alarms'] != '0':
+                          % (ctrl, enclosure, detail.state)) 
+            if detail.alarms != 0:
                 cond.error()
                 log.error('controller %s enclosure unit %s is not ok with Numer of Alarms %s' 
-                          % (ctrl, raid, detail['Number of Alarms'])) 
+                          % (ctrl, enclosure, detail.alarms)) 
 
-        for volume in self.details[ctrl]['volumes'].keys():
+        for volume in self.details[ctrl].get('volumes', {}).keys():
             detail = self.details[ctrl]['volumes'][volume]
-            if detail['State'] != 'Optimal':
+            if detail.state != 'Optimal':
                 cond.error()
                 log.error('controller %s volume %s is not ok with State %s' 
-                          % (ctrl, volume, detail['State'])) 
+                          % (ctrl, volume, detail.state)) 
 
         return cond.state
 
@@ -0,0 +1,85 @@
+import logging
+import threading
+from Queue import Queue, Empty
+
+__version__ = '1.0'
+
+
+class GroupingHandler(logging.Handler):
+    """ Hold back the log records of worker threads, so that each worker's output can be
+    written out later as one block instead of interleaved with all the others. """
+
+    def __init__(self, target):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.groups = dict()
+
+    def start_group(self):
+        # Called from the worker thread - everything it logs until end_group() is held back.
+        self.groups[threading.currentThread()] = list()
+
+    def end_group(self):
+        return self.groups.pop(threading.currentThread(), list())
+
+    def replay(self, records):
+        for record in records:
+            self.target.handle(record)
+
+    def emit(self, record):
+        group = self.groups.get(threading.currentThread())
+        if group is None:
+            self.target.handle(record)
+        else:
+            group.append(record)
+
+    def flush(self):
+        self.target.flush()
+
+
+def run_parallel(func, items, workers, handler=None):
+    """ Call func(item) for every item, with at most 'workers' calls running at once.
+
+    Returns a list of (result, records) tuples in the same order as items. records are the
+    log records the call produced, held back by handler (a GroupingHandler) if one was
+    given. A call that raises has its exception logged and a result of None.
+    """
+    log = logging.getLogger('run_parallel')
+
+    results = [(None, list())] * len(items)
+    work = Queue()
+    for index in range(len(items)):
+        work.put(index)
+
+    def worker():
+        while True:
+            try:
+                index = work.get_nowait()
+            except Empty:
+                return
+            if handler:
+                handler.start_group()
+            try:
+                try:
+                    result = func(items[index])
+                except Exception:
+                    log.exception('worker for %s failed' % getattr(items[index], 'name', items[index]))
+                    result = None
+            finally:
+                records = list()
+                if handler:
+                    records = handler.end_group()
+            results[index] = (result, records)
+
+    threads = list()
+    for num in range(max(1, min(workers, len(items)))):
+        thread = threading.Thread(target=worker, name='worker-%s' % num)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+## END OF LINE ##
@@ -79,6 +79,285 @@ def row_delimiter_split(line, row_spec):
     return (name, value)
 
 
-        
+class TableSpec(object):
+    """ The row layout of a table, compiled once into a function that splits a row.
+
+    The row_* functions above look up and branch on everything in the spec for every line
+    they split - fine for 10 lines, not for a 1000 disk -pdlist. A TableSpec works out the
+    slices, split indices, delimiter and strip chain up front, and split(line) only does
+    the splitting. Whether to log every row is decided by splitter(), once per table read,
+    so there is nothing to pay for the tracing when debug logging is off.
+
+    It is only the rows: the command that prints a table, and how its output is split into
+    tables and entries, are the backend's to keep (its commands, headers...). With record, a
+    Record class, rows are split into records rather than dicts. A TableSpec still reads like
+    the old dicts - spec['name_field'] - and can still be handed to the row_* functions.
+    """
+
+    def __init__(self, row_split, name_field, fields_list=None, delimiter=None,
+                 value_field=None, strip_list=None, record=None):
+        self.spec = dict(row_split=row_split, name_field=name_field)
+        for (key, value) in [('fields_list', fields_list), ('delimiter', delimiter),
+                             ('value_field', value_field), ('strip_list', strip_list),
+                             ('record', record)]:
+            if value is not None:
+                self.spec[key] = value
+
+        self.name_field = name_field
+        self.fields_list = fields_list
+        if row_split == row_delimiter_split:
+            self._split = self._compile_delimiter(delimiter, name_field, value_field, strip_list or [])
+        elif row_split == row_whitespace_split:
+            self._split = self._compile_whitespace(fields_list)
+        elif row_split in (row_hybrid_split, row_fixed_split):
+            self._split = self._compile_fields(fields_list, name_field)
+        else:
+            raise Exception('programming fault, no TableSpec for row split %s' % row_split)
+
+        # rows that are records (see records.py) rather than dicts - a key: value table is
+        # made into records a block at a time by the backend instead
+        if record and row_split != row_delimiter_split:
+            self._split = self._compile_record(self._split, record)
+
+
+    def __getitem__(self, key):
+        return self.spec[key]
+
+
+    def __contains__(self, key):
+        return key in self.spec
+
+
+    def get(self, key, default=None):
+        return self.spec.get(key, default)
+
+
+    def split(self, line):
+        """ Split a row of the table into (name, value). """
+        return self.splitter()(line)
+
+
+    def splitter(self):
+        """ The function split() ends up calling - for loops that want to look it up once. """
+        # The specs are module level, shared by every backend and thread - so nothing about
+        # the logging is kept on them, it is asked each time.
+        if logging.getLogger('TableSpec.split').isEnabledFor(logging.DEBUG):
+            return self._traced
+        return self._split
+
+
+    def _traced(self, line):
+        log = logging.getLogger('TableSpec.split')
+
+        log.debug(line)
+        log.debug('0123456789A123456789B123456789C123456789D123456789E123456789F123456789G123456789H')
+        (name, value) = self._split(line)
+        log.debug('split into "%s" = %s' % (name, value))
+        return (name, value)
+
+
+    def _compile_delimiter(self, delimiter, name_field, value_field, strip_list):
+        strip_list = tuple(strip_list)
+        if strip_list == (None,):
+            # the usual case - just whitespace
+            def split(line):
+                info = line.split(delimiter, 1)
+                return (info[name_field].strip(), info[value_field].strip())
+        else:
+            def split(line):
+                info = line.split(delimiter, 1)   # ONE maxsplit, values can contain the delimiter
+                name = info[name_field]
+                value = info[value_field]
+                for charset in strip_list:
+                    name = name.strip(charset)
+                    value = value.strip(charset)
+                return (name, value)
+        return split
+
+
+    def _compile_whitespace(self, fields_list):
+        # short rows just get fewer fields
+        names = tuple(fields_list)
+        def split(line):
+            info = line.split()
+            return (info[0], dict(zip(names, info)))
+        return split
+
+
+    def _compile_record(self, split_dict, record):
+        def split(line):
+            (name, value) = split_dict(line)
+            return (name, record(value.iteritems()))
+        return split
+
+
+    def _compile_fields(self, fields_list, name_field):
+        # 2-tuples are whitespace split columns, 3-tuples fixed position ones
+        split_names = list()
+        split_indices = list()
+        slices = list()
+        for field in fields_list:
+            if len(field) == 2:
+                split_names.append(field[0])
+                split_indices.append(field[1])
+            elif len(field) == 3:
+                slices.append((field[0], slice(field[1], field[2])))
+            else:
+                raise Exception('programming fault, only 2 and 3 tuples allowed')
+        split_names = tuple(split_names)
+        slices = tuple(slices)
+
+        if not slices:
+            def split(line):
+                info = line.split()
+                d = dict(zip(split_names, [info[index] for index in split_indices]))
+                return (d[name_field], d)
+        elif not split_names:
+            def split(line):
+                d = dict()
+                for (name, columns) in slices:
+                    d[name] = line[columns].strip()
+                return (d[name_field], d)
+        else:
+            def split(line):
+                info = line.split()
+                d = dict(zip(split_names, [info[index] for index in split_indices]))
+                for (name, columns) in slices:
+                    d[name] = line[columns].strip()
+                return (d[name_field], d)
+        return split
+
+
+# Sections of tool output, and the lines that take us from one section to the next.
+#
+# split_sections() reads the output once, line by line, and yields (section, record) as it
+# goes: a row split by the section's TableSpec, the line itself for a section that keeps
+# its lines, or a Mark. The backends build their dicts from that - they never need the
+# whole output in memory, and none of them has its own table state machine any more.
+
+END = 'END'     # a Boundary to END stops the splitter
+
+
+class Mark(object):
+    """ Yielded in place of a row: where a Boundary was crossed (with the line that matched,
+    and the match object for a regex), or BREAK for a blank line in a section of blocks. """
+
+    def __init__(self, boundary=None, line='', match=None):
+        self.boundary = boundary
+        self.line = line
+        self.match = match
+
+
+BREAK = Mark()
+
+
+class Section(object):
+    """ One part of a tool's output.
+
+    Rows are split with spec; without one the lines are dropped - or yielded as they are
+    if keep is set. strip=False hands over the line with only its right side stripped, for
+    fixed position columns and indented trees. blank says what a blank line means: 'skip'
+    it, 'break' between blocks (yields BREAK), or 'end' of the section - on to section then.
+    """
+
+    def __init__(self, name, spec=None, blank='skip', then=END, strip=True, keep=False):
+        self.name = name
+        self.spec = spec
+        self.blank = blank
+        self.then = then
+        self.strip = strip
+        self.keep = keep
+
+
+class Boundary(object):
+    """ A line that takes us into section to. pattern is a string the line has to contain,
+    or a compiled regex searched for in it (the line is stripped for both).
+
+    within limits it to the sections named. A Mark is yielded for it if mark is set, and
+    with keep the line itself also goes to the new section.
+    """
+
+    def __init__(self, pattern, to, within=None, mark=False, keep=False):
+        self.pattern = pattern
+        self.to = to
+        self.within = within
+        self.mark = mark
+        self.keep = keep
+
+
+def split_sections(lines, sections, boundaries=(), start=None, skip=0):
+    """ Yield (section name, record) for lines, starting in section start (or the first
+    one) after skipping skip lines. """
+    # Everything about a section the loop needs, worked out once rather than per line:
+    # its boundaries, and one regex that matches wherever any of them might - so a row
+    # costs one search, however many boundaries there are.
+    states = dict()
+    for section in sections:
+        checks = list()
+        for boundary in boundaries:
+            if boundary.within is None or section.name in boundary.within:
+                if isinstance(boundary.pattern, basestring):
+                    checks.append((re.escape(boundary.pattern), None, boundary))
+                else:
+                    checks.append((boundary.pattern.pattern, boundary.pattern, boundary))
+        if [check for check in checks if check[1] and check[1].flags]:
+            search = lambda line: True        # can't combine those - try them one by one
+        elif checks:
+            search = re.compile('|'.join(['(?:%s)' % check[0] for check in checks])).search
+        else:
+            search = None
+        if section.spec:
+            split = section.spec.splitter()
+        else:
+            split = None
+        states[section.name] = (section.name, search, checks, split, section.blank,
+                                section.then, section.strip, section.keep)
+
+    (name, search, checks, split, blank, then, strip, keep) = states[start or sections[0].name]
+
+    for line in lines:
+        if skip:
+            skip -= 1
+            continue
+        stripped = line.strip()
+
+        if search and search(stripped):
+            # which one was it?
+            for (pattern, regex, boundary) in checks:
+                if regex:
+                    match = regex.search(stripped)
+                else:
+                    match = None
+                    if boundary.pattern in stripped:
+                        break
+                if match:
+                    break
+            else:
+                boundary = None
+            if boundary:
+                if boundary.mark:
+                    yield (boundary.to, Mark(boundary, stripped, match))
+                if boundary.to == END:
+                    return
+                (name, search, checks, split, blank, then, strip, keep) = states[boundary.to]
+                if not boundary.keep:
+                    continue
+
+        if not stripped:
+            if blank == 'break':
+                yield (name, BREAK)
+            elif blank == 'end':
+                if then == END:
+                    return
+                (name, search, checks, split, blank, then, strip, keep) = states[then]
+            continue
+
+        if not strip:
+            stripped = line.rstrip()
+        if split:
+            yield (name, split(stripped))
+        elif keep:
+            yield (name, stripped)
+
 
 ## END OF LINE ##
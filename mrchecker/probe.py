@@ -0,0 +1,160 @@
+""" --auto: which backends this machine needs, found without running anything.
+
+The PCI devices come straight from sys/bus/pci/devices/*/{vendor,device,class} - no lspci -
+and are looked up in known_devices. Linux software raid is there if sys/block has md arrays
+in it, zfs if its module is loaded (sys/module/zfs) or there is a dev/zfs. Each backend's
+program is looked for in the same places Controller.set_program() looks.
+
+The answer is kept in the state directory, and used as it is for as long as the list of PCI
+devices, the md and zfs answers and the programs' mtimes stay the same - a later run costs a
+couple of listdir()s and a stat() per backend instead of the whole probe.
+"""
+
+import logging
+import os
+
+from mrchecker.controller import find_exec
+
+__version__ = '1.0'
+
+
+# The order the backends are run in - and the modules they are in.
+backends = ['areca', 'threeware', 'megaraid', 'linuxsw', 'zpool']
+
+# (vendor, device, class, backend) - a device of None matches any device of that vendor,
+# and a class of None any class. The class is the base class and subclass, 0x0104 for RAID.
+known_devices = [
+    (0x17d3, None, None, 'areca'),          # Areca ARC-11xx, 12xx, 16xx and 18xx
+    (0x13c1, None, None, 'threeware'),      # 3ware 7000 to 9750, under AMCC and LSI too
+    (0x1000, None, 0x0104, 'megaraid'),     # LSI/Avago/Broadcom MegaRAID, Dell PERC, IBM ServeRAID M
+    (0x101e, None, 0x0104, 'megaraid'),     # the AMI MegaRAIDs before LSI bought them
+    (0x1028, 0x0015, None, 'megaraid'),     # Dell PERC 5 - a Dell vendor id on an LSI chip
+]
+
+
+def listdir(*path):
+    # sorted - and empty if it isn't there
+    try:
+        names = os.listdir(os.path.join(*path))
+    except OSError:
+        return []
+    names.sort()
+    return names
+
+
+def read_number(*path):
+    # sysfs has them as 0x17d3
+    try:
+        f = open(os.path.join(*path))
+        try:
+            return int(f.read().strip(), 16)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+
+
+def modified(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def find_program(candidates):
+    for name in candidates:
+        pathname = find_exec(name)
+        if pathname:
+            return pathname
+    return None
+
+
+def fingerprint(root):
+    """ What a probe's answer holds good for: the PCI devices, and if there are md arrays and zfs. """
+    md = len([name for name in listdir(root, 'sys', 'block') if name.startswith('md')]) > 0
+    zfs = os.path.isdir(os.path.join(root, 'sys', 'module', 'zfs')) or os.path.exists(os.path.join(root, 'dev', 'zfs'))
+    return (listdir(root, 'sys', 'bus', 'pci', 'devices'), md, zfs)
+
+
+def detect(root, seen):
+    """ The names of the backends the machine fingerprint() saw as seen needs. """
+    log = logging.getLogger('probe.detect')
+    (devices, md, zfs) = seen
+
+    found = list()
+    directory = os.path.join(root, 'sys', 'bus', 'pci', 'devices')
+    for slot in devices:
+        vendor = read_number(directory, slot, 'vendor')
+        device = read_number(directory, slot, 'device')
+        klass = read_number(directory, slot, 'class')
+        if vendor is None:
+            continue
+        for (known_vendor, known_device, known_class, backend) in known_devices:
+            if vendor != known_vendor or known_device not in (None, device):
+                continue
+            if known_class is not None and (klass is None or klass >> 8 != known_class):
+                continue
+            log.debug('%s is a %04x:%04x - %s' % (slot, vendor, device or 0, backend))
+            if backend not in found:
+                found.append(backend)
+            break
+    if md:
+        log.debug('there are md arrays - linuxsw')
+        found.append('linuxsw')
+    if zfs:
+        log.debug('zfs is loaded - zpool')
+        found.append('zpool')
+
+    return [backend for backend in backends if backend in found]
+
+
+def still_good(entry, seen):
+    log = logging.getLogger('probe.still_good')
+
+    if entry.get('fingerprint') != seen:
+        log.debug('the PCI devices, md arrays or zfs have changed - probing again')
+        return False
+    for (backend, program, mtime, candidates) in entry['backends']:
+        if program is None:
+            if find_program(candidates):
+                log.debug('%s has been installed since - probing again' % candidates[0])
+                return False
+        elif modified(program) != mtime:
+            log.debug('%s has changed - probing again' % program)
+            return False
+    return True
+
+
+def probe(root='/', cache=None):
+    """ The backends to check this machine with, as a list of (backend, program) - the program
+    None if it isn't installed. The answer is kept in, and taken from, cache (a ResultCache). """
+    log = logging.getLogger('probe.probe')
+
+    key = ('probe', os.path.abspath(root))
+    seen = fingerprint(root)
+    if cache:
+        entry = cache.get(key, None)
+        if entry and still_good(entry, seen):
+            log.debug('using the last probe: %s' % ', '.join([found[0] for found in entry['backends']]))
+            return [(backend, program) for (backend, program, mtime, candidates) in entry['backends']]
+
+    found = list()
+    for backend in detect(root, seen):
+        # the only time a backend module is imported just for its program_list
+        module = __import__('mrchecker.' + backend, globals(), locals(), ['program_list'])
+        candidates = module.program_list
+        program = find_program(candidates)
+        if program is None:
+            # not a warning - linuxsw --sysfs doesn't need its mdadm, and the others fail loudly enough
+            log.info('%s: none of %s is installed' % (backend, ', '.join(candidates)))
+            found.append((backend, None, None, candidates))
+        else:
+            found.append((backend, program, modified(program), candidates))
+    log.info('probed %s: %s' % (root, ', '.join([backend for (backend, program, mtime, candidates) in found]) or 'nothing'))
+
+    if cache:
+        cache.put(key, {'fingerprint': seen, 'backends': found})
+    return [(backend, program) for (backend, program, mtime, candidates) in found]
+
+
+## END OF LINE ##
@@ -0,0 +1,248 @@
+import re
+
+__version__ = '1.0'
+
+
+# Converters for the values the checks look at - run once, when the row is parsed. One that
+# can't make sense of a value hands back the string the tool printed instead; a check comparing
+# that with a number sees it as not ok, which is the safe side to fail on.
+
+def raw(value):
+    # kept just as it is
+    return value
+
+
+def number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def state(value):
+    # there are only a handful of different state strings - keep one copy of each
+    return intern(value)
+
+
+temperature_re = re.compile(r'^(-?\d+)\s*C\b')
+
+def temperature(value):
+    # "30C (86.00 F)" - degrees C
+    match = temperature_re.match(value)
+    if match:
+        return int(match.group(1))
+    return value
+
+
+sectors_re = re.compile(r'\[0x([0-9a-fA-F]+) Sectors\]')
+size_re = re.compile(r'^([\d.]+)\s*([KMGTP]?)(i?)B?$', re.IGNORECASE)
+multipliers = dict(K=1, M=2, G=3, T=4, P=5)
+
+def size(value, base=1000):
+    # "465.761 GB [0x3a386030 Sectors]" (MegaCli), "500.1GB" (areca), "1.81T" (zpool) - in bytes.
+    # Units are powers of 1000 unless they're KiB, MiB... or base says otherwise.
+    match = sectors_re.search(value)
+    if match:
+        return int(match.group(1), 16) * 512
+    match = size_re.match(value.strip())
+    if not match:
+        return value
+    (amount, unit, binary) = match.groups()
+    if binary:
+        base = 1024
+    if not unit:
+        return int(float(amount))
+    return int(float(amount) * base ** multipliers[unit.upper()])
+
+
+def binary_size(value):
+    # zpool list - "1.81T" means TiB
+    return size(value, 1024)
+
+
+def gigabytes(value):
+    # a column that is already in GB - 3ware's Size(GB)
+    try:
+        return int(float(value) * 1000 ** 3)
+    except ValueError:
+        return value
+
+
+def kibibytes(value):
+    # mdadm --detail "1953382400 (1862.89 GiB 2000.26 GB)" - the first number is KiB
+    try:
+        return int(value.split()[0]) * 1024
+    except (ValueError, IndexError):
+        return value
+
+
+class Record(object):
+    """ A parsed row - a disk, a volume... - the checks look at.
+
+    The fields the checks use live in slots, converted by the layout (tool key -> (slot,
+    converter)) when the record is made. Everything else the tool printed is kept as a tuple
+    of (key, value) pairs. Records still read like the dicts they replace - record['State'] -
+    and as_dict() gives back the whole thing for --dump-details.
+
+    The classes below give the slots for each kind of record; the backends subclass them with
+    the layout for their tool's output - which is also the list of fields their checks need,
+    the only ones a lazy_record() splits out up front.
+    """
+
+    __slots__ = ('extra',)
+    layout = {}
+
+    def __init__(self, items=()):
+        layout = self.layout
+        extra = list()
+        for (key, value) in items:
+            field = layout.get(key)
+            if field is None:
+                extra.append((intern(key), value))
+            else:
+                setattr(self, field[0], field[1](value))
+        self.extra = tuple(extra)
+
+
+    def _extra(self):
+        # the pairs - split out of the raw lines first, if this is a lazy record
+        if self.extra.__class__ is Lazy:
+            self.extra = self.extra.pairs()
+        return self.extra
+
+
+    def __getitem__(self, key):
+        field = self.layout.get(key)
+        if field is not None:
+            try:
+                return getattr(self, field[0])
+            except AttributeError:
+                raise KeyError(key)
+        for (name, value) in self._extra():
+            if name == key:
+                return value
+        raise KeyError(key)
+
+
+    def __setitem__(self, key, value):
+        field = self.layout.get(key)
+        if field is not None:
+            setattr(self, field[0], value)
+            return
+        extra = [(name, old) for (name, old) in self._extra() if name != key]
+        extra.append((intern(key), value))
+        self.extra = tuple(extra)
+
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def keys(self):
+        keys = [key for key in self.layout.keys() if hasattr(self, self.layout[key][0])]
+        return keys + [name for (name, value) in self._extra()]
+
+
+    def as_dict(self):
+        d = dict(self._extra())
+        for key in self.layout.keys():
+            if hasattr(self, self.layout[key][0]):
+                d[key] = getattr(self, self.layout[key][0])
+        return d
+
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.as_dict())
+
+
+class Disk(Record):
+    __slots__ = ('name', 'state', 'slot', 'enclosure', 'device', 'unit', 'size', 'temperature',
+                 'media_errors', 'other_errors', 'predictive_failures', 'predictive_event',
+                 'read_errors', 'write_errors', 'checksum_errors')
+
+
+class Volume(Record):
+    __slots__ = ('name', 'state', 'level', 'size', 'cache', 'auto_verify')
+
+
+class Array(Record):
+    __slots__ = ('name', 'state', 'level', 'size', 'disks', 'raid_devices', 'total_devices',
+                 'active_devices', 'working_devices', 'failed_devices', 'spare_devices')
+
+
+class Enclosure(Record):
+    __slots__ = ('name', 'state', 'alarms')
+
+
+class Bbu(Record):
+    __slots__ = ('name', 'state', 'online', 'ready', 'volt_state', 'temp_state', 'last_test')
+
+
+class Lazy(object):
+    """ The key: value lines of a record that no check needs - kept as the tool printed them,
+    in one string, and only split up if someone asks for them (--dump-details does). """
+
+    __slots__ = ('text', 'delimiter')
+
+    def __init__(self, lines, delimiter):
+        self.text = '\n'.join(lines)
+        self.delimiter = delimiter
+
+
+    def pairs(self):
+        pairs = list()
+        if not self.text:
+            return tuple(pairs)
+        for line in self.text.split('\n'):
+            info = line.split(self.delimiter, 1)
+            if len(info) == 2:
+                pairs.append((intern(info[0].strip()), info[1].strip()))
+            else:
+                pairs.append((intern(info[0].strip()), ''))
+        return tuple(pairs)
+
+
+def lazy_record(cls, lines, delimiter):
+    """ A cls record made from key: value lines, splitting out only the fields in its layout
+    now. The rest of the lines are kept as a Lazy. """
+    record = cls()
+    layout = cls.layout
+    rest = list()
+    for line in lines:
+        end = line.find(delimiter)
+        if end < 0:
+            rest.append(line)
+            continue
+        field = layout.get(line[:end].strip())
+        if field is None:
+            rest.append(line)
+        else:
+            setattr(record, field[0], field[1](line[end + 1:].strip()))
+    record.extra = Lazy(rest, delimiter)
+    return record
+
+
+def as_dicts(details):
+    """ details with every Record in it turned back into a dict, for --dump-details. """
+    if isinstance(details, Record):
+        return as_dicts(details.as_dict())
+    if isinstance(details, dict):
+        d = dict()
+        for key in details.keys():
+            d[key] = as_dicts(details[key])
+        return d
+    return details
+
+
+## END OF LINE ##
@@ -1,36 +1,103 @@
 
-from subprocess import Popen, PIPE
 import logging
+import re
 
-from raid_check.controller import Controller
-from raid_check.condition import Condition
+from mrchecker.controller import Controller
+from mrchecker.condition import Condition
+from mrchecker.parser import TableSpec, row_whitespace_split
+from mrchecker.parser import Section, Boundary, Mark, END, split_sections
+from mrchecker.records import Disk, Volume, Bbu, state, gigabytes
 
 
 __version__ = '1.0'
 
 
+class ThreewareVolume(Volume):
+    __slots__ = ()
+    layout = { 'unit': ('name', str),
+               'type': ('level', state),
+               'status': ('state', state),
+               'size': ('size', gigabytes),
+               'cache': ('cache', state),
+               'auto_verify': ('auto_verify', state),
+               }
+
+
+class ThreewareDisk(Disk):
+    __slots__ = ()
+    layout = { 'port': ('name', str),
+               'status': ('state', state),
+               'unit': ('unit', state),
+               }
+
+
+class ThreewareBbu(Bbu):
+    __slots__ = ()
+    layout = { 'name': ('name', str),
+               'status': ('state', state),
+               'onlinestate': ('online', state),
+               'bbuready': ('ready', state),
+               'volt': ('volt_state', state),
+               'temp': ('temp_state', state),
+               'lastcaptest': ('last_test', str),
+               }
+
+
 tables = {
-    'cntrs': (['controller', 'model', 'ports', 'drives', 'units', 'notopt', 'rrate', 'vrate', 'bbu_status'],
-              ['Ctl   Model        (V)Ports  Drives   Units   NotOpt  RRate   VRate  BBU',
-               'Ctl   Model        Ports   Drives   Units   NotOpt   RRate   VRate   BBU',
-               '------------------------------------------------------------------------']),
-    'units': (['unit', 'type', 'status', 'rebuild_complete', 'VIM', 'strip_size', 'size', 'cache', 'auto_verify'],
-              ['Unit  UnitType  Status         %RCmpl  %V/I/M  Stripe  Size(GB)  Cache  AVrfy',
-               '------------------------------------------------------------------------------']),
-    'ports': (['port', 'status', 'unit', 'size', 'size units', 'blocks', 'serial number'],
-              ['Port   Status           Unit   Size        Blocks        Serial',
-               '---------------------------------------------------------------']),
-    'bbus':  (['name', 'onlinestate', 'bbuready', 'status', 'volt', 'temp', 'hours', 'lastcaptest'],
-              ['Name  OnlineState  BBUReady  Status    Volt     Temp     Hours  LastCapTest',
-               '---------------------------------------------------------------------------'])
+    'cntrs': TableSpec(row_split=row_whitespace_split,
+                       name_field='controller',
+                       fields_list=['controller', 'model', 'ports', 'drives', 'units', 'notopt', 'rrate', 'vrate', 'bbu_status']),
+    'units': TableSpec(row_split=row_whitespace_split,
+                       record=ThreewareVolume,
+                       name_field='unit',
+                       fields_list=['unit', 'type', 'status', 'rebuild_complete', 'VIM', 'strip_size', 'size', 'cache', 'auto_verify']),
+    'ports': TableSpec(row_split=row_whitespace_split,
+                       record=ThreewareDisk,
+                       name_field='port',
+                       fields_list=['port', 'status', 'unit', 'size', 'size units', 'blocks', 'serial number']),
+    'bbus':  TableSpec(row_split=row_whitespace_split,
+                       record=ThreewareBbu,
+                       name_field='name',
+                       fields_list=['name', 'onlinestate', 'bbuready', 'status', 'volt', 'temp', 'hours', 'lastcaptest']),
+}
+
+# Where each table starts in tw_cli's output - its header line (the firmware versions don't
+# agree on those for the controller list), then a line of dashes.
+headers = {
+    'cntrs': ['Ctl   Model        (V)Ports  Drives   Units   NotOpt  RRate   VRate  BBU',
+              'Ctl   Model        Ports   Drives   Units   NotOpt   RRate   VRate   BBU',
+              '------------------------------------------------------------------------'],
+    'units': ['Unit  UnitType  Status         %RCmpl  %V/I/M  Stripe  Size(GB)  Cache  AVrfy',
+              '------------------------------------------------------------------------------'],
+    'ports': ['Port   Status           Unit   Size        Blocks        Serial',
+              '---------------------------------------------------------------'],
+    'bbus':  ['Name  OnlineState  BBUReady  Status    Volt     Temp     Hours  LastCapTest',
+              '---------------------------------------------------------------------------'],
 }
 
 
 program_list = ['tw_cli']
 
+# The columns of a port that stay as they are for as long as the drive does - all an inventory
+# keeps of the port table. The status is read every run, with /cN show drivestatus.
+port_inventory = ['size', 'size units', 'blocks', 'serial number']
+
+
+# tw_cli prints its "//hostname> " prompt in front of the output of every command it is fed
+# on stdin
+prompt = re.compile(r'^(//\S*> ?)+')
+
 
 class Threeware(Controller):
-    
+
+    # _check_controller_list() works off the controller list, so it has to be cached too
+    state_attrs = ['ctrl_list', 'details']
+    # The port tables - drive models and serials - and the controller list they were read with
+    inventory_attrs = ['inventory', 'inventory_list']
+    single_flight = True
+    selectable_tables = ['units', 'ports', 'bbus']
+    table_aliases = { 'units': 'volumes', 'ports': 'disks' }
+
     def __init__(self, program_name):
         super(Threeware, self).__init__(program_name, program_list)
         log = logging.getLogger('Controller.Threeware.init')
@@ -38,20 +105,222 @@ class Threeware(Controller):
         log.debug('Controller.Threeware.init ending')
 
 
-    def setup(self):
-        log = logging.getLogger('Controller.Threeware.setup')
+    def collect(self):
+        log = logging.getLogger('Controller.Threeware.collect')
+
+        if self.batch:
+            return self._collect_session()
 
-        self.ctrl_list = self._get_controller_list()
+        self.ctrl_list = self._select_controllers(self._get_controller_list())
         if not self.ctrl_list:
             return False
+        inventory = self._use_inventory()
+
+        # One tw_cli /cN show per controller (or the units and bbu, if we have the ports
+        # already) - let the Controller run them as a batch.
+        batch = list()
+        for ctrl in self.ctrl_list.keys():
+            for (command, names) in self._detail_commands(ctrl, inventory):
+                batch.append(((ctrl, names), '%s %s' % (self.program, command), self._parse_controller_details))
+
+        results = self.run_commands(batch)
         self.details = dict()
         for ctrl in self.ctrl_list.keys():
-            self.details[ctrl] = self._get_controller_details(ctrl)
+            self.details[ctrl] = dict()
+        for (ctrl, names) in results.keys():
+            if results[(ctrl, names)] is False:
+                return False
+            self.details[ctrl].update(results[(ctrl, names)])
+        self._keep_inventory(inventory)
+        return True
+
+
+    def _collect_session(self):
+        # Everything in one tw_cli run: "show" on stdin, and once we know the controllers
+        # a "/cN show" for each of them.
+        log = logging.getLogger('controller.threeware._collect_session')
+        log.debug('attempting a tw_cli session with "%s"' % self.program)
+
+        proc = self.start_command([self.program], stdin=True)
+        if not proc:
+            return False
+
+        try:
+            # Only read as far as the end of the table - tw_cli is waiting for its next command.
+            # With no controllers there is no table to end, and tw_cli's next prompt doesn't end
+            # a line until it has something after it: show ver (cheap - it doesn't go near the
+            # controllers) gets it one, so that an empty listing stops at it.
+            proc.write('show\nshow ver\n')
+            self.ctrl_list = self._select_controllers(self._parse_table(self._one_answer(proc.lines()), 'cntrs'))
             if not self.ctrl_list:
                 return False
+
+            inventory = self._use_inventory()
+            ctrls = self.ctrl_list.keys()
+            ctrls.sort()
+            commands = list()
+            for ctrl in ctrls:
+                commands.extend(['%s\n' % command for (command, names) in self._detail_commands(ctrl, inventory)])
+            proc.write(''.join(commands) + 'quit\n')
+            proc.close()
+            self.details = self._parse_session_details(proc.lines(), ctrls)
+            for line in proc.lines():
+                pass
+        finally:
+            proc.stop()
+        self._keep_inventory(inventory)
+
+        log.debug('tw_cli session found %s controllers' % len(ctrls))
+        return True
+
+
+    def _one_answer(self, lines):
+        # The lines of a session's answer to one command, without the prompt in front of it -
+        # up to the next prompt, the start of the answer to the next command.
+        prompts = 0
+        for line in lines:
+            match = prompt.match(line)
+            if match:
+                prompts += match.group(0).count('>')
+                if prompts > 1:
+                    return
+            yield prompt.sub('', line)
+
+
+    def wanted_controller(self, name):
+        # tw_cli's controllers are c0, c1... - --controller 0 picks c0 out, as it would the
+        # first MegaRaid adapter
+        if super(Threeware, self).wanted_controller(name):
+            return True
+        name = str(name)
+        return name.startswith('c') and super(Threeware, self).wanted_controller(name[1:])
+
+
+    def _select_controllers(self, ctrl_list):
+        log = logging.getLogger('controller.threeware._select_controllers')
+
+        if not ctrl_list:
+            log.error('tw_cli show found no controllers')
+            return ctrl_list
+        for ctrl in ctrl_list.keys():
+            if not self.wanted_controller(ctrl):
+                del ctrl_list[ctrl]
+        if not ctrl_list:
+            log.error('none of the selected controllers were found')
+        return ctrl_list
+
+
+    def _detail_tables(self, names=('units', 'ports', 'bbus')):
+        # The tables a command prints - /cN show prints them all, but we only keep the ones selected.
+        return dict([(table, dict()) for table in names if self.wanted_table(table)])
+
+
+    def _detail_commands(self, ctrl, inventory):
+        # (command, the tables it prints) for ctrl - with an inventory we want the units, the
+        # state of the ports and the bbu, and not everything else /cN show goes and gets.
+        if not inventory:
+            return [('/%s show' % ctrl, ('units', 'ports', 'bbus'))]
+        commands = [('/%s show unitstatus' % ctrl, ('units',)),
+                    ('/%s show drivestatus' % ctrl, ('ports',)),
+                    ('/%s/bbu show' % ctrl, ('bbus',))]
+        return [(command, names) for (command, names) in commands if self.wanted_table(names[0])]
+
+
+    def _use_inventory(self):
+        # Can we do without the port tables this time? Not if a controller came or went, or
+        # the number of drives or units on one changed since we read them - nor if a unit
+        # isn't optimal, when we want to see the ports as they are now.
+        if not self.tiered() or not self.load_inventory():
+            return False
+
+        ctrls = self.ctrl_list.keys()
+        ctrls.sort()
+        known = self.inventory_list.keys()
+        known.sort()
+        if ctrls != known:
+            self.inventory_changed('the controllers are now %s' % ', '.join(ctrls))
+            return False
+        for ctrl in ctrls:
+            (now, then) = (self.ctrl_list[ctrl], self.inventory_list[ctrl])
+            if now['drives'] != then['drives'] or now['units'] != then['units']:
+                self.inventory_changed('%s has %s drives and %s units' % (ctrl, now['drives'], now['units']))
+                return False
+            if now['notopt'] != '0':
+                self.inventory_changed('%s has a raid in non-optimal state' % ctrl)
+                return False
         return True
 
 
+    def _keep_inventory(self, inventory):
+        # Fill in what drivestatus doesn't say about the ports from the inventory - or if we've
+        # just read the whole port tables, keep their port_inventory columns.
+        if inventory:
+            for ctrl in self.details.keys():
+                known = self.inventory[ctrl].get('ports', {})
+                for (port, detail) in self.details[ctrl].get('ports', {}).items():
+                    for key in port_inventory:
+                        if key not in detail and known.get(port, {}).get(key) is not None:
+                            detail[key] = known[port][key]
+        elif self.tiered():
+            self.inventory = dict()
+            for ctrl in self.details.keys():
+                self.inventory[ctrl] = dict()
+                if 'ports' not in self.details[ctrl]:
+                    continue
+                ports = dict()
+                for (port, detail) in self.details[ctrl]['ports'].items():
+                    # not while a drive is in trouble - it may be about to be swapped for another
+                    if detail.state != 'OK':
+                        self.inventory_changed('%s port %s is %s' % (ctrl, port, detail.state))
+                        return
+                    ports[port] = dict([(key, detail[key]) for key in port_inventory if key in detail])
+                self.inventory[ctrl]['ports'] = ports
+            self.inventory_list = self.ctrl_list
+            self.save_inventory()
+
+
+    def _split_tables(self, lines, names, then='between'):
+        # Every table tw_cli prints is a header line, a line of dashes, the rows and a blank
+        # line. We go to the table whose header we see - and after it, to then.
+        sections = [Section('between')]
+        boundaries = list()
+        for name in names:
+            sections.append(Section(name, tables[name], blank='end', then=then))
+            (header, dashes) = (headers[name][:-1], headers[name][-1])
+            for line in header:
+                boundaries.append(Boundary(line, name, within=['between', name], mark=True))
+            # the shorter lines of dashes are part of the longer ones
+            boundaries.append(Boundary(dashes, name, within=[name]))
+        return split_sections(lines, sections, boundaries)
+
+
+    def _parse_session_details(self, stdout, ctrls):
+        log = logging.getLogger('controller.threeware._parse_session_details')
+
+        # The output of all the /cN show commands, in the order we sent them. A header for
+        # a table the current controller already has means we're on to the next controller.
+        d = dict()
+        for ctrl in ctrls:
+            d[ctrl] = self._detail_tables()
+        index = -1
+        seen = ['units', 'ports', 'bbus']
+
+        lines = (prompt.sub('', line) for line in stdout)
+        for (table, record) in self._split_tables(lines, ['units', 'ports', 'bbus']):
+            if isinstance(record, Mark):
+                if table in seen:
+                    index += 1
+                    seen = list()
+                    if index >= len(ctrls):
+                        log.warning('more tw_cli output than controllers - ignoring the rest')
+                        break
+                seen.append(table)
+            elif index >= 0 and table in d[ctrls[index]]:
+                d[ctrls[index]][table][record[0]] = record[1]
+
+        return d
+
+
     def check_all(self):
         log = logging.getLogger('controller.threeware.check_all')
         cond = Condition()
@@ -68,62 +337,66 @@ class Threeware(Controller):
         return cond.state
 
 
-    def _parse_table(self, iter, fields, ignore_lines):
-        d = dict()
-
-        for line in iter:
-            line = line.strip()
-            if not line:            # blank line means end of table
-                return d
-            if not line in ignore_lines:
-                info = line.split()
-                name = info[0]   
-                d[name] = dict(zip(fields, info))
+    def quick_check(self):
+        log = logging.getLogger('controller.threeware.quick_check')
+        cond = Condition()
 
+        # Just tw_cli show - the NotOpt column counts the units that aren't optimal.
+        proc = self.start_command('%s show' % self.program)
+        if not proc:
+            return None
+        ctrls = 0
+        for (table, record) in self._split_tables(proc.lines(), ['cntrs'], then=END):
+            if isinstance(record, Mark):
+                continue
+            (ctrl, value) = record
+            if not self.wanted_controller(ctrl):
+                continue
+            ctrls += 1
+            if value['notopt'] != '0':
+                cond.error()
+                log.error('%s controller has a raid in non-optimal state' % ctrl)
+                break
+        proc.stop(terminate=True)
 
-    def _get_controller_list(self):
-        log = logging.getLogger('controller.threeware._get_controller_list')
+        if not ctrls:
+            log.error('tw_cli show found no (selected) controllers')
+            return None
+        return cond.state
 
-        cmd = "%s show" % self.program
-        log.debug('attempting cmd "%s"' % cmd)
 
-        try:
-            proc = Popen(cmd, shell=True, stdout=PIPE)
-            iter = proc.stdout
-        except OSError, ex:
-            log.exception('Specified backend command not found')
-            return False
+    def _parse_table(self, lines, table):
+        d = dict()
 
-        # Skip over first line, and then parse the table.
-        if not iter.next() == '\n':
-            # FIXME
-            raise Exception('parse error')
+        for (section, record) in self._split_tables(lines, [table], then=END):
+            if not isinstance(record, Mark):
+                d[record[0]] = record[1]
 
-        return self._parse_table(iter, tables['cntrs'][0], tables['cntrs'][1])
+        return d
 
 
-    def _get_controller_details(self, ctrl):
-        log = logging.getLogger('controller.threeware._get_controller_details')
+    def _get_controller_list(self):
+        cmd = "%s show" % self.program
 
-        cmd = "%s /%s show" % (self.program, ctrl)
-        log.debug('attempting cmd "%s"' % cmd)
+        proc = self.start_command(cmd)
+        if not proc:
+            return False
 
-        d = dict()
         try:
-            proc = Popen(cmd, shell=True, stdout=PIPE)
-            iter = proc.stdout
-        except OSError, ex:
-            log.exception('Specified backend command not found')
-            return False
+            return self._parse_table(proc.lines(), 'cntrs')
+        finally:
+            proc.stop()
+
 
-        # Skip over first line, and then parse the table.
-        if not iter.next() == '\n':
-            # FIXME
-            raise Exception('parse error')
+    def _parse_controller_details(self, stdout, key):
+        # The unit, port and bbu tables (or the ones of them named) - any of them may be
+        # missing (no bbu fitted)
+        (ctrl, names) = key
+        d = self._detail_tables(names)
 
-        # First table is the unit table
-        for table in ['units', 'ports', 'bbus']:
-            d[table] = self._parse_table(iter, tables[table][0], tables[table][1])
+        for (table, record) in self._split_tables(stdout, ['units', 'ports', 'bbus']):
+            if not isinstance(record, Mark) and table in d:
+                d[table][record[0]] = record[1]
 
         return d
 
@@ -131,11 +404,12 @@ class Threeware(Controller):
         log = logging.getLogger('controller.threeware._check_controller_list')
         cond = Condition(Condition.OK)
 
+        # NotOpt is about the units, and BBU about the bbus - only check what was selected
         for ctrl in self.ctrl_list.keys():
-            if self.ctrl_list[ctrl]['notopt'] != '0':
+            if self.ctrl_list[ctrl]['notopt'] != '0' and self.wanted_table('units'):
                 cond.error()
                 log.error('%s controller has a raid in non-optimal state' % ctrl)
-            if self.ctrl_list[ctrl]['bbu_status'] != 'OK':
+            if self.ctrl_list[ctrl]['bbu_status'] != 'OK' and self.wanted_table('bbus'):
                 cond.error()
                 log.error('%s controller has a battery problem of "%s"' % (ctrl, self.ctrl_list[ctrl]['bbu_status']))
         return cond.state
@@ -145,47 +419,49 @@ class Threeware(Controller):
         log = logging.getLogger('controller.threeware._check_controller_details')
         cond = Condition(Condition.OK)
 
+        # A table that wasn't selected (--only) wasn't collected - hence the get()s.
+
         # check the raid units themselves
-        for unit in self.details[ctrl]['units'].keys():
+        for unit in self.details[ctrl].get('units', {}).keys():
             detail = self.details[ctrl]['units'][unit]
-            if detail['status'] != 'OK':
+            if detail.state != 'OK':
                 cond.error()
-                log.error('%s raid unit %s is not ok with status %s' % (ctrl, unit, detail['status'])) 
-            if detail['cache'] != 'ON' and detail['type'] != 'SPARE':
+                log.error('%s raid unit %s is not ok with status %s' % (ctrl, unit, detail.state)) 
+            if detail.cache != 'ON' and detail.level != 'SPARE':
                 cond.error()
                 log.error('%s raid unit %s has its cache turned off' % (ctrl, unit))
-            if detail['auto_verify'] != 'ON' and detail['type'] != 'SPARE':
+            if detail.auto_verify != 'ON' and detail.level != 'SPARE':
                 cond.warning()
                 log.warning('%s raid unit %s does not have auto verify on' % (ctrl, unit))
 
-        for port in self.details[ctrl]['ports'].keys():
+        for port in self.details[ctrl].get('ports', {}).keys():
             detail = self.details[ctrl]['ports'][port]
             # This one is a double check - if the port has an issue but doesn't belong to an active
             # raid, its not a problem  - at most a warning
-            if detail['status'] != 'OK' and detail['unit'] != '-':
+            if detail.state != 'OK' and detail.unit != '-':
                 cond.error()
-                log.error('%s port %s has a status of %s' % (ctrl, port, detail['status']))
+                log.error('%s port %s has a status of %s' % (ctrl, port, detail.state))
 
-        for bbu in self.details[ctrl]['bbus'].keys():
+        for bbu in self.details[ctrl].get('bbus', {}).keys():
             detail = self.details[ctrl]['bbus'][bbu]
-            if detail['status'] != 'OK':
+            if detail.state != 'OK':
                 cond.error()
-                log.error('%s bbu %s has a status of %s' % (ctrl, bbu, detail['status']))
-            if detail['bbuready'] != 'Yes':
+                log.error('%s bbu %s has a status of %s' % (ctrl, bbu, detail.state))
+            if detail.ready != 'Yes':
                 cond.error()
                 log.error('%s bbu %s is not ready' % (ctrl, bbu))
-            if detail['lastcaptest'] == 'xx-xxx-xxxx':
+            if detail.last_test == 'xx-xxx-xxxx':
                 cond.warning()
                 log.warn('%s bbu %s has not been capacity tested' % (ctrl, bbu))
-            if detail['onlinestate'] != 'On':
+            if detail.online != 'On':
                 cond.error()
                 log.error('%s bbu %s is not online' % (ctrl, bbu))
-            if detail['temp'] != 'OK':
+            if detail.temp_state != 'OK':
                 cond.error()
-                log.error('%s bbu %s has a temp problem (%s)' % (ctrl, bbu, detail['temp']))
-            if detail['volt'] != 'OK':
+                log.error('%s bbu %s has a temp problem (%s)' % (ctrl, bbu, detail.temp_state))
+            if detail.volt_state != 'OK':
                 cond.error()
-                log.error('%s bbu %s has a voltage problem (%s)' % (ctrl, bbu, detail['volt']))
+                log.error('%s bbu %s has a voltage problem (%s)' % (ctrl, bbu, detail.volt_state))
 
         return cond.state
 
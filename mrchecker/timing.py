@@ -0,0 +1,214 @@
+""" --profile: where the time of a run goes.
+
+Every run of a backend program (a Command - spawn to first byte, spawn to EOF, bytes read),
+every _parse_* and _check_*_details call and every setup/check_all/teardown of a backend is
+added up in the one Profile, and report() or summary() lists the steps slowest first.
+Nothing is timed until enable() is called, and only the backends instrument()ed.
+
+A parser reads its input as the backend program writes it, so the time a _parse_* spends
+waiting for the program is counted apart from its own.
+"""
+
+import re
+import threading
+import time
+
+__version__ = '1.0'
+
+
+profile = None      # the Profile, once enable() has been called
+
+# per thread - the seconds spent waiting for backend program output, so far
+local = threading.local()
+
+phases = ['setup', 'refresh', 'check_all', 'teardown', 'quick_check']
+steps = re.compile(r'^_parse_\w+$|^_check_\w+_details$')
+
+
+class Step(object):
+    """ One step's totals, over all of its calls. """
+
+    def __init__(self, backend, kind, name):
+        self.backend = backend
+        self.kind = kind            # program, parse, check or phase
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0          # a parser's own - not counting the waiting
+        self.waiting = 0.0
+        self.rows = 0               # lines read
+        self.bytes = 0
+        self.first_byte = None      # the slowest spawn to first byte
+
+
+class Profile(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = dict()         # (backend, kind, name) -> Step
+        self.started = time.time()
+
+
+    def add(self, backend, kind, name, seconds, rows=0, bytes=0, first_byte=None, waiting=0.0):
+        self.lock.acquire()
+        try:
+            key = (backend, kind, name)
+            step = self.steps.get(key)
+            if step is None:
+                step = self.steps[key] = Step(backend, kind, name)
+            step.calls += 1
+            step.seconds += seconds
+            step.waiting += waiting
+            step.rows += rows
+            step.bytes += bytes
+            if first_byte is not None and (step.first_byte is None or first_byte > step.first_byte):
+                step.first_byte = first_byte
+        finally:
+            self.lock.release()
+
+
+    def sorted_steps(self):
+        self.lock.acquire()
+        try:
+            steps = self.steps.values()
+        finally:
+            self.lock.release()
+        steps.sort(lambda a, b: cmp(b.seconds, a.seconds) or cmp(a.name, b.name))
+        return steps
+
+
+    def report(self):
+        """ The breakdown as a table, slowest first. """
+        lines = ['profile: %.3fs in all - a phase includes the steps it ran, a parser\'s seconds '
+                 'not its waiting for the program' % (time.time() - self.started),
+                 '%9s %9s %6s %8s %10s %8s  %-8s %s' % ('seconds', 'waiting', 'calls', 'rows', 'bytes',
+                                                         '1st byte', 'kind', 'step')]
+        for step in self.sorted_steps():
+            first_byte = '-'
+            if step.first_byte is not None:
+                first_byte = '%.3f' % step.first_byte
+            lines.append('%9.3f %9.3f %6d %8d %10d %8s  %-8s %s %s'
+                         % (step.seconds, step.waiting, step.calls, step.rows, step.bytes, first_byte,
+                            step.kind, step.backend, step.name))
+        return '\n'.join(lines) + '\n'
+
+
+    def summary(self, limit=10):
+        """ The slowest limit steps as one line, for syslog. """
+        steps = self.sorted_steps()
+        words = list()
+        for step in steps[:limit]:
+            text = '%s %s %.3fs' % (step.backend, step.name, step.seconds)
+            if step.calls > 1:
+                text += ' x%d' % step.calls
+            if step.kind == 'program':
+                text += ' %d bytes' % step.bytes
+                if step.first_byte is not None:
+                    text += ' first byte %.3fs' % step.first_byte
+            elif step.kind == 'parse':
+                text += ' %d rows' % step.rows
+                if step.waiting:
+                    text += ' waiting %.3fs' % step.waiting
+            words.append(text)
+        if len(steps) > limit:
+            words.append('%d more' % (len(steps) - limit))
+        return 'profile %.3fs: %s' % (time.time() - self.started, '; '.join(words))
+
+
+def enable():
+    global profile
+    profile = Profile()
+    return profile
+
+
+def reset():
+    # start adding up afresh - each --daemon cycle
+    if profile:
+        enable()
+
+
+def instrument(backend):
+    """ Time backend's phases, parsers and checks from now on. The methods are wrapped on
+    the backend object itself, so nothing else pays for it. """
+    for name in dir(backend):
+        if name in phases:
+            kind = 'phase'
+        elif steps.match(name):
+            kind = name.startswith('_parse_') and 'parse' or 'check'
+        else:
+            continue
+        setattr(backend, name, timed(backend.name, kind, name, getattr(backend, name)))
+
+
+class LineCounter(object):
+    """ Pass an iterator's lines on, counting them. """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.lines.next()
+        self.count += 1
+        return line
+
+
+def timed(backend, kind, name, func):
+    def call(*args, **kwargs):
+        counter = None
+        read = None
+        if kind == 'parse' and args:
+            if hasattr(args[0], 'lines_read'):
+                # a Command - areca's parsers read it themselves
+                read = args[0].lines_read
+            elif hasattr(args[0], 'next'):
+                counter = LineCounter(args[0])
+                args = (counter,) + args[1:]
+        if kind == 'phase':
+            # setup() runs refresh() - only the outermost phase counts
+            if getattr(local, 'phase', None):
+                return func(*args, **kwargs)
+            local.phase = name
+        waiting = waited()
+        started = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            waiting = waited() - waiting
+            if kind == 'phase':
+                local.phase = None
+            if kind != 'parse':
+                waiting = 0.0
+            rows = 0
+            if counter:
+                rows = counter.count
+            elif read is not None:
+                rows = args[0].lines_read - read
+            if profile:
+                profile.add(backend, kind, name, elapsed - waiting, rows=rows, waiting=waiting)
+    return call
+
+
+def waited(seconds=0.0):
+    """ Add seconds to the time this thread has waited for program output - and return the total. """
+    total = getattr(local, 'waiting', 0.0) + seconds
+    local.waiting = total
+    return total
+
+
+def command_done(command):
+    """ Add a finished Command's run to the profile. """
+    if not profile:
+        return
+    finished = command.eof or time.time()
+    first_byte = None
+    if command.first_byte is not None:
+        first_byte = command.first_byte - command.started
+    profile.add(command.owner, 'program', command.describe(), finished - command.started, rows=command.lines_read,
+                bytes=command.bytes_read, first_byte=first_byte)
+
+
+## END OF LINE ##
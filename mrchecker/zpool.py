@@ -1,48 +1,85 @@
 
-from subprocess import Popen, PIPE
 import logging
-from pprint import pprint
+import re
 
-from raid_check.controller import Controller
-from raid_check.condition import Condition
-from raid_check.parser import row_hybrid_split, row_delimiter_split
+from mrchecker.controller import Controller
+from mrchecker.condition import Condition
+from mrchecker.parser import TableSpec, row_hybrid_split, row_delimiter_split
+from mrchecker.parser import Section, Boundary, Mark, split_sections
+from mrchecker.records import Array, Disk, raw, number, state
 
 __version__ = '1.0'
 
 
-# FIXME: we mix the table, entry and row data in one dict here - very MESSY - seperate them
+class ZPoolArray(Array):
+    __slots__ = ()
+    layout = { 'pool': ('name', str),
+               'state': ('state', state),
+               'disks': ('disks', raw),
+               }
+
+
+class ZPoolDisk(Disk):
+    __slots__ = ()
+    layout = { 'name': ('name', str),
+               'state': ('state', state),
+               'read_errors': ('read_errors', number),
+               'write_errors': ('write_errors', number),
+               'checksum_errors': ('checksum_errors', number),
+               }
+
+
+# The zpool command for each table - and in batch mode, the one that covers every pool.
+commands = {
+    'zpools': '%(program)s list -H',
+    'zpool_details': '%(program)s status %(zpool)s',
+    # (no disks - they come out of the zpool_details command)
+    # --quick: just the health - named, as where it is in a plain list -H depends on the version
+    'health': '%(program)s list -H -o name,health',
+    }
+
+commands_batch = {
+    # zpool list in exact numbers, with the columns pinned to the ones we parse
+    'zpools': '%(program)s list -Hp -o name,size,allocated,free,capacity,health,altroot',
+    # one zpool status covering every pool
+    'zpool_details': '%(program)s status',
+    }
+
 tables = {
-    'zpools': { 'commandline': 'zpool list -H',
-                'row_split': row_hybrid_split,
-                'name_field': 'name',
-                'fields_list': [('name', 0),
-                                ('size', 1),
-                                ('used', 2),
-                                ('avail', 3),
-                                ('capacity', 4),
-                                ('health', 5),
-                                ('altroot', 6)],
-                # 'strip_list': [None, '.'],
-                },
+    'zpools': TableSpec(row_split=row_hybrid_split,
+                        name_field='name',
+                        fields_list=[('name', 0),
+                                     ('size', 1),
+                                     ('used', 2),
+                                     ('avail', 3),
+                                     ('capacity', 4),
+                                     ('health', 5),
+                                     ('altroot', 6)],
+                        # strip_list=[None, '.'],
+                        ),
     
-    'zpool_details': { 'commandline': 'zpool status %(zpool)s',
-                      'row_split': row_delimiter_split,
-                      'delimiter': ':',
-                      'name_field': 0,
-                      'value_field': 1,
-                      'strip_list': [None],
-                      },
+    'health': TableSpec(row_split=row_hybrid_split,
+                        name_field='name',
+                        fields_list=[('name', 0),
+                                     ('health', 1)],
+                        ),
     
-    'disks': { 'commandline': None,    # we got the data from the pool_details command...
-               'row_split': row_hybrid_split,
-               'name_field': 'name',
-               'fields_list': [('name', 0),
-                               ('state', 1),
-                               ('read_errors', 2),
-                               ('write_errors', 3),
-                               ('checksum_errors', 4)],
-               'strip_list': [None],
-               },
+    'zpool_details': TableSpec(row_split=row_delimiter_split,
+                               delimiter=':',
+                               name_field=0,
+                               value_field=1,
+                               strip_list=[None],
+                               ),
+    
+    'disks': TableSpec(row_split=row_hybrid_split,
+                       name_field='name',
+                       fields_list=[('name', 0),
+                                    ('state', 1),
+                                    ('read_errors', 2),
+                                    ('write_errors', 3),
+                                    ('checksum_errors', 4)],
+                       strip_list=[None],
+                       ),
 
     # Should we also include zfs actually?
     }
@@ -51,6 +88,24 @@ tables = {
 program_list = ['zpool']
 
 
+# Top level lines of the config tree that start a group of special devices rather than being
+# a vdev of their own.
+vdev_classes = ['logs', 'cache', 'spares', 'special', 'dedup']
+
+
+# zpool status: key: value lines (head), the config: tree and more key: value lines (tail)
+# for each pool in turn
+status_sections = [Section('head', strip=False, keep=True),
+                   Section('config'),
+                   Section('tree', blank='end', then='tail', strip=False, keep=True),
+                   Section('tail', strip=False, keep=True),
+                   ]
+status_boundaries = [Boundary(re.compile(r'^config:'), 'config', within=['head']),
+                     Boundary(re.compile(r'^NAME\s'), 'tree', within=['config'], mark=True),
+                     Boundary(re.compile(r'^pool:'), 'head', within=['tail'], keep=True),
+                     ]
+
+
 class ZPool(Controller):
     
     def __init__(self, program_name):
@@ -61,26 +116,75 @@ class ZPool(Controller):
         self.log.debug('__init__ ending')
 
 
-    def setup(self):
+    def collect(self):
         # Usually we do this by controller - in zpool/zfs, the OS _IS_ the controller,
         # so there can only be one. (VM's are their own OS, so thats irrelevant here I hope).
-        self.log.debug('setup() starting')
+        self.log.debug('collect() starting')
+
+        if self.batch:
+            return self._collect_batch()
 
         self.details = dict()
         zpool_list = self._get_zpool_list()
 
         if not zpool_list:
-            self.log.debug('setup() ending - didnt find any zpools - returning False')
+            self.log.debug('collect() ending - didnt find any zpools - returning False')
+            return False
+        for zpool in zpool_list.keys():
+            if not self.wanted_controller(zpool):
+                del zpool_list[zpool]
+        if not zpool_list:
+            self.log.error('none of the selected zpools were found')
             return False
 
+        # One zpool status per pool - let the Controller run them as a batch.
+        batch = list()
         for zpool in zpool_list.keys():
-            self.details[zpool] = self._get_zpool_details(zpool)
-            self.details[zpool]['summary'] = zpool_list[zpool]
+            args = dict(zip(['program', 'zpool'], [self.program, zpool]))
+            cmdline = commands['zpool_details'] % args
+            batch.append((zpool, cmdline, self._parse_zpool_details))
+
+        results = self.run_commands(batch)
+        for zpool in results.keys():
+            self.details[zpool] = results[zpool]
             if not self.details[zpool]:
-                self.log.debug('setup() ending - didnt find any details for a controller - returning False')
+                self.log.debug('collect() ending - didnt find any details for a controller - returning False')
                 return False
+            self.details[zpool]['summary'] = zpool_list[zpool]
 
-        self.log.debug('setup() ending - found zpool and details - returning True')
+        self.log.debug('collect() ending - found zpool and details - returning True')
+        return True
+
+
+    def _collect_batch(self):
+        # Two zpool runs whatever the number of pools - one list, one status for all of them.
+        self.log.debug('_collect_batch() starting')
+
+        # Both take a list of pools, for when only some were selected.
+        args = dict(zip(['program'], [self.program]))
+        pools = ''
+        if self.controllers is not None:
+            pools = ''.join([' %s' % zpool for zpool in self.controllers])
+        batch = [('list', commands_batch['zpools'] % args + pools,
+                  lambda stdout, key: self._parse_zpool_table(stdout, tables['zpools'])),
+                 ('status', commands_batch['zpool_details'] % args + pools,
+                  self._parse_zpool_status),
+                 ]
+        results = self.run_commands(batch)
+        if not results['list'] or not results['status']:
+            self.log.debug('_collect_batch() ending - didnt find any zpools - returning False')
+            return False
+
+        self.details = dict()
+        for zpool in results['status'].keys():
+            self.details[zpool] = results['status'][zpool]
+            if zpool in results['list']:
+                self.details[zpool]['summary'] = results['list'][zpool]
+            else:
+                # created or destroyed between the two commands
+                self.log.warning('zpool %s has a status but is not in the pool list' % zpool)
+
+        self.log.debug('_collect_batch() ending - found zpools and details - returning True')
         return True
 
 
@@ -97,16 +201,39 @@ class ZPool(Controller):
         return cond.state
 
 
+    def quick_check(self):
+        log = logging.getLogger('controller.zpool.quick_check')
+        cond = Condition()
+
+        # Just the health from zpool list - a pool that isn't ONLINE has something wrong under it.
+        args = dict(zip(['program'], [self.program]))
+        proc = self.start_command(commands['health'] % args)
+        if not proc:
+            return None
+        zpools = 0
+        sections = [Section('zpools', tables['health'])]
+        for (section, (name, value)) in split_sections(proc.lines(), sections):
+            if not self.wanted_controller(name):
+                continue
+            zpools += 1
+            if value['health'] != 'ONLINE':
+                cond.error()
+                log.error('zpool %s not ok with health %s' % (name, value['health']))
+                break
+        proc.stop(terminate=True)
+
+        if not zpools:
+            log.error('zpool list found no (selected) zpools')
+            return None
+        return cond.state
+
+
     def _parse_zpool_table(self, iter, table_spec):
         self.log.debug('parse_zpool_table() starting')
         
         d = dict()
 
-        for line in iter:
-            line = line.strip()
-            self.log.debug('  line is %s' % line)
-            self.log.debug('  table row - adding to dict')
-            (name, value) = table_spec['row_split'](line, table_spec)
+        for (section, (name, value)) in split_sections(iter, [Section('zpools', table_spec)]):
             d[name] = value
 
         return d
@@ -115,82 +242,128 @@ class ZPool(Controller):
     def _get_zpool_list(self):
         self.log.debug('_get_zpool_list() starting')
 
-        cmdline = tables['zpools']['commandline'] 
-        self.log.debug('attempting cmd "%s"' % cmdline)
+        args = dict(zip(['program'], [self.program]))
+        cmdline = commands['zpools'] % args
 
         d = dict()
-        try:
-            proc = Popen(cmdline.split(), shell=False, stdout=PIPE)
-        except OSError, ex:
-            self.log.exception('Specified backend command not found')
+        proc = self.start_command(cmdline)
+        if not proc:
             return False
 
-        d = self._parse_zpool_table(proc.stdout, tables['zpools'])
+        try:
+            d = self._parse_zpool_table(proc.lines(), tables['zpools'])
+        finally:
+            proc.stop()
         self.log.debug('_get_zpool_list() ending')
         return d
     
 
-    def _parse_table0(self, iter, table_spec):
-        self.log.debug('parse_table0() starting')
-        
-        d = dict()
-
-        for line in iter:
-            line = line.strip()
-            self.log.debug('  line is %s' % line)
-            if line.count('config:'):
-                self.log.debug('parse_table0() ending')
-                return d 
-            else:
-                self.log.debug('  table row - adding to dict')
-                (name, value) = table_spec['row_split'](line, table_spec)
-                d[name] = value
+    def _parse_zpool_details(self, stdout, zpool):
+        self.log.debug('_parse_zpool_details() starting')
 
-
-    def _parse_table1(self, iter, table_spec):
-        self.log.debug('parse_table1() starting')
-        
+        pools = self._parse_zpool_status(stdout, zpool)
+        if not zpool in pools:
+            self.log.error('zpool status %s said nothing about pool %s' % (zpool, zpool))
+            return False
+        return pools[zpool]
+
+
+    def _parse_zpool_status(self, stdout, key):
+        self.log.debug('_parse_zpool_status() starting')
+
+        # zpool status output for any number of pools, in one pass. Each pool is a block of
+        #
+        #     pool: tank                  <- key: value lines, with continuation lines
+        #    state: ONLINE                   starting with a tab
+        #   config:
+        #
+        #   \tNAME        STATE     READ WRITE CKSUM
+        #   \ttank        ONLINE       0     0     0      <- the vdev tree - nesting is
+        #   \t  mirror-0  ONLINE       0     0     0         shown by 2 space indents
+        #   \t    sda     ONLINE       0     0     0
+        #   \tspares
+        #   \t  sdc       AVAIL
+        #
+        #   errors: No known data errors
+        #
+        # For every pool we return the key: value lines, the vdev tree as nested dicts of
+        # names under 'vdevs', and every vdev and device under 'disks' - with the class
+        # ('data', 'logs', 'spares'...) and parent vdev it was found under.
+        fields = [field[0] for field in tables['disks']['fields_list']]
         d = dict()
-
-        for line in iter:
-            line = line.strip()
-            self.log.debug('  line is %s' % line)
-            if not line:
-                return d 
-            self.log.debug('  table row - adding to dict')
-            (name, value) = table_spec['row_split'](line, table_spec)
-            d[name] = value
-
+        pool = None
+
+        for (section, line) in split_sections(stdout, status_sections, status_boundaries):
+            if isinstance(line, Mark):
+                # the NAME STATE... header - the tree follows
+                if pool is None:
+                    continue
+                pool['vdevs'] = dict()
+                pool['disks'] = dict()
+                vdev_class = 'data'
+                stack = list()       # (depth, name, children) of the vdevs above this row
+                top_indent = None
+
+            elif section == 'tree':
+                stripped = line.strip()
+
+                # how deep in the tree are we - relative to the first (pool) row
+                indent = len(line.expandtabs()) - len(line.expandtabs().lstrip())
+                if top_indent is None:
+                    top_indent = indent
+                depth = (indent - top_indent) / 2
+
+                info = stripped.split(None, len(fields))
+                if depth == 0 and len(info) == 1 and info[0] in vdev_classes:
+                    vdev_class = info[0]
+                    stack = [(0, info[0], dict())]
+                    pool['vdevs'][info[0]] = stack[0][2]
+                    continue
+
+                while stack and stack[-1][0] >= depth:
+                    stack.pop()
+                value = dict(zip(fields, info))
+                for field in fields:
+                    value.setdefault(field, '')
+                if len(info) > len(fields):
+                    value['note'] = info[-1]      # things like "(resilvering)" or "was /dev/sdb"
+                value['class'] = vdev_class
+                if stack:
+                    value['parent'] = stack[-1][1]
+                    children = stack[-1][2]
+                else:
+                    value['parent'] = ''
+                    children = pool['vdevs']
+                children[value['name']] = dict()
+                stack.append((depth, value['name'], children[value['name']]))
+
+                # an in use hot spare shows up twice - in the data vdevs and under spares
+                name = value['name']
+                if name in pool['disks']:
+                    name = '%s (%s)' % (name, vdev_class)
+                self.log.debug('  vdev row %s at depth %s' % (name, depth))
+                pool['disks'][name] = ZPoolDisk(value.iteritems())
+
+            elif not line.startswith('\t') and line.count(':'):
+                (name, value) = tables['zpool_details'].split(line.strip())
+                if name == 'pool':
+                    self.log.debug('  start of pool %s' % value)
+                    pool = dict()
+                    d[value] = pool
+                elif pool is None:
+                    continue
+                pool[name] = value
+                last = name
+
+            elif section == 'head' and pool is not None:
+                # continuation of the last key: value line
+                pool[last] = ' '.join([pool[last], line.strip()])
+
+        for name in d.keys():
+            d[name] = ZPoolArray(d[name].iteritems())
+
+        self.log.debug('_parse_zpool_status() ending')
         return d
-    
-
-    def _get_zpool_details(self, zpool):
-        self.log.debug('_get_zpool_details() starting')
-
-        args = dict(zip(['zpool'], [zpool]))
-        cmdline = tables['zpool_details']['commandline'] % args
-        self.log.debug('attempting cmd "%s"' % cmdline)
-
-        try:
-            proc = Popen(cmdline.split(), shell=False, stdout=PIPE)
-        except OSError, ex:
-            self.log.exception('Specified backend command not found')
-            return False
-
-        d = self._parse_table0(proc.stdout, tables['zpool_details'])
-
-        # We're not done - after the zpool details, we get a list of the drives/vdevs in the zpool
-        # we need their state and name if nothing else.
-
-        # Skip over lines until we hit the table header
-        for line in proc.stdout:
-            line = line.strip()
-            if line.count('NAME'):
-                break
-
-        d['disks'] = self._parse_table1(proc.stdout, tables['disks'])
-
-        return  d
 
 
     # FIXME: This is very spartan because I'm developing on a machine with all healthy raids.
@@ -199,31 +372,38 @@ class ZPool(Controller):
         cond = Condition(Condition.OK)
 
         # check the disks (physical drives)
-        for disk in self.details[zpool]['disks'].keys():
-            detail = self.details[zpool]['disks'][disk]
-            if detail['state'] != 'ONLINE':
+        for disk in self.details[zpool].disks.keys():
+            detail = self.details[zpool].disks[disk]
+            if detail.get('class') == 'spares':
+                # spares only have a state - and theirs aren't ONLINE even when they're fine
+                if detail.state not in ['AVAIL', 'INUSE']:
+                    cond.warning()
+                    log.warning('zpool %s spare %s is not ok with state %s'
+                                % (zpool, disk, detail.state))
+                continue
+            if detail.state != 'ONLINE':
                 cond.error()
                 log.error('zpool %s disk %s is not ok with state %s' 
-                          % (zpool, disk, detail['state'])) 
-            if detail['checksum_errors'] != '0':
+                          % (zpool, disk, detail.state)) 
+            if detail.checksum_errors != 0:
                 cond.warning()
                 log.warning('zpool %s disk %s is not ok with checksum_errors %s' 
-                          % (zpool, disk, detail['checksum_errors'])) 
-            if detail['write_errors'] != '0':
+                          % (zpool, disk, detail.checksum_errors)) 
+            if detail.write_errors != 0:
                 cond.warning()
                 log.warning('zpool %s disk %s is not ok with write_errors %s' 
-                          % (zpool, disk, detail['write_errors'])) 
-            if detail['read_errors'] != '0':
+                          % (zpool, disk, detail.write_errors)) 
+            if detail.read_errors != 0:
                 cond.warning()
                 log.warning('zpool %s disk %s is not ok with read_errors %s' 
-                          % (zpool, disk, detail['read_errors'])) 
+                          % (zpool, disk, detail.read_errors)) 
                 
 
         detail = self.details[zpool]
-        if detail['state'] != 'ONLINE':
+        if detail.state != 'ONLINE':
             cond.error()
             log.error('zpool %s not ok with state %s' 
-                      % (zpool, detail['state'])) 
+                      % (zpool, detail.state)) 
             
             
         return cond.state
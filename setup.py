@@ -7,9 +7,8 @@ setup(name='mrchecker',
       author='Hunter Matthews',
       author_email='hunter@pobox.com',
       url='http://nowebsiteyet.com',
-      package_dir = {'': 'lib'},
-      packages=['raid_check'],
-      scripts=['scripts/raid-check'],
+      packages=['mrchecker'],
+      scripts=['mrchecker-cli'],
       )
 
 
@@ -0,0 +1,50 @@
+""" Behaviour checks of the backends' parsers and checks, over the captured tool outputs in
+corpus/ - the ones benchmarks/bench_suite.py times the parsers on, too - and of the Command
+the backend programs are run through. Run them from the top of the tree with
+
+    python -m unittest discover -s tests -t .
+
+(make test does that).
+"""
+
+import logging
+import os
+
+__version__ = '1.0'
+
+
+corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+
+def read_corpus(name):
+    f = open(os.path.join(corpus, name))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def corpus_lines(name):
+    # as a Command hands them to a parser - one at a time, without the newlines
+    return iter(read_corpus(name).splitlines())
+
+
+class LogRecorder(logging.Handler):
+    """ Keep the messages logged while it is installed - the checks say what they found there. """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = list()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+    def install(self):
+        logging.getLogger('').addHandler(self)
+        return self
+
+    def remove(self):
+        logging.getLogger('').removeHandler(self)
+
+
+## END OF LINE ##
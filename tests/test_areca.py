@@ -0,0 +1,78 @@
+import unittest
+
+from mrchecker.areca import Areca, tables
+from mrchecker.controller import CommandFailed
+from tests import LogRecorder, corpus_lines
+
+__version__ = '1.0'
+
+
+class Session(object):
+    """ What _parse_table() reads a cli64 answer from - one from the corpus. """
+
+    def __init__(self, name):
+        self.name = name
+        self.stopped = False
+
+    def lines(self):
+        return corpus_lines(self.name)
+
+    def stop(self, terminate=False):
+        self.stopped = True
+
+
+class ArecaTest(unittest.TestCase):
+    """ cli64 answers - a table, and the GuiErrMsg line every one of them ends with. """
+
+    def setUp(self):
+        self.log = LogRecorder().install()
+        self.backend = Areca('cli64')
+
+
+    def tearDown(self):
+        self.log.remove()
+
+
+    def parse(self, session):
+        return self.backend._parse_table(session, tables['ARC-1680']['raids'])
+
+
+    def test_raid_sets(self):
+        session = Session('cli64-rsf-info.txt')
+        raids = self.parse(session)
+        self.assertEqual(sorted(raids.keys()), ['1', '2'])
+        self.assertEqual(raids['2'].state, 'Normal')
+        self.assertFalse(session.stopped)
+
+
+    def test_truncated(self):
+        # cut off before the GuiErrMsg - the session is out of step with us, and is stopped
+        session = Session('cli64-rsf-info-truncated.txt')
+        self.assertRaises(CommandFailed, self.parse, session)
+        self.assertTrue(session.stopped)
+
+
+    def test_failed(self):
+        session = Session('cli64-rsf-info-failed.txt')
+        try:
+            self.parse(session)
+        except CommandFailed, ex:
+            self.assertEqual(str(ex), 'cli64 failed: GuiErrMsg<0x03>: Timeout.')
+        else:
+            self.fail('no CommandFailed')
+        self.assertTrue(session.stopped)
+
+
+    def test_collect_failed(self):
+        # the backend couldn't be checked - an error, not a traceback
+        self.backend.collect = lambda: self.parse(Session('cli64-rsf-info-failed.txt'))
+        self.assertEqual(self.backend._collect_state(), None)
+        self.assertFalse(self.backend.timed_out)
+        self.assertEqual(self.log.messages, ['Areca failed: cli64 failed: GuiErrMsg<0x03>: Timeout.'])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+## END OF LINE ##
@@ -0,0 +1,164 @@
+import os
+import signal
+import time
+import unittest
+
+from mrchecker import controller
+from mrchecker.controller import Command, CommandTimeout, Controller
+from tests import LogRecorder
+
+__version__ = '1.0'
+
+
+def gone(pid):
+    # exited - a zombie left for init to reap counts, it isn't running anything any more
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return True
+    try:
+        f = open('/proc/%s/stat' % pid)
+        try:
+            return f.read().split(')')[-1].split()[0] == 'Z'
+        finally:
+            f.close()
+    except IOError:
+        return True
+
+
+def read_all(proc):
+    lines = list()
+    try:
+        for line in proc.lines():
+            lines.append(line)
+    except CommandTimeout:
+        return (lines, True)
+    return (lines, False)
+
+
+class Stubborn(Command):
+    """ A program that even SIGKILL doesn't get rid of - one stuck in the kernel. """
+
+    def _signal(self, signum):
+        pass
+
+
+class Sessions(Controller):
+    """ A backend that remembers every program it ran. """
+
+    def __init__(self):
+        Controller.__init__(self, 'sh', ['sh'])
+        self.started = list()
+
+    def start_command(self, cmdline, stdin=False):
+        proc = Controller.start_command(self, cmdline, stdin)
+        self.started.append(proc)
+        return proc
+
+
+class CommandTest(unittest.TestCase):
+    """ --timeout: a backend program that doesn't finish in time is stopped, and always reaped. """
+
+    def setUp(self):
+        self.log = LogRecorder().install()
+        self.grace = Command.grace
+        Command.grace = 0.5
+        self.procs = list()
+
+
+    def tearDown(self):
+        Command.grace = self.grace
+        self.log.remove()
+        # nothing a failed test started is left behind
+        for proc in self.procs:
+            if proc and proc.poll() is None:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.proc.wait()
+
+
+    def start(self, script, timeout=1, command=Command):
+        proc = command(['sh', '-c', script], timeout)
+        self.assertTrue(proc.start())
+        self.procs.append(proc)
+        return proc
+
+
+    def test_finishes_in_time(self):
+        proc = self.start('echo one; echo two', timeout=0)
+        self.assertEqual(read_all(proc), (['one\n', 'two\n'], False))
+        self.assertEqual(proc.stop(), 0)
+
+
+    def test_deadline(self):
+        # the output that came before the deadline is still handed out
+        proc = self.start('echo one; echo two; exec sleep 30')
+        started = time.time()
+        self.assertEqual(read_all(proc), (['one\n', 'two\n'], True))
+        self.assertTrue(time.time() - started < 1 + Command.grace)
+        self.assertNotEqual(proc.poll(), None)
+        self.assertEqual(proc.proc.returncode, -signal.SIGTERM)
+        self.assertTrue(gone(proc.pid))
+
+
+    def test_sigterm_ignored(self):
+        proc = self.start('trap "" TERM; exec sleep 30')
+        self.assertEqual(read_all(proc), ([], True))
+        self.assertEqual(proc.proc.returncode, -signal.SIGKILL)
+        self.assertTrue('sh (pid %s) ignored SIGTERM - killing it' % proc.pid in self.log.messages)
+
+
+    def test_process_group(self):
+        # what the program started goes with it - it has the program's stdout, too
+        proc = self.start('sleep 30 & echo $!; wait')
+        (lines, timed_out) = read_all(proc)
+        self.assertTrue(timed_out)
+        child = int(lines[0])
+        deadline = time.time() + 5
+        while not gone(child) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(gone(child))
+
+
+    def test_unreaped(self):
+        proc = self.start('exec sleep 30', command=Stubborn)
+        self.assertEqual(read_all(proc), ([], True))
+        self.assertEqual(proc.poll(), None)
+        self.assertTrue(proc.proc in controller.unreaped)
+        self.assertTrue('sh (pid %s) will not die - leaving it' % proc.pid in self.log.messages)
+
+        # once it does go, the next Command to start reaps it
+        os.killpg(proc.pid, signal.SIGKILL)
+        time.sleep(0.2)
+        self.start('true')
+        self.assertFalse(proc.proc in controller.unreaped)
+        self.assertEqual(proc.proc.returncode, -signal.SIGKILL)
+
+
+    def run_commands(self, concurrency):
+        backend = Sessions()
+        backend.timeout = 1
+        backend.concurrency = concurrency
+        batch = [('fast', 'echo fast', lambda lines, key: list(lines)),
+                 ('hung', ['sh', '-c', 'echo hung; exec sleep 30'], lambda lines, key: list(lines))]
+        self.assertRaises(CommandTimeout, backend.run_commands, batch)
+        self.procs.extend(backend.started)
+        self.assertEqual(len(backend.started), 2)
+        for proc in backend.started:
+            self.assertNotEqual(proc.poll(), None)
+            self.assertTrue(gone(proc.pid))
+
+
+    def test_run_commands(self):
+        self.run_commands(1)
+
+
+    def test_run_commands_jobs(self):
+        # --jobs: the timeout in the worker thread is raised again here
+        self.run_commands(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+## END OF LINE ##
@@ -0,0 +1,69 @@
+import logging
+import sys
+import unittest
+
+from mrchecker.csysloghandler import coalesced
+
+__version__ = '1.0'
+
+
+def record(msg, name='controller.checkdetails', levelno=logging.ERROR):
+    return logging.makeLogRecord({'name': name, 'levelno': levelno,
+                                  'levelname': logging.getLevelName(levelno), 'msg': msg})
+
+
+def messages(records):
+    return [record.getMessage() for record in coalesced(records)]
+
+
+class CoalescedTest(unittest.TestCase):
+    """ --syslog-coalesce: which of the queued messages are merged, and into what. """
+
+    def test_one_controller(self):
+        records = [record('controller 0 disk %d is not ok with Media Error Count 3' % disk)
+                   for disk in (10, 4, 9, 4)]
+        self.assertEqual(messages(records),
+                         ['4 times: controller 0 disk {4,9,10} is not ok with Media Error Count 3'])
+
+
+    def test_per_controller(self):
+        # which disk is on which controller isn't lost - a line per controller, every disk in it
+        records = [record('controller %d disk %d is not ok with Media Error Count 3' % (ctrl, disk))
+                   for ctrl in (0, 1) for disk in range(20)]
+        disks = ','.join([str(disk) for disk in range(20)])
+        self.assertEqual(messages(records),
+                         ['20 times: controller 0 disk {%s} is not ok with Media Error Count 3' % disks,
+                          '20 times: controller 1 disk {%s} is not ok with Media Error Count 3' % disks])
+
+
+    def test_two_words_differ(self):
+        records = [record('controller 0 disk 4 is not ok with Media Error Count 3'),
+                   record('controller 1 disk 7 is not ok with Media Error Count 3'),
+                   record('controller 0 disk 5 is not ok with Media Error Count 1'),
+                   record('controller 0 disk 6 is not ok with Media Error Count 1')]
+        self.assertEqual(messages(records),
+                         ['controller 0 disk 4 is not ok with Media Error Count 3',
+                          'controller 1 disk 7 is not ok with Media Error Count 3',
+                          '2 times: controller 0 disk {5,6} is not ok with Media Error Count 1'])
+
+
+    def test_kept_apart(self):
+        # a different logger, level or wording - and anything with a traceback - is never merged
+        try:
+            raise ValueError('bad')
+        except ValueError:
+            broken = record('controller 0 disk 6 is not ok with Media Error Count 3')
+            broken.exc_info = sys.exc_info()
+        records = [record('controller 0 disk 4 is not ok with Media Error Count 3'),
+                   record('controller 0 disk 5 is not ok with Media Error Count 3', levelno=logging.WARNING),
+                   record('controller 0 disk 5 is not ok with Media Error Count 3', name='controller.quick_check'),
+                   record('controller 0 disk 5 is not ok with Other Error Count 3'),
+                   broken]
+        self.assertEqual(coalesced(records), records)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+## END OF LINE ##
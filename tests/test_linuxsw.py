@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mrchecker.condition import Condition
+from mrchecker.linuxsw import LinuxSW
+from tests import LogRecorder, corpus_lines, read_corpus
+
+__version__ = '1.0'
+
+
+class MdadmTest(unittest.TestCase):
+    """ mdadm --detail output, parsed and checked. """
+
+    def setUp(self):
+        self.log = LogRecorder().install()
+        self.backend = LinuxSW('mdadm')
+
+
+    def tearDown(self):
+        self.log.remove()
+
+
+    def check(self, name, array, lazy=False):
+        self.backend.lazy = lazy
+        self.backend.details = {array: self.backend._parse_array_details(corpus_lines(name), array)}
+        return self.backend.check_all()
+
+
+    def test_clean(self):
+        self.assertEqual(self.check('mdadm-detail.txt', '/dev/md0'), Condition.OK)
+        self.assertEqual(self.log.messages, [])
+        self.assertEqual(len(self.backend.details['/dev/md0'].disks), 6)
+
+
+    def test_removed_member(self):
+        # Total Devices and Working Devices are both 1 - only Raid Devices says one is missing
+        for lazy in (False, True):
+            self.log.messages = list()
+            self.assertEqual(self.check('mdadm-detail-removed.txt', '/dev/md1', lazy), Condition.ERROR)
+            self.assertTrue('array /dev/md1 is not ok with Raid Devices 2 != Active Devices 1' in self.log.messages)
+
+
+    def test_faulty_member(self):
+        self.assertEqual(self.check('mdadm-detail-faulty.txt', '/dev/md2'), Condition.ERROR)
+        self.assertTrue('array /dev/md2 not ok with Failed Devices 1' in self.log.messages)
+        self.assertTrue('array /dev/md2 disk 2 is not ok with state faulty' in self.log.messages)
+
+
+class SysfsTest(unittest.TestCase):
+    """ --sysfs: /proc/mdstat and /sys/block/md*/md, in a tree written for each test. """
+
+    def setUp(self):
+        self.log = LogRecorder().install()
+        self.root = tempfile.mkdtemp(prefix='mrchecker-test-')
+        self.backend = LinuxSW('mdadm')
+        self.backend.use_sysfs = True
+        self.backend.sysfs_root = self.root
+
+
+    def tearDown(self):
+        self.log.remove()
+        shutil.rmtree(self.root)
+
+
+    def write(self, path, text):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+
+
+    def write_array(self, mdstat, level, raid_disks, degraded, members):
+        """ md0 with members - a list of (device, state, slot) - and its mdstat from the corpus. """
+        self.write('proc/mdstat', read_corpus(mdstat))
+        md = 'sys/block/md0/md'
+        for (name, value) in [('level', level), ('array_state', 'clean'), ('raid_disks', raid_disks),
+                              ('degraded', degraded), ('sync_action', 'idle')]:
+            self.write('%s/%s' % (md, name), '%s\n' % value)
+        for (device, state, slot) in members:
+            self.write('%s/dev-%s/state' % (md, device), '%s\n' % state)
+            self.write('%s/dev-%s/slot' % (md, device), '%s\n' % slot)
+
+
+    def check(self):
+        self.assertTrue(self.backend.collect())
+        return self.backend.check_all()
+
+
+    def test_clean(self):
+        self.write_array('mdstat-raid1.txt', 'raid1', 2, 0, [('sda1', 'in_sync', 0), ('sdb1', 'in_sync', 1)])
+        self.assertEqual(self.check(), Condition.OK)
+        self.assertEqual(self.backend.quick_check(), Condition.OK)
+        self.assertEqual(self.log.messages, [])
+
+
+    def test_removed_member(self):
+        # the member is gone from sysfs altogether - nothing is faulty, only missing
+        self.write_array('mdstat-raid1-removed.txt', 'raid1', 2, 1, [('sda1', 'in_sync', 0)])
+        self.assertEqual(self.check(), Condition.ERROR)
+        self.assertTrue('array /dev/md0 is not ok with Degraded 1' in self.log.messages)
+        self.assertTrue('array /dev/md0 is not ok with Raid Devices 2 != Active Devices 1' in self.log.messages)
+        self.assertEqual(self.backend.quick_check(), Condition.ERROR)
+
+
+    def test_faulty_member(self):
+        self.write_array('mdstat-raid5-faulty.txt', 'raid5', 3, 1,
+                         [('sda1', 'in_sync', 0), ('sdb1', 'in_sync', 1), ('sdc1', 'faulty', 'none')])
+        self.assertEqual(self.check(), Condition.ERROR)
+        self.assertTrue('array /dev/md0 not ok with Failed Devices 1' in self.log.messages)
+        self.assertTrue('array /dev/md0 disk 3 is not ok with state faulty' in self.log.messages)
+        self.assertEqual(self.backend.quick_check(), Condition.ERROR)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+## END OF LINE ##
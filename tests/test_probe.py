@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mrchecker.cache import ResultCache
+from mrchecker.probe import detect, fingerprint, probe
+from tests import LogRecorder
+
+__version__ = '1.0'
+
+
+class ProbeTest(unittest.TestCase):
+    """ --auto: the backends a machine needs, from a sys/ tree written for each test. """
+
+    def setUp(self):
+        self.log = LogRecorder().install()
+        self.root = tempfile.mkdtemp(prefix='mrchecker-test-')
+        self.cache = ResultCache(os.path.join(self.root, 'state'))
+
+
+    def tearDown(self):
+        self.log.remove()
+        shutil.rmtree(self.root)
+
+
+    def write(self, path, text):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+
+
+    def add_device(self, slot, vendor, device, klass):
+        """ A PCI device, with its ids as sysfs has them - 0x1000 and 0x010400. """
+        for (name, value) in [('vendor', '0x%04x' % vendor), ('device', '0x%04x' % device),
+                              ('class', '0x%06x' % klass)]:
+            self.write('sys/bus/pci/devices/%s/%s' % (slot, name), '%s\n' % value)
+
+
+    def detect(self):
+        return detect(self.root, fingerprint(self.root))
+
+
+    def probe(self):
+        return [backend for (backend, program) in probe(self.root, self.cache)]
+
+
+    def test_nothing(self):
+        self.add_device('0000:00:1f.2', 0x8086, 0x2922, 0x010601)     # an AHCI controller
+        self.assertEqual(self.detect(), [])
+
+
+    def test_vendors(self):
+        # areca and 3ware go by the vendor alone - and come out in the order they're run in
+        self.add_device('0000:05:00.0', 0x13c1, 0x1010, 0x010400)
+        self.add_device('0000:03:00.0', 0x17d3, 0x1880, 0x010400)
+        self.add_device('0000:04:00.0', 0x17d3, 0x1880, 0x010400)
+        self.assertEqual(self.detect(), ['areca', 'threeware'])
+
+
+    def test_megaraid(self):
+        self.add_device('0000:03:00.0', 0x1000, 0x005d, 0x010400)
+        self.assertEqual(self.detect(), ['megaraid'])
+
+
+    def test_sas_hba(self):
+        # an LSI SAS HBA (class 0x0107) has no MegaRAID on it for MegaCli to find
+        self.add_device('0000:03:00.0', 0x1000, 0x0097, 0x010700)
+        self.assertEqual(self.detect(), [])
+
+
+    def test_perc5(self):
+        # a Dell vendor id, of any class
+        self.add_device('0000:03:00.0', 0x1028, 0x0015, 0x010000)
+        self.add_device('0000:04:00.0', 0x1028, 0x0016, 0x010400)
+        self.assertEqual(self.detect(), ['megaraid'])
+
+
+    def test_md_and_zfs(self):
+        self.write('sys/block/sda/size', '1953525168\n')
+        self.assertEqual(self.detect(), [])
+        self.write('sys/block/md0/size', '1953260928\n')
+        self.write('sys/module/zfs/version', '2.1.5-1\n')
+        self.add_device('0000:03:00.0', 0x17d3, 0x1880, 0x010400)
+        self.assertEqual(self.detect(), ['areca', 'linuxsw', 'zpool'])
+
+
+    def test_cached(self):
+        self.add_device('0000:03:00.0', 0x17d3, 0x1880, 0x010400)
+        self.assertEqual(self.probe(), ['areca'])
+        # the same list of devices - the last answer is used, without reading them again
+        self.add_device('0000:03:00.0', 0x13c1, 0x1010, 0x010400)
+        self.assertEqual(self.probe(), ['areca'])
+        self.assertEqual([backend for (backend, program) in probe(self.root)], ['threeware'])
+
+
+    def test_cache_invalidated(self):
+        self.add_device('0000:03:00.0', 0x17d3, 0x1880, 0x010400)
+        self.assertEqual(self.probe(), ['areca'])
+        self.add_device('0000:04:00.0', 0x1000, 0x005d, 0x010400)
+        self.assertEqual(self.probe(), ['areca', 'megaraid'])
+        shutil.rmtree(os.path.join(self.root, 'sys/bus/pci/devices/0000:03:00.0'))
+        self.assertEqual(self.probe(), ['megaraid'])
+        self.write('sys/block/md0/size', '1953260928\n')
+        self.assertEqual(self.probe(), ['megaraid', 'linuxsw'])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+## END OF LINE ##
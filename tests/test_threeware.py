@@ -0,0 +1,59 @@
+import unittest
+
+from mrchecker.condition import Condition
+from mrchecker.threeware import Threeware, port_inventory
+from tests import LogRecorder, corpus_lines
+
+__version__ = '1.0'
+
+
+class InventoryTest(unittest.TestCase):
+    """ --inventory-age: what of the port tables is kept between runs, and what is read every run. """
+
+    def setUp(self):
+        self.log = LogRecorder().install()
+        self.backend = Threeware('tw_cli')
+        self.backend.inventory_age = 600
+        self.backend.ctrl_list = self.backend._parse_table(corpus_lines('tw_cli-show.txt'), 'cntrs')
+
+
+    def tearDown(self):
+        self.log.remove()
+
+
+    def read(self, name, names, inventory):
+        self.backend.details = {'c0': self.backend._parse_controller_details(corpus_lines(name), ('c0', names))}
+        self.backend._keep_inventory(inventory)
+
+
+    def test_only_fixed_columns_kept(self):
+        self.read('tw_cli-c0-show.txt', ('units', 'ports', 'bbus'), False)
+        self.assertTrue(self.backend.load_inventory())
+        ports = self.backend.inventory['c0']['ports']
+        self.assertEqual(len(ports), 12)
+        self.assertEqual(sorted(ports['p3'].keys()), sorted(port_inventory))
+        self.assertEqual(ports['p3']['serial number'], '9QG000003')
+
+
+    def test_port_state_read_every_run(self):
+        # a member port erroring while its unit (and NotOpt) still say OK
+        self.read('tw_cli-c0-show.txt', ('units', 'ports', 'bbus'), False)
+        self.assertTrue(self.backend._use_inventory())
+        self.assertEqual([command for (command, names) in self.backend._detail_commands('c0', True)],
+                         ['/c0 show unitstatus', '/c0 show drivestatus', '/c0/bbu show'])
+        self.read('tw_cli-c0-drivestatus.txt', ('ports',), True)
+        self.assertEqual(self.backend.details['c0']['ports']['p3'].state, 'DEVICE-ERROR')
+        self.assertEqual(self.backend._check_controller_details('c0'), Condition.ERROR)
+        self.assertTrue('c0 port p3 has a status of DEVICE-ERROR' in self.log.messages)
+
+
+    def test_no_inventory_of_a_port_in_trouble(self):
+        self.read('tw_cli-c0-drivestatus.txt', ('ports',), False)
+        self.assertFalse(self.backend.load_inventory())
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+## END OF LINE ##
@@ -0,0 +1,105 @@
+import unittest
+
+from mrchecker.condition import Condition
+from mrchecker.zpool import ZPool, tables
+from tests import LogRecorder, corpus_lines
+
+__version__ = '1.0'
+
+
+class ZPoolTest(unittest.TestCase):
+    """ zpool status output - the vdev tree and the checks over it. """
+
+    def setUp(self):
+        self.log = LogRecorder().install()
+        self.backend = ZPool('zpool')
+
+
+    def tearDown(self):
+        self.log.remove()
+
+
+    def check(self, name):
+        self.backend.details = self.backend._parse_zpool_status(corpus_lines(name), None)
+        return self.backend.check_all()
+
+
+    def test_healthy(self):
+        self.assertEqual(self.check('zpool-status.txt'), Condition.OK)
+        self.assertEqual(self.log.messages, [])
+
+        pools = self.backend.details
+        self.assertEqual(sorted(pools.keys()), ['tank', 'tank1'])
+        tank = pools['tank']
+        self.assertEqual(tank['state'], 'ONLINE')
+        self.assertEqual(sorted(tank['vdevs']['tank'].keys()), ['mirror-0', 'mirror-1'])
+        self.assertEqual(sorted(tank['vdevs']['tank']['mirror-1'].keys()), ['sdc', 'sdd'])
+        self.assertEqual(tank['vdevs']['logs'], {'sdy1': {}})
+        self.assertEqual(tank.disks['sdc']['parent'], 'mirror-1')
+        self.assertEqual(tank.disks['sdc']['class'], 'data')
+        self.assertEqual(tank.disks['sdz1']['class'], 'cache')
+        self.assertEqual(tank.disks['sdx'].state, 'AVAIL')
+
+
+    def test_list(self):
+        pools = self.backend._parse_zpool_table(corpus_lines('zpool-list.txt'), tables['zpools'])
+        self.assertEqual(sorted(pools.keys()), ['tank', 'tank1'])
+        self.assertEqual(pools['tank']['health'], 'ONLINE')
+
+
+    def test_health(self):
+        # what --quick reads - with the columns named, as plain list -H has more of them on
+        # later versions (CKPOINT, EXPANDSZ, FRAG...) before HEALTH
+        pools = self.backend._parse_zpool_table(corpus_lines('zpool-list-health.txt'), tables['health'])
+        self.assertEqual(pools['tank'], {'name': 'tank', 'health': 'ONLINE'})
+        self.assertEqual(pools['tank1']['health'], 'DEGRADED')
+
+
+    def test_faulted_vdev(self):
+        self.assertEqual(self.check('zpool-status-faulted.txt'), Condition.ERROR)
+
+        tank = self.backend.details['tank']
+        self.assertEqual(tank['state'], 'DEGRADED')
+        # a status: line goes on over the tab indented lines after it
+        self.assertTrue(tank['status'].endswith('continue functioning in a degraded state.'))
+        self.assertEqual(sorted(tank['vdevs']['tank']['raidz2-0']['spare-2'].keys()), ['sdc', 'sdx'])
+        self.assertEqual(tank.disks['sdc']['parent'], 'spare-2')
+        self.assertEqual(tank.disks['sdc']['note'], 'too many errors')
+        # the spare shows up twice - in the raidz2 it stands in for, and under spares
+        self.assertEqual(tank.disks['sdx'].state, 'ONLINE')
+        self.assertEqual(tank.disks['sdx (spares)'].state, 'INUSE')
+
+        for message in ['zpool tank disk sdc is not ok with state FAULTED',
+                        'zpool tank disk sdc is not ok with write_errors 81',
+                        'zpool tank disk sdc is not ok with read_errors 3',
+                        'zpool tank disk sdd is not ok with checksum_errors 2',
+                        'zpool tank disk spare-2 is not ok with state DEGRADED',
+                        'zpool tank not ok with state DEGRADED']:
+            self.assertTrue(message in self.log.messages, message)
+        # an in use spare is fine
+        self.assertEqual([message for message in self.log.messages if 'spares' in message], [])
+
+
+    def test_unavailable_pool(self):
+        self.assertEqual(self.check('zpool-status-unavail.txt'), Condition.ERROR)
+
+        tank1 = self.backend.details['tank1']
+        self.assertEqual(tank1.disks['tank1']['note'], 'insufficient replicas')
+        for message in ['zpool tank1 disk sde is not ok with state UNAVAIL',
+                        'zpool tank1 disk sdf is not ok with state REMOVED',
+                        'zpool tank1 not ok with state UNAVAIL']:
+            self.assertTrue(message in self.log.messages, message)
+
+
+    def test_one_pool(self):
+        # zpool status tank - one pool picked out of the output
+        self.assertEqual(self.backend._parse_zpool_details(corpus_lines('zpool-status-faulted.txt'), 'tank')['state'],
+                         'DEGRADED')
+        self.assertEqual(self.backend._parse_zpool_details(corpus_lines('zpool-status-faulted.txt'), 'tank1'), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+## END OF LINE ##